@@ -0,0 +1,340 @@
+# webapp/api.py
+"""API REST em JSON (/api/v1) ao lado das rotas HTML.
+
+Nenhuma rota daqui renderiza o dashboard nem sonda o status real de todos
+os ambientes: as listagens vêm só do banco. Operações demoradas respondem
+202 com o id do job (acompanhe em /api/v1/jobs/<id>).
+"""
+import os
+import shlex
+import sqlite3
+import time
+
+from flask import Blueprint, jsonify, request
+
+import db
+import jobs
+import logindex
+import logtail
+import nodes
+import rootfs
+import snapshots
+
+bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Campos que podem ser pedidos em ?fields=
+ENV_FIELDS = ('id', 'name', 'cpu', 'mem', 'io', 'status', 'created_at',
+              'container_path', 'last_command', 'log_path', 'node')
+
+
+def _error(message, status):
+    return jsonify({"error": message}), status
+
+
+def _fields():
+    """Campos pedidos em ?fields=a,b (None = todos). Levanta ValueError se inválido."""
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in ENV_FIELDS]
+    if unknown:
+        raise ValueError(f"Campos desconhecidos: {', '.join(unknown)}")
+    return fields
+
+
+def _project(row, fields):
+    if fields is None:
+        return row
+    return {f: row.get(f) for f in fields}
+
+
+def _accepted(job_id, name, action, **extra):
+    resp = jsonify({"job_id": job_id, "name": name, "action": action,
+                    "job_url": f"{bp.url_prefix}/jobs/{job_id}", **extra})
+    resp.status_code = 202
+    resp.headers['Location'] = f"{bp.url_prefix}/jobs/{job_id}"
+    return resp
+
+
+def _require_env(name):
+    env = db.get_env(name)
+    if env is None:
+        return None, _error("Ambiente não encontrado", 404)
+    return env, None
+
+
+def _env_node(env):
+    try:
+        return nodes.SCHEDULER.for_env(env), None
+    except nodes.NodeError as e:
+        return None, _error(str(e), 503)
+
+
+# ------------------------------------------------------------ ambientes
+
+@bp.route('/environments')
+def list_environments():
+    try:
+        fields = _fields()
+    except ValueError as e:
+        return _error(str(e), 400)
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    status = request.args.get('status')
+
+    rows, total = db.list_envs_page(limit, offset, status)
+    return jsonify({
+        "items": [_project(r, fields) for r in rows],
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+    })
+
+
+@bp.route('/environments', methods=['POST'])
+def create_environment():
+    data = request.get_json(silent=True) or {}
+    try:
+        name = data['name']
+        cpu = int(data.get('cpu', 100))
+        mem = int(data.get('mem', 1024))
+        io = int(data.get('io', 10))
+        if not isinstance(name, str):
+            raise TypeError(name)
+    except (KeyError, TypeError, ValueError):
+        return _error("Informe 'name' e, opcionalmente, 'cpu', 'mem' e 'io' inteiros", 400)
+    image = data.get('image')
+    if image is not None and not isinstance(image, str):
+        return _error("'image' deve ser o nome de uma imagem", 400)
+
+    job_id, error, status = jobs.submit_create(name, cpu, mem, io, image)
+    if error:
+        return _error(error, status)
+    return _accepted(job_id, name, 'create')
+
+
+@bp.route('/environments/<name>')
+def get_environment(name):
+    try:
+        fields = _fields()
+    except ValueError as e:
+        return _error(str(e), 400)
+    env, error = _require_env(name)
+    if error:
+        return error
+    return jsonify(_project(env, fields))
+
+
+@bp.route('/environments/<name>', methods=['DELETE'])
+def destroy_environment(name):
+    env, error = _require_env(name)
+    if error:
+        return error
+    return _accepted(jobs.submit('destroy', name), name, 'destroy')
+
+
+@bp.route('/environments/<name>/stop', methods=['POST'])
+def stop_environment(name):
+    env, error = _require_env(name)
+    if error:
+        return error
+    if env['status'] in jobs.TRANSITIONAL:
+        return _error(f"Operação em andamento ({env['status']})", 409)
+    return _accepted(jobs.submit('halt', name), name, 'halt')
+
+
+@bp.route('/environments/<name>/resume', methods=['POST'])
+def resume_environment(name):
+    env, error = _require_env(name)
+    if error:
+        return error
+    if env['status'] in jobs.TRANSITIONAL:
+        return _error(f"Operação em andamento ({env['status']})", 409)
+    return _accepted(jobs.submit('resume', name), name, 'resume')
+
+
+@bp.route('/environments/<name>/exec', methods=['POST'])
+def exec_environment(name):
+    data = request.get_json(silent=True) or {}
+    command = data.get('command')
+    argv = data.get('argv')
+    background = bool(data.get('background'))
+    if argv is not None:
+        # argv roda direto, sem shell (só em foreground)
+        if (not isinstance(argv, list) or not argv or background
+                or not all(isinstance(a, str) for a in argv)):
+            return _error("'argv' deve ser uma lista de strings (sem background)", 400)
+        command = argv
+    elif not isinstance(command, str) or not command.strip():
+        return _error("Informe 'command' ou 'argv'", 400)
+    env, error = _require_env(name)
+    if error:
+        return error
+    node, error = _env_node(env)
+    if error:
+        return error
+
+    # Ambiente sem diretório ou parado: erro HTTP, não exit_code
+    try:
+        target_error = node.exec_target(name)
+    except nodes.NodeError as e:
+        return _error(str(e), 502)
+    if target_error:
+        return _error(target_error, 404 if target_error == "Ambiente não encontrado" else 409)
+
+    r, out, err = node.exec_in_env(name, command, background=background,
+                                   restart=data.get('restart', 'never'))
+
+    db.set_last_command(name, shlex.join(argv) if argv is not None else command)
+    return jsonify({"name": name, "exit_code": r, "stdout": out, "stderr": err, "background": background})
+
+
+@bp.route('/environments/<name>/logs')
+def environment_logs(name):
+    env, error = _require_env(name)
+    if error:
+        return error
+    node, error = _env_node(env)
+    if error:
+        return error
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    max_bytes = min(request.args.get('max_bytes', logtail.MAX_READ, type=int), logtail.MAX_READ)
+    if node.remote:
+        try:
+            data, next_offset, reset = node.read_log(name, offset, max_bytes)
+        except nodes.NodeError as e:
+            return _error(str(e), 502)
+    else:
+        lp = env['log_path']
+        if not lp or not os.path.exists(lp):
+            return _error("Log não encontrado", 404)
+        data, next_offset, reset = logtail.read_from(lp, offset, max_bytes)
+    return jsonify({
+        "name": name,
+        "data": data.decode('utf-8', errors='replace'),
+        "offset": next_offset,
+        "reset": reset,
+    })
+
+
+def _log_filters():
+    return {
+        "env": request.args.get('env') or None,
+        "kind": request.args.get('kind') or None,
+        "failed": request.args.get('failed') in ('1', 'true'),
+        "limit": min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT),
+    }
+
+
+@bp.route('/logs/search')
+def search_logs():
+    """Linhas de log de todos os ambientes com as palavras de ?q= (índice FTS)."""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return _error("Informe 'q'", 400)
+    start = time.perf_counter()
+    try:
+        items = logindex.INDEXER.search(query, **_log_filters())
+    except sqlite3.Error as e:
+        return _error(f"Índice de logs indisponível: {e}", 503)
+    return jsonify({"items": items, "took_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+
+@bp.route('/logs/commands')
+def search_commands():
+    """Comandos registrados nos logs (filtros: env, kind, failed, exit_code, q)."""
+    start = time.perf_counter()
+    try:
+        items = logindex.INDEXER.commands(exit_code=request.args.get('exit_code', type=int),
+                                          contains=request.args.get('q') or None, **_log_filters())
+    except sqlite3.Error as e:
+        return _error(f"Índice de logs indisponível: {e}", 503)
+    return jsonify({"items": items, "took_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+
+@bp.route('/environments/<name>/snapshots', methods=['POST'])
+def snapshot_environment(name):
+    env, error = _require_env(name)
+    if error:
+        return error
+    if env['status'] in jobs.TRANSITIONAL:
+        return _error(f"Operação em andamento ({env['status']})", 409)
+    job_id, snapshot_id = jobs.submit_snapshot(name)
+    return _accepted(job_id, name, 'snapshot', snapshot_id=snapshot_id,
+                     snapshot_url=f"{bp.url_prefix}/snapshots/{snapshot_id}")
+
+
+# ------------------------------------------------------------ snapshots
+
+@bp.route('/snapshots')
+def list_snapshots():
+    return jsonify({"items": snapshots.list_snapshots(env=request.args.get('env'))})
+
+
+@bp.route('/snapshots/<snapshot_id>')
+def get_snapshot(snapshot_id):
+    try:
+        return jsonify(snapshots.get(snapshot_id))
+    except snapshots.SnapshotError as e:
+        return _error(str(e), 404)
+
+
+@bp.route('/snapshots/<snapshot_id>', methods=['DELETE'])
+def delete_snapshot(snapshot_id):
+    try:
+        snapshots.get(snapshot_id)
+    except snapshots.SnapshotError as e:
+        return _error(str(e), 404)
+    try:
+        snapshots.delete(snapshot_id)
+    except snapshots.SnapshotError as e:
+        return _error(str(e), 409)
+    return '', 204
+
+
+@bp.route('/snapshots/<snapshot_id>/clone', methods=['POST'])
+def clone_snapshot(snapshot_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        name = data['name']
+        limits = {k: int(data[k]) if data.get(k) is not None else None for k in ('cpu', 'mem', 'io')}
+        if not isinstance(name, str):
+            raise TypeError(name)
+    except (KeyError, TypeError, ValueError):
+        return _error("Informe 'name' e, opcionalmente, 'cpu', 'mem' e 'io' inteiros", 400)
+
+    job_id, error, status = jobs.submit_clone(name, snapshot_id, **limits)
+    if error:
+        return _error(error, status)
+    return _accepted(job_id, name, 'clone')
+
+
+@bp.route('/images')
+def list_images():
+    return jsonify({"items": rootfs.list_images(), "default": rootfs.DEFAULT_IMAGE or None})
+
+
+# ----------------------------------------------------------------- jobs
+
+@bp.route('/nodes')
+def list_nodes():
+    return jsonify(nodes.SCHEDULER.stats())
+
+
+@bp.route('/jobs')
+def list_jobs():
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    return jsonify({"items": jobs.list_jobs(name=request.args.get('env'), limit=limit)})
+
+
+@bp.route('/jobs/<int:job_id>')
+def get_job(job_id):
+    job = jobs.get_job(job_id)
+    if not job:
+        return _error("Job não encontrado", 404)
+    return jsonify(job)
@@ -1,33 +1,101 @@
 # webapp/app.py
-from flask import Flask, render_template, request, redirect, url_for, send_file
-from db import get_db
-from manage_env import create_env, status_env, exec_in_env, halt_env, destroy_env, resume_env
+from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, Response, stream_with_context, g
+import db
+import api
+from manage_env import exec_batch, EXEC_TIMEOUT, EXEC_MAX_OUTPUT, ENVS_DIR
+import manage_env
+import nodes
+from metrics import LATENCY
+from ledger import LEDGER
+import envpool
+import fanout
+import jobs
+import logindex
+import logtail
+import pagecache
+import reconciler
+import rootfs
+import telemetry
+import tracing
+import functools
+import json
 import os
+import signal
 
 app = Flask(__name__)
+# Uma conexão do pool por requisição, devolvida no teardown
+db.init_app(app)
+# API JSON (/api/v1) para clientes automatizados
+app.register_blueprint(api.bp)
+
+# Pool de namespaces pré-iniciados (CLOUDENV_POOL_SIZE=0 desativa)
+envpool.POOL.start()
+# Amostragem periódica do uso real (cgroups) de cada ambiente
+telemetry.COLLECTOR.start()
+# Status do banco alinhado com o host (CLOUDENV_RECONCILE_INTERVAL=0 desliga)
+reconciler.RECONCILER.start()
+# Índice de busca dos logs (CLOUDENV_LOG_INDEX_INTERVAL=0 desliga)
+logindex.INDEXER.start()
+
+# Paginação do dashboard
+DASHBOARD_PAGE_SIZE = int(os.environ.get("CLOUDENV_DASHBOARD_PAGE_SIZE", 50))
+DASHBOARD_MAX_PAGE_SIZE = 200
+STATUS_FILTERS = ('running', 'stopped', 'creating', 'stopping', 'destroying', 'error')
 
 @app.route('/')
 def index():
-    db = get_db()
-    cur = db.cursor(dictionary=True)
-    cur.execute("SELECT * FROM environments ORDER BY created_at DESC")
-    envs = cur.fetchall()
-    
-    # Atualizar status real de cada ambiente
-    for env in envs:
-        real_status = status_env(env['name'])
-        if real_status != env['status'] and real_status != 'not_found':
-            # Atualizar no banco se o status mudou
-            cur2 = db.cursor()
-            cur2.execute("UPDATE environments SET status=%s WHERE name=%s", 
-                        (real_status, env['name']))
-            db.commit()
-            cur2.close()
-            env['status'] = real_status
-    
-    cur.close()
-    db.close()
-    return render_template('index.html', envs=envs)
+    status = request.args.get('status') or None
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', DASHBOARD_PAGE_SIZE, type=int), 1), DASHBOARD_MAX_PAGE_SIZE)
+    key = (status, page, per_page)
+    
+    cached = pagecache.DASHBOARD.get(key)
+    if cached:
+        html, etag, last_modified = cached
+    else:
+        generation = pagecache.DASHBOARD.generation
+        # Os status já vêm corrigidos pelo reconciliador: nada de sondar o host aqui
+        envs, total = db.list_envs_page(per_page, (page - 1) * per_page, status)
+        
+        pages = max((total + per_page - 1) // per_page, 1)
+        html = render_template('index.html', envs=envs, total=total, page=page, pages=pages,
+                               per_page=per_page, status=status, statuses=STATUS_FILTERS,
+                               images=rootfs.list_images(), default_image=rootfs.DEFAULT_IMAGE)
+        etag, last_modified = pagecache.DASHBOARD.put(key, html, generation)
+    
+    resp = Response(html, mimetype='text/html')
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    # O navegador sempre revalida; sem mudanças a resposta é um 304 vazio
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
+
+@app.before_request
+def begin_trace():
+    # Spans agregados pela regra da rota (/exec/<name>), não pela URL
+    g.trace = tracing.begin(request.url_rule.rule if request.url_rule else "(sem rota)")
+    if request.args.get('profile') == '1' or request.headers.get('X-Cloudenv-Profile') == '1':
+        g.profiler = tracing.start_profile()
+
+@app.after_request
+def finish_profile(resp):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        resp.headers['X-Cloudenv-Profile-Id'] = str(tracing.stop_profile(profiler, f"{request.method} {request.path}"))
+    return resp
+
+@app.teardown_request
+def finish_trace(exc=None):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracing.finish(trace, "cloudenv_request_seconds", (("route", trace.name), ("method", request.method)))
+
+@app.after_request
+def invalidate_dashboard(resp):
+    # Qualquer rota que altera estado (form HTML ou API) invalida o dashboard
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        pagecache.DASHBOARD.invalidate()
+    return resp
 
 @app.route('/create', methods=['POST'])
 def create():
@@ -35,119 +103,435 @@ def create():
     cpu_percent = int(request.form['cpu'])  # ✅ CORRIGIDO: renomeado para cpu_percent
     mem = int(request.form['mem'])
     io = int(request.form.get('io', 10))
+    image = request.form.get('image')  # '' = raiz do host
     
     # Verificar se já existe
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("SELECT name FROM environments WHERE name=%s", (name,))
-    if cur.fetchone():
-        cur.close()
-        db.close()
+    if db.env_exists(name):
         return redirect(url_for('index'))
     
-    cur.execute(
-        "INSERT INTO environments (name, cpu, mem, io, status) VALUES (%s,%s,%s,%s,%s)",
-        (name, cpu_percent, mem, io, 'creating')  # ✅ Salva a porcentagem no banco
-    )
-    db.commit()
-    cur.close()
-    db.close()
-    
-    # Criar ambiente - ✅ CORRIGIDO: passa cpu_percent
-    try:
-        r, out, err, path = create_env(name, cpu_percent=cpu_percent, mem=mem, io=io)
-        status = 'running' if r == 0 else 'error'
-    except Exception as e:
-        print(f"Erro ao criar ambiente: {e}")
-        r, out, err, path = 1, "", str(e), None
-        status = 'error'
-    
-    db = get_db()
-    cur = db.cursor()
-    log_path = os.path.join("/vagrant/environments", name, "logs", f"{name}.log")
-    cur.execute(
-        "UPDATE environments SET status=%s, container_path=%s, log_path=%s WHERE name=%s",
-        (status, path if r == 0 else None, log_path, name)
-    )
-    db.commit()
-    cur.close()
-    db.close()
+    # Criar ambiente em background - o worker atualiza o status
+    job_id, error, status = jobs.submit_create(name, cpu_percent, mem, io, image)
+    if error:
+        return error, status
     
     return redirect(url_for('index'))
 
+def _env_node(name):
+    """Nó dono do ambiente, ou (None, resposta de erro) se ele não está configurado."""
+    try:
+        return nodes.SCHEDULER.for_name(name), None
+    except nodes.NodeError as e:
+        return None, (str(e), 503)
+
+def _local_env(view):
+    """Rotas que leem o diretório do ambiente: só ambientes do nó local."""
+    @functools.wraps(view)
+    def wrapper(name, *args, **kwargs):
+        node, error = _env_node(name)
+        if error:
+            return error
+        if node.remote:
+            return f"Disponível só para ambientes do nó local ({name} está em {node.name})", 409
+        return view(name, *args, **kwargs)
+    return wrapper
+
 @app.route('/exec/<name>', methods=['POST'])
 def execcmd(name):
     cmd = request.form['command']
     bg = request.form.get('background') == '1'
+    restart = request.form.get('restart', 'never')
     
-    r, out, err = exec_in_env(name, cmd, background=bg)
+    node, error = _env_node(name)
+    if error:
+        return error
+    r, out, err = node.exec_in_env(name, cmd, background=bg, restart=restart)
     
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("UPDATE environments SET last_command=%s WHERE name=%s", (cmd, name))
-    db.commit()
-    cur.close()
-    db.close()
+    db.set_last_command(name, cmd)
     
     return redirect(url_for('index'))
 
-@app.route('/logs/<name>')
-def logs(name):
-    db = get_db()
-    cur = db.cursor(dictionary=True)
-    cur.execute("SELECT log_path FROM environments WHERE name=%s", (name,))
-    row = cur.fetchone()
-    cur.close()
-    db.close()
+def _clamp(requested, configured):
+    """O cliente pode pedir limites menores que os configurados, nunca maiores (0 = sem limite)."""
+    if not requested or requested <= 0:
+        return configured
+    return min(requested, configured) if configured else requested
+
+def _batch_commands(data):
+    """Lista de comandos do corpo JSON: "commands" ou um "script" único."""
+    if data.get('script'):
+        return [data['script']]
+    commands = data.get('commands') or []
+    if not isinstance(commands, list) or not all(isinstance(c, str) and c.strip() for c in commands):
+        return None
+    return commands
+
+def _batch_options(data):
+    """(opções do exec_batch, erro) a partir de 'parallel', 'timeout' e 'stop_on_error'."""
+    try:
+        parallel = int(data.get('parallel', 1))
+        timeout = float(data.get('timeout') or 0)
+    except (TypeError, ValueError):
+        return None, "'parallel' deve ser inteiro e 'timeout' um número de segundos"
+    return {
+        "parallel": parallel,
+        "timeout": _clamp(timeout, EXEC_TIMEOUT),
+        "stop_on_error": bool(data.get('stop_on_error')),
+    }, None
+
+def _run_batch(name, commands, options):
+    node, error = _env_node(name)
+    if error:
+        return error[0], None
+    if node.remote:
+        return f"Batches só em ambientes do nó local ({name} está em {node.name})", None
+    return exec_batch(name, commands, **options)
+
+@app.route('/exec/<name>/batch', methods=['POST'])
+def execbatch(name):
+    data = request.get_json(silent=True) or {}
+    commands = _batch_commands(data)
+    if not commands:
+        return jsonify({"error": "Informe 'commands' (lista de strings) ou 'script'"}), 400
+    options, error = _batch_options(data)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    error, result = _run_batch(name, commands, options)
+    if error:
+        return jsonify({"error": error}), 409
+    db.set_last_command(name, commands[-1])
+    return jsonify(result)
+
+@app.route('/exec/batch', methods=['POST'])
+def execbatch_targets():
+    data = request.get_json(silent=True) or {}
+    commands = _batch_commands(data)
+    targets = data.get('targets') or []
+    if not commands or not isinstance(targets, list) or not targets:
+        return jsonify({"error": "Informe 'targets' e 'commands' (ou 'script')"}), 400
+    options, error = _batch_options(data)
+    if error:
+        return jsonify({"error": error}), 400
+    # Os nomes viram caminhos em ENVS_DIR: só ambientes de verdade (nada de .pool/ ou ../)
+    if not all(isinstance(n, str) and jobs.NAME_RE.match(n) for n in targets):
+        return jsonify({"error": "'targets' deve ser uma lista de nomes de ambiente"}), 400
+    missing = sorted(set(targets) - db.existing_envs(targets))
+    if missing:
+        return jsonify({"error": f"Ambientes não encontrados: {', '.join(missing)}"}), 404
+    
+    results = {}
+    for name in targets:
+        error, result = _run_batch(name, commands, options)
+        results[name] = {"error": error} if error else result
+    # Um único UPDATE para todos os ambientes onde o batch rodou
+    db.set_last_command_many([n for n in targets if 'error' not in results[n]], commands[-1])
+    return jsonify(results)
+
+@app.route('/exec/fanout', methods=['POST'])
+def execfanout():
+    data = request.get_json(silent=True) or {}
+    command = data.get('command')
+    if not isinstance(command, str) or not command.strip():
+        return jsonify({"error": "Informe 'command'"}), 400
+    try:
+        width = int(data.get('width', 4))
+        timeout = _clamp(float(data.get('timeout') or 0), EXEC_TIMEOUT)
+    except (TypeError, ValueError):
+        return jsonify({"error": "'width' deve ser inteiro e 'timeout' um número de segundos"}), 400
+    
+    names = data.get('names')
+    if names is not None and not (isinstance(names, list)
+                                  and all(isinstance(n, str) and jobs.NAME_RE.match(n) for n in names)):
+        return jsonify({"error": "'names' deve ser uma lista de nomes de ambiente"}), 400
+    if not isinstance(data.get('pattern') or "", str):
+        return jsonify({"error": "'pattern' deve ser um padrão de nome (fnmatch)"}), 400
+    
+    targets = fanout.select_targets(
+        pattern=data.get('pattern'),
+        status=data.get('status', 'running'),
+        names=names,
+    )
+    if not targets:
+        return jsonify({"error": "Nenhum ambiente selecionado"}), 404
     
+    db.release_request_db()
+    
+    def results():
+        finished = []
+        for result in fanout.run(targets, command, width=width, timeout=timeout):
+            if 'exit_code' in result:
+                finished.append(result['name'])
+            yield json.dumps(result) + "\n"
+        # Um único UPDATE para todos os alvos onde o comando rodou
+        db.set_last_command_many(finished, command)
+    
+    # NDJSON: uma linha por ambiente, na ordem em que terminam
+    resp = Response(results(), mimetype='application/x-ndjson')
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.headers['X-Fanout-Targets'] = str(len(targets))
+    return resp
+
+@app.route('/exec/<name>/batches/<batch_id>/<int:index>')
+@_local_env
+def batch_output(name, batch_id, index):
+    if not batch_id.isalnum():
+        return "Batch inválido", 400
+    output = ENVS_DIR / name / "batches" / batch_id / f"{index}.out"
+    if not output.exists():
+        return "Saída não encontrada", 404
+    return send_file(output, mimetype='text/plain', conditional=True)
+
+@app.route('/exec/<name>/stream', methods=['POST'])
+def execcmd_stream(name):
+    cmd = request.form['command']
+    timeout = _clamp(request.form.get('timeout', type=float), EXEC_TIMEOUT)
+    max_bytes = _clamp(request.form.get('max_bytes', type=int), EXEC_MAX_OUTPUT)
+    
+    node, error = _env_node(name)
+    if error:
+        return error
+    db.set_last_command(name, cmd)
+    # A saída pode demorar: devolver a conexão ao pool antes do stream
+    db.release_request_db()
+    
+    # Resposta chunked: cada pedaço da saída é enviado assim que chega
+    resp = Response(node.exec_stream(name, cmd, timeout=timeout, max_bytes=max_bytes), mimetype='text/plain')
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+def _supervisor_response(resp):
+    if not resp["ok"]:
+        status = 404 if "não encontrado" in resp["error"] else 409
+        return jsonify({"error": resp["error"]}), status
+    return jsonify(resp.get("job") or resp.get("jobs"))
+
+@app.route('/exec/<name>/jobs')
+@_local_env
+def bg_jobs(name):
+    return _supervisor_response(manage_env.list_jobs(name))
+
+@app.route('/exec/<name>/jobs/<int:job_id>')
+@_local_env
+def bg_job(name, job_id):
+    return _supervisor_response(manage_env.supervisor_call(name, "get", id=job_id))
+
+@app.route('/exec/<name>/jobs/<int:job_id>/kill', methods=['POST'])
+@_local_env
+def bg_job_kill(name, job_id):
+    sig = request.form.get('sig', int(signal.SIGTERM), type=int)
+    return _supervisor_response(manage_env.kill_job(name, job_id, sig))
+
+@app.route('/exec/<name>/jobs/<int:job_id>/wait')
+@_local_env
+def bg_job_wait(name, job_id):
+    timeout = min(request.args.get('timeout', 30, type=float), 300)
+    return _supervisor_response(manage_env.wait_job(name, job_id, timeout))
+
+@app.route('/exec/<name>/jobs/<int:job_id>/output')
+@_local_env
+def bg_job_output(name, job_id):
+    output = ENVS_DIR / name / "jobs" / str(job_id) / "output.log"
+    if not output.exists():
+        return "Saída não encontrada", 404
+    return send_file(output, mimetype='text/plain', conditional=True)
+
+def _log_path(name):
+    """Caminho do log do ambiente, ou (None, resposta de erro)."""
+    row = db.fetch_one('get_log_path', (name,))
     if not row:
-        return "Ambiente não encontrado", 404
+        return None, ("Ambiente não encontrado", 404)
     
     lp = row['log_path']
     if not lp or not os.path.exists(lp):
-        return "Log não encontrado. O ambiente pode não ter sido criado corretamente.", 404
+        return None, ("Log não encontrado. O ambiente pode não ter sido criado corretamente.", 404)
+    return lp, None
+
+def _remote_log(node, name):
+    """/logs/<name> de um ambiente remoto: o arquivo está no host do nó."""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    max_bytes = min(request.args.get('max_bytes', logtail.MAX_READ, type=int), logtail.MAX_READ)
+    try:
+        data, next_offset, reset = node.read_log(name, offset, max_bytes)
+    except nodes.NodeError as e:
+        return str(e), 502
+    
+    if 'offset' not in request.args:
+        # Arquivo inteiro: os pedaços seguintes vêm enquanto a resposta é enviada
+        def chunks(data, next_offset):
+            while data:
+                yield data
+                try:
+                    data, next_offset, _ = node.read_log(name, next_offset)
+                except nodes.NodeError:
+                    return
+        return Response(chunks(data, next_offset), mimetype='text/plain')
     
-    return send_file(lp, mimetype='text/plain')
+    resp = Response(data, mimetype='text/plain')
+    resp.headers['X-Log-Offset'] = str(next_offset)
+    if reset:
+        resp.headers['X-Log-Reset'] = '1'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
-@app.route('/stop/<name>', methods=['POST'])
-def stop(name):
-    halt_env(name)
+@app.route('/logs/<name>')
+def logs(name):
+    node, error = _env_node(name)
+    if error:
+        return error
+    if node.remote:
+        return _remote_log(node, name)
+    
+    lp, error = _log_path(name)
+    if error:
+        return error
+    
+    # Tail incremental: ?offset=N devolve só os bytes novos e o próximo offset
+    if 'offset' in request.args:
+        offset = request.args.get('offset', 0, type=int)
+        max_bytes = min(request.args.get('max_bytes', logtail.MAX_READ, type=int), logtail.MAX_READ)
+        data, next_offset, reset = logtail.read_from(lp, max(offset, 0), max_bytes)
+        resp = Response(data, mimetype='text/plain')
+        resp.headers['X-Log-Offset'] = str(next_offset)
+        if reset:
+            resp.headers['X-Log-Reset'] = '1'
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
+    
+    # conditional=True: suporte a Range (206), ETag e If-Modified-Since
+    return send_file(lp, mimetype='text/plain', conditional=True)
+
+@app.route('/logs/<name>/follow')
+def logs_follow(name):
+    node, error = _env_node(name)
+    if error:
+        return error
+    if node.remote:
+        # Sem inotify à distância: o nó é consultado a cada segundo
+        follow = functools.partial(node.follow_log, name)
+    else:
+        lp, error = _log_path(name)
+        follow = functools.partial(logtail.follow, lp)
+    # O stream pode durar minutos: devolver a conexão ao pool já
+    db.release_request_db()
+    if error:
+        return error
+    
+    # EventSource reenvia o último id recebido ao reconectar
+    offset = request.headers.get('Last-Event-ID', type=int)
+    if offset is None:
+        offset = request.args.get('offset', 0, type=int)
     
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("UPDATE environments SET status=%s WHERE name=%s", ("stopped", name))
-    db.commit()
-    cur.close()
-    db.close()
+    def events():
+        for next_offset, data in follow(max(offset, 0)):
+            if data is None:
+                yield ": ping\n\n"
+            elif not data:
+                yield "id: 0\nevent: reset\ndata: \n\n"
+            else:
+                text = data.decode('utf-8', errors='replace')
+                if text.endswith("\n"):
+                    text = text[:-1]
+                lines = "".join(f"data: {line}\n" for line in text.split("\n"))
+                yield f"id: {next_offset}\n{lines}\n"
     
+    resp = Response(stream_with_context(events()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+@app.route('/stop/<name>', methods=['POST'])
+def stop(name):
+    jobs.submit('halt', name)
     return redirect(url_for('index'))
 
 @app.route('/resume/<name>', methods=['POST'])
 def resume(name):
-    r, out, err = resume_env(name)
-    
-    db = get_db()
-    cur = db.cursor()
-    status = 'running' if r == 0 else 'error'
-    cur.execute("UPDATE environments SET status=%s WHERE name=%s", (status, name))
-    db.commit()
-    cur.close()
-    db.close()
-    
+    jobs.submit('resume', name)
     return redirect(url_for('index'))
 
 @app.route('/destroy/<name>', methods=['POST'])
 def destroy(name):
-    destroy_env(name)
-    
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("DELETE FROM environments WHERE name=%s", (name,))
-    db.commit()
-    cur.close()
-    db.close()
-    
+    jobs.submit('destroy', name)
     return redirect(url_for('index'))
 
+@app.route('/jobs')
+def list_jobs():
+    return jsonify(jobs.list_jobs(name=request.args.get('env')))
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job)
+
+@app.route('/stats/latency')
+def latency_stats():
+    # Percentis de create/halt medidos neste processo
+    return jsonify(LATENCY.snapshot())
+
+@app.route('/stats/traces')
+def trace_stats():
+    # Tempo médio por rota/job e quanto dele foi em cada span (cmd, helper, db, fases)
+    return jsonify(tracing.routes())
+
+@app.route('/stats/profiles')
+def profile_list():
+    return jsonify({"enabled": tracing.PROFILING, "profiles": tracing.profiles()})
+
+@app.route('/stats/profiles/<int:profile_id>')
+def profile_report(profile_id):
+    profile = tracing.get_profile(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile não encontrado"}), 404
+    return Response(profile["report"], mimetype='text/plain')
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Formato texto do Prometheus; contadores e histogramas deste processo
+    return Response(tracing.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/dashboard')
+def dashboard_stats():
+    # Acertos/erros do cache de páginas do dashboard neste processo
+    return jsonify(pagecache.DASHBOARD.stats())
+
+@app.route('/stats/reconciler')
+def reconciler_stats():
+    # Passadas e contadores (status corrigidos, órfãos removidos) deste processo
+    return jsonify(reconciler.RECONCILER.stats())
+
+@app.route('/stats/logindex')
+def logindex_stats():
+    return jsonify(logindex.INDEXER.stats())
+
+@app.route('/telemetry')
+def telemetry_all():
+    return jsonify({
+        "collector": telemetry.COLLECTOR.stats(),
+        "environments": telemetry.COLLECTOR.latest(),
+    })
+
+@app.route('/telemetry/<name>')
+def telemetry_env(name):
+    history = telemetry.COLLECTOR.history(name, request.args.get('limit', type=int))
+    if history is None:
+        return jsonify({"error": "Sem telemetria para este ambiente"}), 404
+    return jsonify({"name": name, "interval": telemetry.COLLECTOR.interval, "history": history})
+
+@app.route('/capacity')
+def capacity():
+    return jsonify(LEDGER.stats())
+
+@app.route('/stats/nodes')
+def node_stats():
+    return jsonify(nodes.SCHEDULER.stats())
+
+@app.route('/pool')
+def pool_stats():
+    return jsonify(envpool.POOL.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,80 @@
+# webapp/bench_db.py
+"""Mede req/s de GET / e POST /create com e sem pool de conexões.
+
+Usa o test client do Flask contra o MySQL real; os jobs não são executados
+(só a parte de banco das rotas é medida). Os registros criados (benchdb_*)
+são apagados ao final.
+
+Uso (dentro da VM):
+    python3 bench_db.py [requisições por thread] [threads]
+"""
+import itertools
+import sys
+import threading
+import time
+
+import db
+import jobs
+from app import app
+
+PREFIX = "benchdb_"
+
+
+def _worker(method, count, counter, errors):
+    client = app.test_client()
+    for _ in range(count):
+        if method == 'index':
+            resp = client.get('/')
+        else:
+            name = f"{PREFIX}{next(counter)}"
+            resp = client.post('/create', data={'name': name, 'cpu': 10, 'mem': 64, 'io': 1})
+        if resp.status_code >= 400:
+            errors.append(resp.status_code)
+
+
+def run(method, pool_size, count, threads):
+    db.POOL_SIZE = pool_size
+    db._pool = None
+    counter = itertools.count(pool_size * 100000)
+    errors = []
+    workers = [threading.Thread(target=_worker, args=(method, count, counter, errors)) for _ in range(threads)]
+
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return count * threads / elapsed, len(errors)
+
+
+def cleanup():
+    conn = db.get_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM jobs WHERE env_name LIKE %s", (PREFIX + "%",))
+    cur.execute("DELETE FROM environments WHERE name LIKE %s", (PREFIX + "%",))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    pool_size = db.POOL_SIZE or 8
+
+    # Só o registro do job no banco: nada de criar namespaces de verdade
+    jobs._executor.submit = lambda *args, **kwargs: None
+
+    print(f"{'rota':<10}{'modo':<12}{'req/s':>10}{'erros':>8}")
+    try:
+        for method in ('index', 'create'):
+            for mode, size in (("sem pool", 0), ("pool", pool_size)):
+                rate, failures = run(method, size, count, threads)
+                print(f"{method:<10}{mode:<12}{rate:>10.1f}{failures:>8}")
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# webapp/bench_helper.py
+"""Compara a latência de create/exec/halt via sudo e via helper privilegiado.
+
+Uso (dentro da VM, como www-data, com o cloudenv-helper rodando):
+    sudo -u www-data python3 bench_helper.py [repetições]
+"""
+import statistics
+import sys
+import time
+
+import manage_env
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_mode(use_helper, rounds):
+    manage_env.USE_HELPER = use_helper
+    name = f"bench_{'helper' if use_helper else 'sudo'}"
+    times = {"create": [], "exec": [], "halt": []}
+
+    for _ in range(rounds):
+        times["create"].append(_timed(manage_env.create_env, name, cpu_percent=50, mem=256, io=10))
+        times["exec"].append(_timed(manage_env.exec_in_env, name, "echo bench"))
+        times["halt"].append(_timed(manage_env.halt_env, name))
+
+    manage_env.destroy_env(name)
+    return times
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    if not manage_env.helper_available():
+        print(f"✗ Helper não encontrado em {manage_env.HELPER_SOCK}")
+        sys.exit(1)
+
+    results = {"sudo": run_mode(False, rounds), "helper": run_mode(True, rounds)}
+
+    print(f"{'operação':<10}{'modo':<10}{'média (ms)':>12}{'mediana (ms)':>14}{'máx (ms)':>12}")
+    for op in ("create", "exec", "halt"):
+        for mode, times in results.items():
+            values = times[op]
+            print(f"{op:<10}{mode:<10}{statistics.mean(values):>12.1f}"
+                  f"{statistics.median(values):>14.1f}{max(values):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+# webapp/bench_lifecycle.py
+"""Benchmark de carga do ciclo de vida dos ambientes.
+
+Roda N ciclos create -> exec -> halt -> destroy com C em paralelo:
+
+- engine: direto nas funções do manage_env;
+- app: pelas rotas da API (/api/v1) com o test client do Flask, esperando
+  cada job terminar (mede a rota e o job de ponta a ponta).
+
+Para cada operação mostra p50/p95/p99, e para a rodada a vazão (ciclos/s),
+os subprocessos criados por este processo (por programa) e as chamadas ao
+helper privilegiado (por operação). Com --output o resultado vai para um
+JSON, e --compare mostra a diferença para uma rodada anterior.
+
+Com --sqlite o MySQL é trocado por um SQLite local (CLOUDENV_DB_SQLITE), e
+CLOUDENV_ENVS_DIR aponta os ambientes para outro diretório.
+
+Uso (dentro da VM, com o cloudenv-helper rodando):
+    python3 bench_lifecycle.py -n 20 -c 4 --mode both --output run.json
+    python3 bench_lifecycle.py -n 20 -c 4 --sqlite /tmp/bench.db --compare run.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+OPS = {
+    "engine": ("create", "exec", "halt", "destroy"),
+    "app": ("create", "create_job", "exec", "halt", "halt_job", "destroy", "destroy_job", "list"),
+}
+JOB_POLL = 0.05
+JOB_TIMEOUT = 120
+
+
+class Recorder:
+    """Latências e erros por operação, mais a contagem de processos."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = Counter()
+        self.last_errors = {}
+        self.subprocesses = Counter()
+        self.helper_calls = Counter()
+        self._lock = threading.Lock()
+
+    def timed(self, op, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.fail(op, e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.samples.setdefault(op, []).append(elapsed)
+        return result
+
+    def record(self, op, seconds):
+        with self._lock:
+            self.samples.setdefault(op, []).append(seconds)
+
+    def fail(self, op, message=None):
+        with self._lock:
+            self.errors[op] += 1
+            if message:
+                self.last_errors[op] = str(message).strip()[:200]
+
+    def summary(self, ops):
+        from metrics import percentile
+        result = {}
+        for op in ops:
+            values = sorted(self.samples.get(op, ()))
+            entry = {"count": len(values), "errors": self.errors[op]}
+            if op in self.last_errors:
+                entry["last_error"] = self.last_errors[op]
+            if values:
+                entry.update({
+                    "p50_ms": round(percentile(values, 50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 99) * 1000, 2),
+                    "max_ms": round(values[-1] * 1000, 2),
+                    "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                })
+            result[op] = entry
+        return result
+
+
+def _count_processes(recorder):
+    """Conta os subprocessos e as chamadas ao helper durante a rodada."""
+    import manage_env
+
+    original_popen_init = subprocess.Popen.__init__
+    original_helper_call = manage_env.helper_call
+
+    def popen_init(self, args, *a, **kw):
+        argv = [args] if isinstance(args, (str, bytes)) else list(args)
+        program = os.path.basename(str(argv[0])) if argv else "?"
+        if program == "sudo" and len(argv) > 1:
+            program = f"sudo {os.path.basename(str(argv[1]))}"
+        with recorder._lock:
+            recorder.subprocesses[program] += 1
+        original_popen_init(self, args, *a, **kw)
+
+    def helper_call(op, *a, **kw):
+        with recorder._lock:
+            recorder.helper_calls[op] += 1
+        return original_helper_call(op, *a, **kw)
+
+    subprocess.Popen.__init__ = popen_init
+    manage_env.helper_call = helper_call
+
+    def restore():
+        subprocess.Popen.__init__ = original_popen_init
+        manage_env.helper_call = original_helper_call
+    return restore
+
+
+# ---------------------------------------------------------------- engine
+
+def _engine_lifecycle(recorder, name, args):
+    import manage_env
+
+    r, _, err, _ = recorder.timed("create", manage_env.create_env, name,
+                                  cpu_percent=args.cpu, mem=args.mem, io=args.io)
+    if r != 0:
+        recorder.fail("create", err)
+        manage_env.destroy_env(name)
+        return False
+    try:
+        r, _, err = recorder.timed("exec", manage_env.exec_in_env, name, args.command)
+        if r != 0:
+            recorder.fail("exec", err)
+        r, _, err = recorder.timed("halt", manage_env.halt_env, name)
+        if r != 0:
+            recorder.fail("halt", err)
+    finally:
+        r, _, err = recorder.timed("destroy", manage_env.destroy_env, name)
+        if r != 0:
+            recorder.fail("destroy", err)
+    return True
+
+
+# ------------------------------------------------------------------- app
+
+def _wait_job(client, job_id):
+    """Espera o job terminar. Retorna (ok, mensagem)."""
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/v1/jobs/{job_id}").get_json()
+        if job and job.get("status") in ("done", "error"):
+            return job["status"] == "done", job.get("message")
+        time.sleep(JOB_POLL)
+    return False, f"job {job_id} não terminou em {JOB_TIMEOUT} s"
+
+
+def _route(recorder, op, call, expected):
+    resp = recorder.timed(op, call)
+    if resp.status_code != expected:
+        body = resp.get_json(silent=True) or {}
+        recorder.fail(op, body.get("error") or f"HTTP {resp.status_code}")
+        return None
+    return resp.get_json(silent=True) or {}
+
+
+def _job(recorder, op, client, job_id, started):
+    ok, message = _wait_job(client, job_id)
+    recorder.record(op, time.perf_counter() - started)
+    if not ok:
+        recorder.fail(op, message)
+    return ok
+
+
+def _app_lifecycle(recorder, name, args, app):
+    client = app.test_client()
+    base = f"/api/v1/environments/{name}"
+
+    started = time.perf_counter()
+    body = _route(recorder, "create", lambda: client.post("/api/v1/environments", json={
+        "name": name, "cpu": args.cpu, "mem": args.mem, "io": args.io}), 202)
+    if body is None:
+        return False
+    if not _job(recorder, "create_job", client, body["job_id"], started):
+        client.delete(base)
+        return False
+
+    _route(recorder, "exec", lambda: client.post(f"{base}/exec", json={"command": args.command}), 200)
+    _route(recorder, "list", lambda: client.get("/api/v1/environments?limit=50"), 200)
+
+    started = time.perf_counter()
+    body = _route(recorder, "halt", lambda: client.post(f"{base}/stop"), 202)
+    if body is not None:
+        _job(recorder, "halt_job", client, body["job_id"], started)
+
+    started = time.perf_counter()
+    body = _route(recorder, "destroy", lambda: client.delete(base), 202)
+    if body is not None:
+        _job(recorder, "destroy_job", client, body["job_id"], started)
+    return True
+
+
+# ---------------------------------------------------------------- rodada
+
+def run(mode, args):
+    recorder = Recorder()
+    prefix = f"benchlc{os.getpid()}{mode[0]}"
+    names = [f"{prefix}{i}" for i in range(args.lifecycles)]
+
+    if mode == "app":
+        from app import app
+        lifecycle = lambda name: _app_lifecycle(recorder, name, args, app)
+    else:
+        lifecycle = lambda name: _engine_lifecycle(recorder, name, args)
+
+    restore = _count_processes(recorder)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            completed = sum(1 for ok in executor.map(lifecycle, names) if ok)
+    finally:
+        elapsed = time.perf_counter() - start
+        restore()
+
+    return {
+        "lifecycles": args.lifecycles,
+        "completed": completed,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(completed / elapsed, 3) if elapsed else None,
+        "ops": recorder.summary(OPS[mode]),
+        "subprocesses": dict(recorder.subprocesses.most_common()),
+        "subprocesses_per_lifecycle": round(sum(recorder.subprocesses.values()) / max(args.lifecycles, 1), 2),
+        "helper_calls": dict(recorder.helper_calls.most_common()),
+    }
+
+
+def _git_rev():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _print_run(mode, result):
+    print(f"\n[{mode}] {result['completed']}/{result['lifecycles']} ciclos em {result['elapsed_s']} s "
+          f"({result['throughput_per_s']} ciclos/s, concorrência {result['concurrency']})")
+    print(f"{'operação':<14}{'n':>6}{'erros':>7}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}{'máx (ms)':>11}")
+    for op, s in result["ops"].items():
+        if not s["count"]:
+            continue
+        print(f"{op:<14}{s['count']:>6}{s['errors']:>7}{s['p50_ms']:>11.1f}{s['p95_ms']:>11.1f}"
+              f"{s['p99_ms']:>11.1f}{s['max_ms']:>11.1f}")
+        if "last_error" in s:
+            print(f"{'':<14}último erro: {s['last_error']}")
+    procs = ", ".join(f"{p}={n}" for p, n in result["subprocesses"].items()) or "nenhum"
+    helper = ", ".join(f"{op}={n}" for op, n in result["helper_calls"].items()) or "nenhuma"
+    print(f"subprocessos ({result['subprocesses_per_lifecycle']}/ciclo): {procs}")
+    print(f"chamadas ao helper: {helper}")
+
+
+def _print_compare(old, new):
+    print(f"\nComparação com {old['meta'].get('started_at')} (rev {old['meta'].get('git_rev')}):")
+    print(f"{'modo/operação':<22}{'p50 antes':>11}{'p50 agora':>11}{'p99 antes':>11}{'p99 agora':>11}{'Δp50':>9}")
+    for mode in ("engine", "app"):
+        if mode not in old or mode not in new:
+            continue
+        for op, s in new[mode]["ops"].items():
+            before = old[mode]["ops"].get(op, {})
+            if "p50_ms" not in s or "p50_ms" not in before:
+                continue
+            delta = (s["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+            print(f"{mode + '/' + op:<22}{before['p50_ms']:>11.1f}{s['p50_ms']:>11.1f}"
+                  f"{before['p99_ms']:>11.1f}{s['p99_ms']:>11.1f}{delta:>+8.1f}%")
+        print(f"{mode + '/vazão':<22}{old[mode]['throughput_per_s']:>11}{new[mode]['throughput_per_s']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do ciclo de vida dos ambientes")
+    parser.add_argument("-n", "--lifecycles", type=int, default=10, help="ciclos por modo")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="ciclos em paralelo")
+    parser.add_argument("--mode", choices=("engine", "app", "both"), default="both")
+    parser.add_argument("--command", default="echo bench", help="comando do passo exec")
+    parser.add_argument("--cpu", type=int, default=10)
+    parser.add_argument("--mem", type=int, default=128)
+    parser.add_argument("--io", type=int, default=10)
+    parser.add_argument("--sqlite", help="arquivo SQLite no lugar do MySQL")
+    parser.add_argument("--output", help="grava o resultado em JSON")
+    parser.add_argument("--compare", help="JSON de uma rodada anterior para comparar")
+    args = parser.parse_args()
+
+    # Antes de importar db/app: as configurações são lidas no import
+    if args.sqlite:
+        os.environ["CLOUDENV_DB_SQLITE"] = args.sqlite
+    os.environ.setdefault("CLOUDENV_JOB_WORKERS", str(args.concurrency))
+    os.environ.setdefault("CLOUDENV_RECONCILE_INTERVAL", "0")
+    os.environ.setdefault("CLOUDENV_TELEMETRY_INTERVAL", "0")
+    import manage_env
+
+    results = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "git_rev": _git_rev(),
+            "helper": manage_env.helper_available(),
+            "database": f"sqlite:{args.sqlite}" if args.sqlite else "mysql",
+            "envs_dir": str(manage_env.ENVS_DIR),
+            "args": vars(args),
+        }
+    }
+    for mode in (("engine", "app") if args.mode == "both" else (args.mode,)):
+        results[mode] = run(mode, args)
+        _print_run(mode, results[mode])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultado gravado em {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            _print_compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# webapp/cgroups.py
+"""Gerência de cgroups v2 dos ambientes, escrevendo direto nos arquivos do cgroupfs.
+
+Cada ambiente tem um EnvCgroup (/sys/fs/cgroup/cloudenv_<nome>). Os erros de
+escrita viram CgroupError em vez de sumirem num ``|| true``. Quando o processo
+não tem permissão (ex.: Flask rodando como www-data), a escrita passa pelas
+primitivas privilegiadas do manage_env (helper ou sudo).
+
+A raiz do cgroupfs e do /sys/dev/block são parâmetros, para que o módulo
+possa ser testado contra uma árvore falsa num diretório temporário.
+"""
+import os
+import signal
+import time
+from pathlib import Path
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+SYS_DEV_BLOCK = Path("/sys/dev/block")
+
+# Controladores que os ambientes usam (pids: telemetria do número de processos)
+CONTROLLERS = ("cpu", "memory", "io", "pids")
+
+CPU_PERIOD = 100000  # 100ms em microsegundos
+MEMORY_HIGH_RATIO = 0.9  # memory.high (soft limit) = 90% do memory.max
+
+
+class CgroupError(Exception):
+    pass
+
+
+# ----------------------------------------------------------- E/S no cgroupfs
+
+def _write(path, value):
+    try:
+        with open(path, 'w') as f:
+            f.write(value)
+        return
+    except PermissionError:
+        pass
+    except OSError as e:
+        raise CgroupError(f"Falha ao escrever {value!r} em {path}: {e.strerror}")
+
+    import manage_env
+    if not manage_env.priv_write(path, value, mode=None, owner=None):
+        raise CgroupError(f"Falha ao escrever {value!r} em {path}")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except PermissionError:
+        import manage_env
+        return manage_env.priv_read(path)
+
+
+def _mkdir(path):
+    try:
+        os.mkdir(path)
+        return
+    except FileExistsError:
+        return
+    except PermissionError:
+        pass
+    except OSError as e:
+        raise CgroupError(f"Falha ao criar cgroup {path}: {e.strerror}")
+
+    import manage_env
+    if not manage_env.priv_mkdir(path, mode=None, owner=None):
+        raise CgroupError(f"Falha ao criar cgroup {path}")
+
+
+def _rmdir(path):
+    try:
+        os.rmdir(path)
+        return
+    except FileNotFoundError:
+        return
+    except PermissionError:
+        pass
+    except OSError as e:
+        raise CgroupError(f"Falha ao remover cgroup {path}: {e.strerror}")
+
+    import manage_env
+    if not manage_env.priv_rmdir(path):
+        raise CgroupError(f"Falha ao remover cgroup {path}")
+
+
+def _parse_keyed(text):
+    """Arquivos como cgroup.events: uma linha "chave valor" por entrada."""
+    values = {}
+    for line in (text or "").splitlines():
+        key, _, value = line.partition(" ")
+        values[key] = value.strip()
+    return values
+
+
+# ------------------------------------------------------------ dispositivo
+
+def block_device(path, sys_dev_block=SYS_DEV_BLOCK):
+    """"MAJ:MIN" do disco que guarda ``path`` (o disco inteiro, não a partição).
+
+    io.max só aceita discos inteiros. Retorna None para sistemas de arquivos
+    sem dispositivo de bloco (tmpfs, vboxsf, overlay...).
+    """
+    dev = os.stat(path).st_dev
+    return device_for(os.major(dev), os.minor(dev), sys_dev_block)
+
+
+def device_for(major, minor, sys_dev_block=SYS_DEV_BLOCK):
+    """Resolve MAJ:MIN de uma partição para o disco inteiro via /sys/dev/block."""
+    if major == 0:
+        return None
+
+    node = Path(sys_dev_block) / f"{major}:{minor}"
+    if not node.exists():
+        return None
+    if (node / "partition").exists():
+        # .../block/sda/sda1 -> o dev do diretório pai é o do disco
+        parent_dev = _read(node.resolve().parent / "dev")
+        if parent_dev:
+            return parent_dev.strip()
+    return f"{major}:{minor}"
+
+
+def find_block_device(paths, sys_dev_block=SYS_DEV_BLOCK):
+    """Primeiro dispositivo de bloco encontrado entre ``paths``."""
+    for path in paths:
+        try:
+            device = block_device(path, sys_dev_block)
+        except OSError:
+            continue
+        if device:
+            return device
+    return None
+
+
+# ----------------------------------------------------------------- cgroup
+
+class EnvCgroup:
+    """Um cgroup v2 de ambiente, filho direto da raiz ``root``."""
+
+    def __init__(self, name, root=CGROUP_ROOT):
+        self.name = name
+        self.root = Path(root)
+        self.path = self.root / name
+
+    def __repr__(self):
+        return f"EnvCgroup({self.path})"
+
+    def file(self, name):
+        return self.path / name
+
+    def exists(self):
+        return self.path.is_dir()
+
+    def read(self, name):
+        return _read(self.file(name))
+
+    def write(self, name, value):
+        _write(self.file(name), str(value))
+
+    # -------------------------------------------------------- criação
+
+    def enable_controllers(self, controllers=CONTROLLERS):
+        """Liga no pai (cgroup.subtree_control) os controladores ainda desligados."""
+        available = set((_read(self.root / "cgroup.controllers") or "").split())
+        enabled = set((_read(self.root / "cgroup.subtree_control") or "").split())
+        missing = [c for c in controllers if c in available and c not in enabled]
+        if missing:
+            _write(self.root / "cgroup.subtree_control", " ".join(f"+{c}" for c in missing))
+        return [c for c in controllers if c in available]
+
+    def create(self):
+        self.enable_controllers()
+        _mkdir(self.path)
+        return self
+
+    # --------------------------------------------------------- limites
+
+    def set_cpu(self, cpu_percent, period=CPU_PERIOD):
+        # Para X% de CPU: quota = X * período / 100 (150% = 1.5 cores)
+        quota = int(cpu_percent * period / 100)
+        self.write("cpu.max", f"{quota} {period}")
+        return quota
+
+    def set_memory(self, mem_mb):
+        mem_bytes = mem_mb * 1024 * 1024
+        # memory.high primeiro: nunca fica acima de um memory.max já menor
+        self.write("memory.high", str(int(mem_bytes * MEMORY_HIGH_RATIO)))
+        self.write("memory.max", str(mem_bytes))
+        return mem_bytes
+
+    def set_io(self, device, io_mb):
+        io_bps = io_mb * 1024 * 1024
+        self.write("io.max", f"{device} rbps={io_bps} wbps={io_bps}")
+        return io_bps
+
+    # ------------------------------------------------------- processos
+
+    def procs(self):
+        return [int(p) for p in (self.read("cgroup.procs") or "").split() if p.isdigit()]
+
+    def attach(self, pid):
+        """Move o processo (com todas as threads) para este cgroup."""
+        self.write("cgroup.procs", str(pid))
+
+    def populated(self):
+        events = _parse_keyed(self.read("cgroup.events"))
+        if "populated" in events:
+            return events["populated"] != "0"
+        return bool(self.procs())
+
+    def freeze(self, frozen=True):
+        self.write("cgroup.freeze", "1" if frozen else "0")
+
+    def migrate_to(self, dest, timeout=1.0):
+        """Move todos os processos para ``dest`` com o cgroup congelado.
+
+        Congelado, nenhum processo consegue criar filhos durante a migração,
+        então nada fica para trás.
+        """
+        self.freeze(True)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                pids = self.procs()
+                if not pids:
+                    return
+                for pid in pids:
+                    try:
+                        dest.attach(pid)
+                    except CgroupError:
+                        # Processo saiu entre a leitura e a escrita
+                        if pid in self.procs():
+                            raise
+                if time.monotonic() > deadline:
+                    raise CgroupError(f"Processos restantes em {self.path}: {self.procs()}")
+        finally:
+            self.freeze(False)
+
+    # ---------------------------------------------------------- remoção
+
+    def kill(self):
+        """SIGKILL em todos os processos do cgroup (cgroup.kill, kernel >= 5.14)."""
+        if self.file("cgroup.kill").exists():
+            self.write("cgroup.kill", "1")
+            return
+
+        import manage_env
+        for pid in self.procs():
+            manage_env.priv_kill(pid, signal.SIGKILL)
+
+    def wait_empty(self, timeout):
+        """Espera o cgroup esvaziar (cgroup.events: populated 0)."""
+        deadline = time.monotonic() + timeout
+        while self.populated():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def destroy(self, timeout=1.0):
+        """Mata os processos, espera o cgroup esvaziar e remove o diretório."""
+        if not self.exists():
+            return
+        self.kill()
+        if not self.wait_empty(timeout):
+            raise CgroupError(f"Cgroup {self.path} não esvaziou em {timeout:.1f} s")
+        _rmdir(self.path)
@@ -1,12 +1,468 @@
 # webapp/db.py
+"""Acesso ao MySQL: pool de conexões, conexão por requisição e queries fixas.
+
+- get_db() entrega uma conexão do pool; release_db() encerra a transação
+  aberta e devolve ao pool. Com CLOUDENV_DB_POOL_SIZE=0 abre uma conexão nova
+  por chamada, como antes.
+- Dentro de uma requisição Flask, request_db() reaproveita a mesma conexão
+  até o fim da requisição (init_app registra o teardown).
+- As queries fixas do app ficam em QUERIES e rodam como prepared statements,
+  com um cursor preparado por query e por conexão.
+- Com CLOUDENV_DB_SQLITE=<arquivo> um SQLite local substitui o MySQL
+  (benchmarks e desenvolvimento fora da VM); o schema é criado na hora.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
+from mysql.connector import pooling, errors
 
-def get_db():
+import tracing
+from ledger import ALLOCATED_STATUSES
+
+DB_CONFIG = {
     # conecta ao MySQL dentro da VM base (192.168.56.10)
-    return mysql.connector.connect(
-        host='192.168.56.10',
-        user='cloud_user',
-        password='cloud_pass',
-        database='cloud_project',
-        connect_timeout=10
-    )
+    'host': os.environ.get("CLOUDENV_DB_HOST", '192.168.56.10'),
+    'user': os.environ.get("CLOUDENV_DB_USER", 'cloud_user'),
+    'password': os.environ.get("CLOUDENV_DB_PASSWORD", 'cloud_pass'),
+    'database': os.environ.get("CLOUDENV_DB_NAME", 'cloud_project'),
+    'connect_timeout': 10,
+}
+
+POOL_SIZE = int(os.environ.get("CLOUDENV_DB_POOL_SIZE", 8))
+# Conexões paradas há mais que isso recebem um ping antes de serem usadas
+HEALTH_CHECK_IDLE = float(os.environ.get("CLOUDENV_DB_HEALTH_IDLE", 30))
+# Espera máxima pela trava de admissão de um nó, em segundos
+ADMISSION_LOCK_TIMEOUT = int(os.environ.get("CLOUDENV_ADMISSION_LOCK_TIMEOUT", 10))
+
+QUERIES = {
+    'list_envs': "SELECT * FROM environments ORDER BY created_at DESC",
+    'list_env_statuses': "SELECT name, status, node FROM environments",
+    'list_envs_page': "SELECT * FROM environments ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s",
+    'list_envs_page_status': "SELECT * FROM environments WHERE status=%s ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s",
+    'count_envs': "SELECT COUNT(*) AS total FROM environments",
+    'count_envs_status': "SELECT COUNT(*) AS total FROM environments WHERE status=%s",
+    'get_env': "SELECT * FROM environments WHERE name=%s",
+    'env_exists': "SELECT name FROM environments WHERE name=%s",
+    'insert_env': "INSERT INTO environments (name, cpu, mem, io, status, node) VALUES (%s,%s,%s,%s,%s,%s)",
+    'set_status': "UPDATE environments SET status=%s WHERE name=%s",
+    'set_created': "UPDATE environments SET status=%s, container_path=%s, log_path=%s WHERE name=%s",
+    'set_last_command': "UPDATE environments SET last_command=%s WHERE name=%s",
+    'delete_env': "DELETE FROM environments WHERE name=%s",
+    'get_log_path': "SELECT log_path FROM environments WHERE name=%s",
+    'allocated_on_node': "SELECT COALESCE(SUM(cpu), 0) AS cpu, COALESCE(SUM(mem), 0) AS mem FROM environments "
+                         "WHERE node=%s AND name<>%s AND status IN ("
+                         + ",".join(f"'{s}'" for s in ALLOCATED_STATUSES) + ")",
+    'insert_job': "INSERT INTO jobs (env_name, action, status) VALUES (%s,%s,%s)",
+    'job_started': "UPDATE jobs SET status=%s, started_at=NOW() WHERE id=%s",
+    'job_finished': "UPDATE jobs SET status=%s, result=%s, finished_at=NOW() WHERE id=%s",
+    'get_job': "SELECT * FROM jobs WHERE id=%s",
+    'list_jobs': "SELECT * FROM jobs ORDER BY id DESC LIMIT %s",
+    'list_env_jobs': "SELECT * FROM jobs WHERE env_name=%s ORDER BY id DESC LIMIT %s",
+}
+
+SQLITE_PATH = os.environ.get("CLOUDENV_DB_SQLITE")
+
+# Mesmas tabelas do Vagrantfile, no dialeto do SQLite
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS environments (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name VARCHAR(100) NOT NULL UNIQUE,
+  cpu INT NOT NULL,
+  mem INT NOT NULL,
+  io INT DEFAULT 10,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  status VARCHAR(30) DEFAULT 'creating',
+  container_path VARCHAR(255),
+  last_command TEXT,
+  log_path VARCHAR(255),
+  node VARCHAR(100) NOT NULL DEFAULT 'local'
+);
+CREATE INDEX IF NOT EXISTS idx_status ON environments (status);
+CREATE INDEX IF NOT EXISTS idx_node ON environments (node);
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  env_name VARCHAR(100) NOT NULL,
+  action VARCHAR(20) NOT NULL,
+  status VARCHAR(20) DEFAULT 'queued',
+  result TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  started_at TIMESTAMP NULL,
+  finished_at TIMESTAMP NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_env ON jobs (env_name);
+"""
+
+_pool = None
+_pool_lock = threading.Lock()
+_sqlite_ready = False
+_last_used = {}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # pool_reset_session=False: o reset descartaria os prepared statements
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="cloudenv", pool_size=POOL_SIZE,
+                    pool_reset_session=False, **DB_CONFIG
+                )
+    return _pool
+
+
+def _health_check(conn):
+    key = id(conn._cnx) if hasattr(conn, '_cnx') else id(conn)
+    if time.monotonic() - _last_used.get(key, 0) > HEALTH_CHECK_IDLE:
+        # Reconecta se o servidor derrubou a conexão ociosa
+        conn.ping(reconnect=True, attempts=2, delay=0)
+        _prepared_cache(conn).clear()
+    _last_used[key] = time.monotonic()
+
+
+class _SqliteCursor:
+    """O pedaço da API de cursor do mysql.connector que o app usa."""
+
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+
+    def execute(self, sql, params=()):
+        self._cur.execute(sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP"), tuple(params))
+
+    def fetchall(self):
+        names = [d[0] for d in self._cur.description or ()]
+        return [dict(zip(names, row)) for row in self._cur.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    def close(self):
+        self._cur.close()
+
+
+class _SqliteConnection:
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self, prepared=False, dictionary=False):
+        return _SqliteCursor(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def close(self):
+        self._conn.close()
+
+
+def _sqlite_connect():
+    global _sqlite_ready
+    conn = _SqliteConnection(SQLITE_PATH)
+    if not _sqlite_ready:
+        with _pool_lock:
+            conn._conn.execute("PRAGMA journal_mode=WAL")
+            conn._conn.executescript(SQLITE_SCHEMA)
+            _sqlite_ready = True
+    return conn
+
+
+def get_db():
+    """Conexão com o MySQL (do pool, se habilitado). Devolva com release_db()."""
+    if SQLITE_PATH:
+        return _sqlite_connect()
+    if POOL_SIZE <= 0:
+        return mysql.connector.connect(**DB_CONFIG)
+
+    try:
+        conn = _get_pool().get_connection()
+    except errors.PoolError:
+        # Pool esgotado: conexão avulsa em vez de falhar a requisição
+        return mysql.connector.connect(**DB_CONFIG)
+
+    try:
+        _health_check(conn)
+    except errors.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def release_db(conn):
+    """Encerra a transação aberta e devolve a conexão ao pool (ou fecha).
+
+    Sem autocommit, até um SELECT abre uma transação REPEATABLE READ; se ela
+    voltasse ao pool aberta, o próximo a pegar a conexão leria o snapshot
+    antigo (job parado em 'queued', status velhos). O pool não faz isso por
+    nós: pool_reset_session=False.
+    """
+    try:
+        conn.rollback()
+    except (errors.Error, sqlite3.Error):
+        pass
+    try:
+        conn.close()
+    except (errors.Error, sqlite3.Error):
+        pass
+
+
+# ------------------------------------------------- conexão por requisição
+
+def request_db():
+    """Conexão reaproveitada durante toda a requisição Flask atual."""
+    from flask import g, has_app_context
+    if not has_app_context():
+        return get_db()
+    conn = g.get('_cloudenv_db')
+    if conn is None:
+        conn = g._cloudenv_db = get_db()
+    return conn
+
+
+def release_request_db(exc=None):
+    """Devolve ao pool a conexão da requisição atual (também roda no teardown)."""
+    from flask import g
+    conn = g.pop('_cloudenv_db', None)
+    if conn is not None:
+        release_db(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_db)
+
+
+# ------------------------------------------------------- queries fixas
+
+def _prepared_cache(conn):
+    # O cache fica na conexão física, que sobrevive às idas e voltas do pool
+    cnx = getattr(conn, '_cnx', conn)
+    cache = getattr(cnx, '_cloudenv_stmts', None)
+    if cache is None:
+        cache = {}
+        cnx._cloudenv_stmts = cache
+    return cache
+
+
+def _cursor(conn, key):
+    cache = _prepared_cache(conn)
+    cur = cache.get(key)
+    if cur is None:
+        cur = cache[key] = conn.cursor(prepared=True, dictionary=True)
+    return cur
+
+
+@contextmanager
+def _use(conn=None):
+    """Conexão explícita, a da requisição atual ou uma do pool só para esta chamada."""
+    if conn is not None:
+        yield conn
+        return
+
+    from flask import has_app_context
+    if has_app_context():
+        yield request_db()
+        return
+
+    conn = get_db()
+    try:
+        yield conn
+    finally:
+        release_db(conn)
+
+
+def _run(conn, key, params):
+    tracing.count("cloudenv_db_queries_total", "query", key)
+    cur = _cursor(conn, key)
+    try:
+        # Mesmo objeto str a cada chamada: o cursor reaproveita o statement preparado
+        cur.execute(QUERIES[key], params)
+    except (errors.Error, sqlite3.Error):
+        _prepared_cache(conn).pop(key, None)
+        raise
+    return cur
+
+
+def fetch_all(key, params=(), conn=None):
+    with tracing.span(f"db:{key}"), _use(conn) as c:
+        return _run(c, key, params).fetchall()
+
+
+def fetch_one(key, params=(), conn=None):
+    rows = fetch_all(key, params, conn)
+    return rows[0] if rows else None
+
+
+def execute(key, params=(), conn=None):
+    """Executa uma escrita e faz commit. Retorna (rowcount, lastrowid)."""
+    with tracing.span(f"db:{key}"), _use(conn) as c:
+        cur = _run(c, key, params)
+        c.commit()
+        return cur.rowcount, cur.lastrowid
+
+
+# ------------------------------------------------------ atalhos do app
+
+def list_envs(conn=None):
+    return fetch_all('list_envs', (), conn)
+
+
+def list_envs_page(limit, offset=0, status=None, conn=None):
+    """Uma página de ambientes e o total (com o filtro de status, se houver)."""
+    if status:
+        rows = fetch_all('list_envs_page_status', (status, limit, offset), conn)
+        total = fetch_one('count_envs_status', (status,), conn)['total']
+    else:
+        rows = fetch_all('list_envs_page', (limit, offset), conn)
+        total = fetch_one('count_envs', (), conn)['total']
+    return rows, total
+
+
+def list_env_statuses(conn=None):
+    """{nome: status} de todos os ambientes (só as duas colunas)."""
+    return {r['name']: r['status'] for r in fetch_all('list_env_statuses', (), conn)}
+
+
+def list_env_statuses_by_node(conn=None):
+    """{nó: {nome: status}} de todos os ambientes."""
+    nodes = {}
+    for r in fetch_all('list_env_statuses', (), conn):
+        nodes.setdefault(r['node'], {})[r['name']] = r['status']
+    return nodes
+
+
+def get_env(name, conn=None):
+    return fetch_one('get_env', (name,), conn)
+
+
+def env_exists(name, conn=None):
+    return fetch_one('env_exists', (name,), conn) is not None
+
+
+@contextmanager
+def admission(node, name, conn=None):
+    """Admissão de ``name`` no nó, serializada entre processos.
+
+    Trava o nó (GET_LOCK no MySQL, BEGIN IMMEDIATE no SQLite), lê o que os
+    outros ambientes do nó têm alocado e entrega (conexão, CPU, memória). A
+    escrita feita com essa conexão antes de sair (insert_env, set_status)
+    entra na mesma transação; sem commit, tudo é desfeito. Levanta
+    TimeoutError se a trava não vier em ADMISSION_LOCK_TIMEOUT segundos.
+    """
+    lock = f"cloudenv_admission_{node}"
+    with tracing.span("db:admission"), _use(conn) as c:
+        if SQLITE_PATH:
+            c._conn.execute("BEGIN IMMEDIATE")
+        else:
+            c.rollback()
+            cur = c.cursor()
+            cur.execute("SELECT GET_LOCK(%s, %s)", (lock, ADMISSION_LOCK_TIMEOUT))
+            got = cur.fetchall()[0][0]
+            cur.close()
+            if got != 1:
+                raise TimeoutError(f"Admissão no nó {node} ocupada; tente de novo")
+            # A soma abaixo abre um snapshot novo, já com a trava na mão
+            c.commit()
+        try:
+            row = fetch_one('allocated_on_node', (node, name), c)
+            yield c, float(row['cpu']), int(row['mem'])
+        finally:
+            c.rollback()
+            if not SQLITE_PATH:
+                cur = c.cursor()
+                cur.execute("SELECT RELEASE_LOCK(%s)", (lock,))
+                cur.fetchall()
+                cur.close()
+
+
+def existing_envs(names, conn=None):
+    """Quais de ``names`` têm linha em environments (uma query só)."""
+    if not names:
+        return set()
+    placeholders = ",".join(["%s"] * len(names))
+    tracing.count("cloudenv_db_queries_total", "query", "existing_envs")
+    with tracing.span("db:existing_envs"), _use(conn) as c:
+        cur = c.cursor(dictionary=True)
+        cur.execute(f"SELECT name FROM environments WHERE name IN ({placeholders})", list(names))
+        found = {r['name'] for r in cur.fetchall()}
+        cur.close()
+    return found
+
+
+def insert_env(name, cpu, mem, io, status='creating', node='local', conn=None):
+    return execute('insert_env', (name, cpu, mem, io, status, node), conn)
+
+
+def set_status(name, status, conn=None):
+    return execute('set_status', (status, name), conn)
+
+
+def set_last_command(name, command, conn=None):
+    return execute('set_last_command', (command, name), conn)
+
+
+def delete_env(name, conn=None):
+    return execute('delete_env', (name,), conn)
+
+
+def get_log_path(name, conn=None):
+    row = fetch_one('get_log_path', (name,), conn)
+    return row['log_path'] if row else None
+
+
+def set_last_command_many(names, command, conn=None):
+    """Grava o mesmo last_command em vários ambientes num único UPDATE."""
+    if not names:
+        return 0
+    placeholders = ",".join(["%s"] * len(names))
+    tracing.count("cloudenv_db_queries_total", "query", "set_last_command_many")
+    with tracing.span("db:set_last_command_many"), _use(conn) as c:
+        cur = c.cursor()
+        cur.execute(f"UPDATE environments SET last_command=%s WHERE name IN ({placeholders})",
+                    [command] + list(names))
+        c.commit()
+        count = cur.rowcount
+        cur.close()
+    return count
+
+
+def update_statuses(changes, conn=None, skip=()):
+    """Atualiza o status de vários ambientes num único UPDATE.
+
+    ``changes`` é um dict {nome: novo_status}. Linhas cujo status atual está
+    em ``skip`` não são tocadas. Retorna o número de linhas alteradas.
+    """
+    if not changes:
+        return 0
+
+    names = list(changes)
+    cases = " ".join(["WHEN %s THEN %s"] * len(names))
+    placeholders = ",".join(["%s"] * len(names))
+    params = [v for name in names for v in (name, changes[name])] + names
+    where = f"name IN ({placeholders})"
+    if skip:
+        where += f" AND status NOT IN ({','.join(['%s'] * len(skip))})"
+        params += list(skip)
+
+    # SQL de tamanho variável: cursor comum, sem prepared statement
+    tracing.count("cloudenv_db_queries_total", "query", "update_statuses")
+    with tracing.span("db:update_statuses"), _use(conn) as c:
+        cur = c.cursor()
+        cur.execute(f"UPDATE environments SET status = CASE name {cases} END WHERE {where}", params)
+        c.commit()
+        count = cur.rowcount
+        cur.close()
+    return count
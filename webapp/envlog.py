@@ -0,0 +1,200 @@
+# webapp/envlog.py
+"""Log por ambiente: append com buffer, flush periódico e rotação por tamanho.
+
+Cada arquivo de log tem um único EnvLog por processo (veja get_log). Uma
+escrita só copia o texto para o buffer em memória; o buffer vai para o disco
+quando passa de BUFFER_SIZE, a cada FLUSH_INTERVAL segundos (thread de flush)
+ou quando alguém chama flush(). Quando o arquivo passa de MAX_BYTES ele é
+rotacionado (log -> log.1 -> log.2 ...) e, opcionalmente, comprimido em .gz.
+"""
+import atexit
+import gzip
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+MAX_BYTES = int(os.environ.get("CLOUDENV_LOG_MAX_BYTES", 50 * 1024 * 1024))
+BACKUPS = int(os.environ.get("CLOUDENV_LOG_BACKUPS", 5))
+COMPRESS = os.environ.get("CLOUDENV_LOG_COMPRESS", "1") != "0"
+FLUSH_INTERVAL = float(os.environ.get("CLOUDENV_LOG_FLUSH_INTERVAL", 1.0))
+BUFFER_SIZE = 64 * 1024
+
+
+class EnvLog:
+    """Sink de log append-only de um ambiente."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS, compress=COMPRESS,
+                 fallback_writer=None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        # Chamado com (path, texto) quando o processo não consegue abrir o arquivo
+        # (ex.: criado por root); normalmente manage_env.priv_write em modo append.
+        self.fallback_writer = fallback_writer
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._fh = None
+        self._ino = None
+
+    # ------------------------------------------------------------ escrita
+
+    def write(self, text):
+        data = text.encode('utf-8', errors='replace') if isinstance(text, str) else text
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= BUFFER_SIZE:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            self._close_fh()
+
+    # ----------------------------------------------------------- internos
+
+    def _open(self):
+        # Outro processo pode ter rotacionado o arquivo: reabrir se o inode mudou
+        if self._fh is not None:
+            try:
+                if os.stat(self.path).st_ino == self._ino:
+                    return self._fh
+            except FileNotFoundError:
+                pass
+            self._close_fh()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.path, 'ab', buffering=0)
+        self._ino = os.fstat(self._fh.fileno()).st_ino
+        return self._fh
+
+    def _close_fh(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+        self._fh = None
+        self._ino = None
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        try:
+            fh = self._open()
+            fh.write(data)
+        except PermissionError:
+            if self.fallback_writer is None:
+                raise
+            self.fallback_writer(self.path, data.decode('utf-8', errors='replace'))
+            return
+
+        if self.max_bytes and fh.tell() >= self.max_bytes:
+            self._rotate_locked()
+
+    def _segment(self, index):
+        return self.path.with_name(f"{self.path.name}.{index}")
+
+    def _rotate_locked(self):
+        self._close_fh()
+
+        # log.N(.gz) -> log.N+1(.gz), descartando o mais antigo
+        for index in range(self.backups, 0, -1):
+            for suffix in ("", ".gz"):
+                src = Path(f"{self._segment(index)}{suffix}")
+                if not src.exists():
+                    continue
+                if index == self.backups:
+                    src.unlink()
+                else:
+                    src.rename(f"{self._segment(index + 1)}{suffix}")
+
+        if self.backups <= 0:
+            self.path.unlink()
+            return
+
+        rotated = self._segment(1)
+        os.rename(self.path, rotated)
+        if self.compress:
+            threading.Thread(target=_compress, args=(rotated,), daemon=True).start()
+
+
+def _compress(path):
+    """Comprime um segmento rotacionado (log.1 -> log.1.gz)."""
+    try:
+        with open(path, 'rb') as src, gzip.open(f"{path}.gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.unlink(path)
+    except OSError as e:
+        print(f"Erro ao comprimir log {path}: {e}")
+
+
+# ------------------------------------------------------------------ registro
+
+_logs = {}
+_logs_lock = threading.Lock()
+_flusher = None
+
+
+def get_log(path, fallback_writer=None):
+    """Retorna o EnvLog (único por processo) do arquivo ``path``."""
+    key = str(path)
+    log = _logs.get(key)
+    if log is None:
+        with _logs_lock:
+            log = _logs.get(key)
+            if log is None:
+                log = EnvLog(path, fallback_writer=fallback_writer)
+                _logs[key] = log
+                _start_flusher()
+    return log
+
+
+def flush_log(path):
+    log = _logs.get(str(path))
+    if log is not None:
+        log.flush()
+
+
+def close_log(path):
+    """Fecha e esquece o log (ex.: antes de remover o ambiente)."""
+    with _logs_lock:
+        log = _logs.pop(str(path), None)
+    if log is not None:
+        log.close()
+
+
+def flush_all():
+    for log in list(_logs.values()):
+        try:
+            log.flush()
+        except Exception as e:
+            print(f"Erro ao gravar log {log.path}: {e}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush_all()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, name="envlog-flusher", daemon=True)
+        _flusher.start()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,228 @@
+# webapp/envpool.py
+"""Pool de namespaces pré-iniciados para create quase instantâneo.
+
+Cada slot do pool é um ambiente completo (diretórios, init.sh, cgroup e
+namespace rodando) em ENVS_DIR/.pool/<slot>, ainda sem dono e sem limites.
+Um create pega um slot pronto, renomeia diretório, log e cgroup para o nome
+do ambiente, aplica cpu.max/memory.max/io.max e troca o hostname. Uma thread
+repõe o pool em background.
+
+Os slots pertencem ao processo que os criou (<pid>_<n>); slots de processos
+que já morreram são removidos quando o pool inicia.
+"""
+import atexit
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+import manage_env
+import rootfs
+from metrics import LATENCY
+
+POOL_SIZE = int(os.environ.get("CLOUDENV_POOL_SIZE", 0))
+POOL_DIR = manage_env.ENVS_DIR / ".pool"
+RETRY_DELAY = 5  # segundos de espera após falha ao criar slot
+
+
+def _slot_paths(slot):
+    env_path = POOL_DIR / slot
+    return env_path, f"cloudenv_pool_{slot}", env_path / "logs" / f"{slot}.log"
+
+
+class EnvPool:
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._seq = itertools.count()
+        self._thread = None
+
+    # ------------------------------------------------------------ ciclo
+
+    def start(self):
+        if self.size <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._refill_loop, name="envpool-refill", daemon=True)
+        self._thread.start()
+        self._wake.set()
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """Remove os slots ainda não usados deste processo."""
+        self.size = 0
+        with self._lock:
+            slots = list(self._ready)
+            self._ready.clear()
+        for slot in slots:
+            self._discard(slot)
+
+    def _refill_loop(self):
+        self._cleanup_orphans()
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while len(self._ready) < self.size:
+                if not self._add_slot():
+                    time.sleep(RETRY_DELAY)
+                    break
+
+    def _add_slot(self):
+        slot = f"{os.getpid()}_{next(self._seq)}"
+        env_path, cgroup_name, log_file = _slot_paths(slot)
+        start = time.perf_counter()
+        try:
+            if not POOL_DIR.exists():
+                manage_env.priv_mkdir(POOL_DIR)
+            r, out, err, _ = manage_env.start_env_at(env_path, f"pool-{slot}", cgroup_name, log_file,
+                                                     image=rootfs.DEFAULT_IMAGE)
+        except Exception as e:
+            r, err = 1, str(e)
+
+        if r != 0:
+            print(f"Erro ao criar slot do pool {slot}: {err}")
+            self.refill_errors += 1
+            self._discard(slot)
+            return False
+
+        LATENCY.record('pool_refill', time.perf_counter() - start)
+        with self._lock:
+            self._ready.append(slot)
+            self.refills += 1
+        return True
+
+    def _discard(self, slot):
+        env_path, cgroup_name, log_file = _slot_paths(slot)
+        try:
+            manage_env.halt_env_at(env_path, log_file)
+            manage_env.destroy_env_at(env_path, cgroup_name, log_file)
+        except Exception as e:
+            print(f"Aviso ao remover slot do pool {slot}: {e}")
+
+    def _cleanup_orphans(self):
+        if not POOL_DIR.exists():
+            return
+        for entry in POOL_DIR.iterdir():
+            owner = entry.name.split("_", 1)[0]
+            if owner.isdigit() and not manage_env.pid_alive(int(owner)):
+                self._discard(entry.name)
+
+    # ----------------------------------------------------------- claim
+
+    def _take(self):
+        with self._lock:
+            return self._ready.popleft() if self._ready else None
+
+    def claim(self, name, cpu_percent, mem, io):
+        """Entrega um slot pronto como o ambiente ``name``. None se o pool estiver vazio."""
+        slot = self._take()
+        self._wake.set()
+        if slot is None:
+            self.misses += 1
+            return None
+
+        env_path, slot_cgroup, slot_log = _slot_paths(slot)
+        host_pid = manage_env.read_pid(env_path / "env.pid")
+        if not host_pid or not manage_env.pid_alive(host_pid):
+            self.misses += 1
+            self._discard(slot)
+            return None
+
+        dest = manage_env.ENVS_DIR / name
+        manage_env.close_log(slot_log)
+        if not manage_env.priv_rename(env_path, dest):
+            # Destino já existe (ex.: resto de um ambiente antigo): devolver o slot
+            with self._lock:
+                self._ready.appendleft(slot)
+            self.misses += 1
+            return None
+
+        # Os namespaces do slot ficaram em cache no helper com o caminho antigo
+        manage_env.ns_drop(env_path)
+        log_file = dest / "logs" / f"{name}.log"
+        manage_env.priv_rename(dest / "logs" / f"{slot}.log", log_file)
+        manage_env.write_log(log_file, f"=== Ambiente {name} criado a partir do pool (slot {slot}) ===\n")
+
+        cgroup_name = f"cloudenv_{name}"
+        if manage_env.CGROUP_V2:
+            self._move_cgroup(slot_cgroup, cgroup_name, log_file)
+        manage_env.write_log(log_file, f"CPU: {cpu_percent}% | Memoria: {mem} MB | I/O: {io} MB/s\n")
+        error = manage_env.apply_limits(cgroup_name, cpu_percent, mem, io, log_file)
+        if error:
+            self.hits += 1
+            return 1, "", error, str(dest)
+
+        init_pid = manage_env.ns_init_pid(host_pid)
+        if init_pid:
+            manage_env.priv_run(["nsenter", "-t", str(init_pid), "-u", "hostname", f"env-{name}"])
+        if rootfs.env_image(dest):
+            self._move_layer(env_path, dest, init_pid, log_file)
+
+        manage_env.write_log(log_file, f"PID do host: {host_pid}\n✓ Status: running\n\n")
+        self.hits += 1
+        return 0, "Ambiente criado com sucesso (pool)", "", str(dest)
+
+    def _move_cgroup(self, slot_cgroup, cgroup_name, log_file):
+        if manage_env.priv_rename(manage_env.CGROUP_BASE / slot_cgroup, manage_env.CGROUP_BASE / cgroup_name):
+            return
+
+        # Sem rename (ex.: cgroup de destino já existe): mover os processos
+        manage_env.write_log(log_file, f"⚠ Não foi possível renomear o cgroup {slot_cgroup}; movendo processos\n")
+        source = manage_env.env_cgroup(slot_cgroup)
+        try:
+            source.migrate_to(manage_env.env_cgroup(cgroup_name).create())
+            source.destroy()
+        except manage_env.CgroupError as e:
+            manage_env.write_log(log_file, f"✗ Erro ao mover processos do cgroup: {e}\n")
+
+    def _move_layer(self, slot_path, dest, init_pid, log_file):
+        # O overlay montado segue a camada renomeada; dentro do namespace o
+        # ambiente ainda está no caminho do slot, então ganha um bind no novo
+        manage_env.priv_rename(rootfs.layer_path(slot_path, manage_env.ENVS_DIR),
+                               rootfs.layer_path(dest, manage_env.ENVS_DIR))
+        if init_pid:
+            r, _, err = manage_env.priv_run(["nsenter", "-t", str(init_pid), "-m", "sh", "-c",
+                                             rootfs.rebind_script(slot_path, dest)])
+            if r != 0:
+                manage_env.write_log(log_file, f"⚠ Não foi possível expor {dest} no namespace: {err}\n")
+
+    # ---------------------------------------------------------- stats
+
+    def stats(self):
+        with self._lock:
+            ready = len(self._ready)
+        return {
+            "size": self.size,
+            "ready": ready,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refills": self.refills,
+            "refill_errors": self.refill_errors,
+            "refill_latency": LATENCY.summary('pool_refill'),
+        }
+
+
+POOL = EnvPool()
+
+
+def create_env(name, cpu_percent=100, mem=1024, io=10, image=None):
+    """Igual a manage_env.create_env, mas tenta primeiro um namespace do pool.
+
+    Os slots usam a imagem padrão; outra imagem sempre cria do zero.
+    """
+    if image is None:
+        image = rootfs.DEFAULT_IMAGE
+    if POOL.size > 0 and image == rootfs.DEFAULT_IMAGE and not manage_env.validate_limits(cpu_percent, mem, io):
+        start = time.perf_counter()
+        result = POOL.claim(name, cpu_percent, mem, io)
+        if result is not None:
+            LATENCY.record('create', time.perf_counter() - start)
+            return result
+    return manage_env.create_env(name, cpu_percent=cpu_percent, mem=mem, io=io, image=image)
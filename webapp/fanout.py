@@ -0,0 +1,104 @@
+# webapp/fanout.py
+"""Fan-out: o mesmo comando em vários ambientes ao mesmo tempo.
+
+Os alvos são escolhidos por padrão de nome (fnmatch) e/ou status real. Cada
+alvo roda como um batch de um comando (manage_env.exec_batch), com timeout
+próprio e saída em arquivo, num pool de threads de largura configurável. Os
+resultados saem na ordem em que terminam, então o tempo total é o do alvo
+mais lento, não a soma.
+"""
+import fnmatch
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import db
+import manage_env
+from ledger import LOCAL_NODE
+
+MAX_WIDTH = int(os.environ.get("CLOUDENV_FANOUT_MAX_WIDTH", 16))
+PREVIEW_BYTES = 2048  # fim da saída devolvido junto com o resultado
+
+
+def select_targets(pattern=None, status="running", names=None):
+    """Nomes dos ambientes que casam com ``pattern``, ``status`` e ``names``.
+
+    Os candidatos são as linhas de environments do nó local (o exec_batch
+    roda neste host), nunca diretórios quaisquer de ENVS_DIR como os slots
+    do pool; o status comparado é o real, lido do host.
+    """
+    candidates = [r['name'] for r in db.fetch_all('list_env_statuses') if r['node'] == LOCAL_NODE]
+    if names is not None:
+        wanted = set(names)
+        candidates = [n for n in candidates if n in wanted]
+    statuses = manage_env.status_all(candidates)
+    selected = []
+    for name, current in sorted(statuses.items()):
+        if pattern and not fnmatch.fnmatchcase(name, pattern):
+            continue
+        if status and current != status:
+            continue
+        selected.append(name)
+    return selected
+
+
+def _tail(path, size=PREVIEW_BYTES):
+    try:
+        with open(path, 'rb') as f:
+            f.seek(max(os.fstat(f.fileno()).st_size - size, 0))
+            return f.read().decode('utf-8', errors='replace')
+    except (OSError, TypeError):
+        return ""
+
+
+def _run_one(name, command, timeout):
+    start = time.perf_counter()
+    error, batch = manage_env.exec_batch(name, [command], timeout=timeout)
+    result = {"name": name, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+    if error:
+        result["error"] = error
+        return result
+
+    cmd = batch["results"][0]
+    result.update({
+        "exit_code": cmd["exit_code"],
+        "timed_out": batch["timed_out"],
+        "batch": batch["batch"],
+        "output": cmd["output"],
+        "bytes": cmd["bytes"],
+        "preview": _tail(cmd["output"]),
+    })
+    return result
+
+
+def run(targets, command, width=4, timeout=manage_env.EXEC_TIMEOUT):
+    """Gera um resultado por alvo conforme terminam e, por último, o resumo."""
+    width = max(1, min(int(width), MAX_WIDTH, len(targets) or 1))
+    start = time.perf_counter()
+    ok = failed = 0
+
+    executor = ThreadPoolExecutor(max_workers=width, thread_name_prefix="cloudenv-fanout")
+    try:
+        futures = [executor.submit(_run_one, name, command, timeout) for name in targets]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"error": str(e)}
+            if result.get("exit_code") == 0:
+                ok += 1
+            else:
+                failed += 1
+            yield result
+    finally:
+        # Cliente desconectou: não iniciar os alvos que ainda estão na fila
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    yield {
+        "done": True,
+        "targets": len(targets),
+        "ok": ok,
+        "failed": failed,
+        "width": width,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
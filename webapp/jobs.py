@@ -0,0 +1,291 @@
+# webapp/jobs.py
+"""Fila de jobs em background para operações demoradas de ambientes.
+
+As rotas só registram o job (tabela ``jobs``) e retornam; um pool limitado
+de workers executa create/resume/halt/destroy e atualiza tanto o job quanto
+o ``environments.status`` (ex.: 'creating' -> 'running'/'error'). Cada
+ambiente vive num nó (nodes.py): as ações falam com o nó gravado na linha.
+"""
+import os
+import re
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import manage_env
+import nodes
+import pagecache
+import rootfs
+import snapshots
+import tracing
+
+MAX_WORKERS = int(os.environ.get("CLOUDENV_JOB_WORKERS", 2))
+# Quanto um resume espera por capacidade livre antes de desistir (segundos)
+ADMISSION_WAIT = float(os.environ.get("CLOUDENV_ADMISSION_WAIT", 0))
+
+# Nomes viram diretório, cgroup e hostname: nada de "/", "." ou espaços
+NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$")
+
+# Status intermediários controlados pelos workers (o index não deve sobrescrever)
+TRANSITIONAL = ('creating', 'stopping', 'destroying')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="cloudenv-job")
+
+# Um job por ambiente de cada vez (dentro deste processo)
+_env_locks = {}
+_env_locks_lock = threading.Lock()
+
+
+def _env_lock(name):
+    with _env_locks_lock:
+        return _env_locks.setdefault(name, threading.Lock())
+
+
+def _set_job(job_id, status, result=None):
+    if status == 'running':
+        db.execute('job_started', (status, job_id))
+    else:
+        db.execute('job_finished', (status, result, job_id))
+
+
+def _set_env_status(name, status):
+    db.set_status(name, status)
+    pagecache.DASHBOARD.invalidate()
+
+
+def _admit(backend, name, cpu, mem, write):
+    """Confere a capacidade do nó no banco e grava com ``write(conn)``.
+
+    O ledger do processo já aceitou o pedido, mas outro processo WSGI pode
+    ter admitido ambientes que ele só vê no próximo reseed; sob a trava de
+    admissão a soma do banco decide. Retorna a mensagem de erro ou None.
+    """
+    try:
+        with db.admission(backend.name, name) as (conn, cpu_used, mem_used):
+            error = backend.ledger.shortage(cpu, mem, allocated=(cpu_used, mem_used))
+            if error is None:
+                write(conn)
+            return error
+    except TimeoutError as e:
+        return str(e)
+
+
+# ---------------------------------------------------------------- ações
+
+def _do_create(name, cpu=100, mem=1024, io=10, image=None, node=None):
+    _set_env_status(name, 'creating')
+    backend = nodes.SCHEDULER.get(node)
+    try:
+        r, out, err, path = backend.create_env(name, cpu, mem, io, image=image)
+    except Exception as e:
+        print(f"Erro ao criar ambiente: {e}")
+        r, out, err, path = 1, "", str(e), None
+    return _finish_create(name, r, out, err, path, backend)
+
+
+def _do_clone(name, snapshot_id, cpu=100, mem=1024, io=10):
+    _set_env_status(name, 'creating')
+    try:
+        r, out, err, path = snapshots.clone(snapshot_id, name, cpu, mem, io)
+    except Exception as e:
+        print(f"Erro ao clonar ambiente: {e}")
+        r, out, err, path = 1, "", str(e), None
+    return _finish_create(name, r, out, err, path, nodes.SCHEDULER.local)
+
+
+def _finish_create(name, r, out, err, path, backend):
+    status = 'running' if r == 0 else 'error'
+    if r != 0:
+        backend.release(name)
+    # No nó remoto o caminho é o do host dele: as rotas de log leem pelo nó
+    db.execute('set_created', (status, path if r == 0 else None, backend.log_path(name), name))
+    return r, out or err
+
+
+def _do_resume(name):
+    env = db.get_env(name)
+    if env is None:
+        return 1, "Ambiente não encontrado"
+    backend = nodes.SCHEDULER.for_env(env)
+    # Admissão: o ambiente volta a ocupar CPU/memória no seu nó
+    error = backend.reserve(name, env['cpu'], env['mem'], timeout=ADMISSION_WAIT)
+    if error is None:
+        error = _admit(backend, name, env['cpu'], env['mem'],
+                       lambda conn: db.set_status(name, 'creating', conn=conn))
+        if error:
+            backend.release(name)
+    if error:
+        return 1, error
+    pagecache.DASHBOARD.invalidate()
+
+    # Os limites originais do ambiente, não os padrões do create
+    r, out, err = backend.resume_env(name, env['cpu'], env['mem'], env['io'])
+    if r != 0:
+        backend.release(name)
+    _set_env_status(name, 'running' if r == 0 else 'error')
+    return r, out or err
+
+
+def _do_halt(name):
+    backend = nodes.SCHEDULER.for_name(name)
+    _set_env_status(name, 'stopping')
+    try:
+        r, out, err = backend.halt_env(name)
+    except nodes.NodeError as e:
+        # Sem resposta do nó não dá para dizer que parou
+        _set_env_status(name, 'error')
+        return 1, str(e)
+    _set_env_status(name, 'stopped')
+    backend.release(name)
+    return r, out or err
+
+
+def _do_destroy(name):
+    backend = nodes.SCHEDULER.for_name(name)
+    _set_env_status(name, 'destroying')
+    try:
+        r, out, err = backend.destroy_env(name)
+    except nodes.NodeError as e:
+        # A linha fica (em 'error') para o destroy ser repetido quando o nó voltar
+        _set_env_status(name, 'error')
+        return 1, str(e)
+    db.delete_env(name)
+    backend.release(name)
+    return r, out or err
+
+
+def _do_snapshot(name, snapshot_id):
+    env = db.get_env(name)
+    if env is None:
+        return 1, "Ambiente não encontrado"
+    if nodes.SCHEDULER.for_env(env).remote:
+        return 1, "Snapshots só de ambientes do nó local (o snapshot fica no disco do host do app)"
+    try:
+        meta = snapshots.create(name, snapshot_id, env['cpu'], env['mem'], env['io'])
+    except snapshots.SnapshotError as e:
+        return 1, str(e)
+    return 0, f"Snapshot {snapshot_id} criado ({meta['bytes']} bytes em {meta['copy_ms']} ms)"
+
+
+ACTIONS = {
+    'create': _do_create,
+    'clone': _do_clone,
+    'resume': _do_resume,
+    'halt': _do_halt,
+    'destroy': _do_destroy,
+    'snapshot': _do_snapshot,
+}
+
+
+def _run(job_id, action, name, params):
+    # Um trace por job: as rotas só enfileiram, o trabalho de verdade é aqui
+    trace = tracing.begin(f"job:{action}")
+    lock = _env_lock(name)
+    with tracing.span("wait:env_lock"):
+        lock.acquire()
+    try:
+        _set_job(job_id, 'running')
+        r, message = ACTIONS[action](name, **params)
+        _set_job(job_id, 'done' if r == 0 else 'error', message)
+    except Exception as e:
+        print(f"Erro no job {job_id} ({action} {name}): {e}")
+        traceback.print_exc()
+        try:
+            _set_job(job_id, 'error', str(e))
+            if action in ('create', 'clone', 'resume'):
+                nodes.SCHEDULER.release(name, params.get('node'))
+                _set_env_status(name, 'error')
+        except Exception:
+            pass
+    finally:
+        # set_created/delete_env também mudam o que o dashboard mostra
+        pagecache.DASHBOARD.invalidate()
+        lock.release()
+        tracing.finish(trace, "cloudenv_job_seconds", (("action", action),))
+
+
+# ------------------------------------------------------------------ API
+
+def submit(action, name, **params):
+    """Registra o job na tabela e o coloca na fila. Retorna o id do job."""
+    if action not in ACTIONS:
+        raise ValueError(f"Ação desconhecida: {action}")
+
+    _, job_id = db.execute('insert_job', (name, action, 'queued'))
+    _executor.submit(_run, job_id, action, name, params)
+    return job_id
+
+
+def submit_create(name, cpu, mem, io=10, image=None, snapshot_id=None):
+    """Valida, reserva capacidade, grava a linha e enfileira o create.
+
+    ``image`` é a imagem da raiz (None = a padrão, '' = raiz do host). Com
+    ``snapshot_id`` o ambiente é um clone do snapshot (a imagem é a dele).
+    Retorna (job_id, erro, status HTTP); job_id é None quando há erro.
+    """
+    if not NAME_RE.match(name or ""):
+        return None, "Nome inválido (letras, números, '-' e '_', até 63 caracteres)", 400
+    # Com nós remotos o teto é a capacidade de cada nó, conferida pelo escalonador
+    error = manage_env.validate_limits(cpu, mem, io, host=not nodes.SCHEDULER.remote or bool(snapshot_id))
+    if error:
+        return None, error, 400
+    if image:
+        try:
+            rootfs.image_path(image)
+        except rootfs.RootfsError as e:
+            return None, str(e), 400
+    if db.env_exists(name):
+        return None, f"Ambiente {name} já existe", 409
+
+    # Admissão: recusa se nenhum nó tem CPU/memória livres para o ambiente.
+    # Os snapshots ficam no disco do host do app, então clones nascem nele.
+    if snapshot_id:
+        node, error = nodes.SCHEDULER.local.name, nodes.SCHEDULER.local.reserve(name, cpu, mem)
+    else:
+        node, error = nodes.SCHEDULER.place(name, cpu, mem)
+    if error:
+        return None, error, 409
+
+    try:
+        error = _admit(nodes.SCHEDULER.get(node), name, cpu, mem,
+                       lambda conn: db.insert_env(name, cpu, mem, io, 'creating', node, conn=conn))
+    except Exception:
+        nodes.SCHEDULER.release(name, node)
+        raise
+    if error:
+        nodes.SCHEDULER.release(name, node)
+        return None, error, 409
+
+    # O worker atualiza o status
+    if snapshot_id:
+        return submit('clone', name, snapshot_id=snapshot_id, cpu=cpu, mem=mem, io=io), None, 202
+    return submit('create', name, cpu=cpu, mem=mem, io=io, image=image, node=node), None, 202
+
+
+def submit_clone(name, snapshot_id, cpu=None, mem=None, io=None):
+    """Clone do snapshot; limites não informados vêm do snapshot."""
+    try:
+        meta = snapshots.get(snapshot_id)
+    except snapshots.SnapshotError as e:
+        return None, str(e), 404
+    cpu = meta['cpu'] if cpu is None else cpu
+    mem = meta['mem'] if mem is None else mem
+    io = meta['io'] if io is None else io
+    return submit_create(name, cpu, mem, io, snapshot_id=snapshot_id)
+
+
+def submit_snapshot(name):
+    """Enfileira um snapshot do ambiente. Retorna (job_id, snapshot_id)."""
+    snapshot_id = snapshots.new_id()
+    return submit('snapshot', name, snapshot_id=snapshot_id), snapshot_id
+
+
+def get_job(job_id):
+    return db.fetch_one('get_job', (job_id,))
+
+
+def list_jobs(name=None, limit=50):
+    if name:
+        return db.fetch_all('list_env_jobs', (name, limit))
+    return db.fetch_all('list_jobs', (limit,))
@@ -0,0 +1,211 @@
+# webapp/ledger.py
+"""Ledger de alocação: quanto de CPU e memória os ambientes já reservaram.
+
+A capacidade vem do host (/proc e raiz do cgroup), não de constantes. O
+ledger guarda em memória as reservas de cada ambiente e os totais, então a
+admissão de um create/resume é O(1). Ele é semeado da tabela
+``environments`` (ambientes que ocupam recursos) e ressemeado quando fica
+mais velho que LEDGER_TTL, o que mantém os processos WSGI alinhados entre si.
+
+Quando não há capacidade o pedido é recusado, ou espera até ``timeout``
+segundos por uma liberação (fila de admissão).
+
+O ledger é por processo, então é só a checagem rápida: a palavra final é
+do banco (db.admission), que soma as reservas do nó sob uma trava e grava a
+linha na mesma transação, valendo entre todos os processos WSGI.
+
+Cada host de execução tem o seu ledger (nodes.py): ``node`` filtra as linhas
+do banco pela coluna ``environments.node``. LEDGER é o do host local.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+# Memória deixada para o host (sistema, Apache, MySQL...), em MB
+HOST_RESERVED_MEM = int(os.environ.get("CLOUDENV_HOST_RESERVED_MEM", 512))
+LEDGER_TTL = float(os.environ.get("CLOUDENV_LEDGER_TTL", 10))
+
+# Nó dos ambientes criados neste host (linhas antigas sem a coluna também)
+LOCAL_NODE = "local"
+
+# Status em que o ambiente ocupa CPU/memória
+ALLOCATED_STATUSES = ('creating', 'running', 'stopping')
+
+
+def _read(path):
+    try:
+        return Path(path).read_text()
+    except OSError:
+        return ""
+
+
+def host_capacity(proc=Path("/proc"), cgroup_root=Path("/sys/fs/cgroup")):
+    """(cores, memória em MB) que o host pode dar aos ambientes."""
+    try:
+        cores = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cores = float(os.cpu_count() or 1)
+
+    # Quota da raiz do cgroup (ex.: o host é ele mesmo um container)
+    quota = _read(Path(cgroup_root) / "cpu.max").split()
+    if len(quota) == 2 and quota[0] != "max":
+        cores = min(cores, int(quota[0]) / int(quota[1]))
+
+    mem_mb = 0
+    for line in _read(Path(proc) / "meminfo").splitlines():
+        if line.startswith("MemTotal:"):
+            mem_mb = int(line.split()[1]) // 1024
+            break
+    limit = _read(Path(cgroup_root) / "memory.max").strip()
+    if limit.isdigit():
+        mem_mb = min(mem_mb, int(limit) // (1024 * 1024))
+
+    return cores, max(mem_mb - HOST_RESERVED_MEM, 0)
+
+
+def _check_positive(cpu, mem):
+    # Reserva negativa abriria espaço para os outros (validate_limits recusa antes)
+    if cpu <= 0 or mem <= 0:
+        raise ValueError(f"Reserva inválida: CPU {cpu}%, memória {mem} MB")
+
+
+class Ledger:
+
+    def __init__(self, cpu_capacity=None, mem_capacity=None, ttl=LEDGER_TTL, node=LOCAL_NODE):
+        if cpu_capacity is None or mem_capacity is None:
+            cores, mem = host_capacity()
+            cpu_capacity = cores * 100 if cpu_capacity is None else cpu_capacity
+            mem_capacity = mem if mem_capacity is None else mem_capacity
+        self.cpu_capacity = cpu_capacity  # em % (100 = 1 core)
+        self.mem_capacity = mem_capacity  # em MB
+        self.ttl = ttl
+        self.node = node
+        self.rejected = 0
+        self._entries = {}  # nome -> (cpu, mem, instante da reserva local)
+        self._cpu = 0
+        self._mem = 0
+        self._seeded_at = None
+        self._cond = threading.Condition()
+
+    # ------------------------------------------------------------ semente
+
+    def seed(self, rows=None):
+        """Recarrega as reservas de ``rows`` (ou da tabela environments)."""
+        if rows is None:
+            import db
+            rows = [r for r in db.list_envs()
+                    if r['status'] in ALLOCATED_STATUSES and (r.get('node') or LOCAL_NODE) == self.node]
+
+        with self._cond:
+            now = time.monotonic()
+            entries = {r['name']: (r['cpu'], r['mem'], None) for r in rows}
+            # Reservas locais recentes podem ainda não ter chegado ao banco
+            for name, entry in self._entries.items():
+                if name not in entries and entry[2] is not None and now - entry[2] < self.ttl:
+                    entries[name] = entry
+            self._entries = entries
+            self._cpu = sum(e[0] for e in entries.values())
+            self._mem = sum(e[1] for e in entries.values())
+            self._seeded_at = now
+            self._cond.notify_all()
+
+    def _refresh(self):
+        if self._seeded_at is None or time.monotonic() - self._seeded_at > self.ttl:
+            try:
+                self.seed()
+            except Exception as e:
+                print(f"Aviso: ledger não foi ressemeado do banco: {e}")
+                if self._seeded_at is None:
+                    self._seeded_at = time.monotonic()
+
+    # ----------------------------------------------------------- admissão
+
+    def shortage(self, cpu, mem, allocated=None):
+        """Mensagem de erro se ``cpu``/``mem`` não cabem no nó, ou None.
+
+        ``allocated`` é o (CPU, memória) já reservado; sem ele, o do ledger.
+        """
+        cpu_used, mem_used = allocated if allocated is not None else (self._cpu, self._mem)
+        if cpu_used + cpu > self.cpu_capacity:
+            free = max(self.cpu_capacity - cpu_used, 0)
+            return f"CPU insuficiente: pedido {cpu}%, livre {free:.0f}% de {self.cpu_capacity:.0f}%"
+        if mem_used + mem > self.mem_capacity:
+            free = max(self.mem_capacity - mem_used, 0)
+            return f"Memória insuficiente: pedido {mem} MB, livre {free} MB de {self.mem_capacity} MB"
+        return None
+
+    def reserve(self, name, cpu, mem, timeout=0):
+        """Reserva CPU/memória para ``name``. Retorna a mensagem de erro ou None.
+
+        Com ``timeout`` > 0 espera até lá por capacidade liberada.
+        """
+        _check_positive(cpu, mem)
+        self._refresh()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Reservar de novo o mesmo ambiente só troca os valores
+            old = self._entries.pop(name, None)
+            if old:
+                self._cpu -= old[0]
+                self._mem -= old[1]
+
+            while True:
+                error = self.shortage(cpu, mem)
+                if error is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if old:
+                        self._add(name, old)
+                    self.rejected += 1
+                    return error
+                self._cond.wait(remaining)
+
+            self._add(name, (cpu, mem, time.monotonic()))
+            return None
+
+    def fit(self, cpu, mem):
+        """(carga, erro) se ``cpu``/``mem`` fossem reservados agora.
+
+        A carga é a maior fração ocupada entre CPU e memória; sem espaço ela é
+        None e o erro diz quanto falta. Só leitura: quem reserva é ``reserve``.
+        """
+        _check_positive(cpu, mem)
+        self._refresh()
+        with self._cond:
+            error = self.shortage(cpu, mem)
+            if error:
+                return None, error
+            return max((self._cpu + cpu) / self.cpu_capacity if self.cpu_capacity else 1.0,
+                       (self._mem + mem) / self.mem_capacity if self.mem_capacity else 1.0), None
+
+    def _add(self, name, entry):
+        self._entries[name] = entry
+        self._cpu += entry[0]
+        self._mem += entry[1]
+
+    def release(self, name):
+        with self._cond:
+            entry = self._entries.pop(name, None)
+            if entry:
+                self._cpu -= entry[0]
+                self._mem -= entry[1]
+                self._cond.notify_all()
+
+    # ------------------------------------------------------------ leitura
+
+    def stats(self):
+        with self._cond:
+            return {
+                "node": self.node,
+                "cpu_capacity": self.cpu_capacity,
+                "mem_capacity": self.mem_capacity,
+                "cpu_allocated": self._cpu,
+                "mem_allocated": self._mem,
+                "environments": len(self._entries),
+                "rejected": self.rejected,
+            }
+
+
+LEDGER = Ledger()
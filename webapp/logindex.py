@@ -0,0 +1,385 @@
+# webapp/logindex.py
+"""Índice de busca dos logs dos ambientes (SQLite FTS5).
+
+Uma thread lê, a cada INTERVAL segundos, só os bytes novos de cada
+<ambiente>/logs/<ambiente>.log (offset e inode guardados no próprio índice)
+e grava:
+
+- ``commands``: um registro por comando (marcadores "=== Executando: ... ==="
+  do manage_env, batches, create e halt) com início e código de saída;
+- ``lines``: tabela FTS5 com cada linha não vazia, ligada ao comando em que
+  apareceu.
+
+Rotação: quando o inode muda, o resto do arquivo antigo é lido de log.1 (se
+ainda não foi comprimido) e o novo começa do 0. Ambientes removidos saem do
+índice. O arquivo do índice é só um cache (dá para apagar e reconstruir) e
+fica fora da pasta sincronizada do Vagrant, onde o SQLite não trava direito.
+
+Com vários processos WSGI só um indexa por vez (flock ao lado do índice).
+Roda como thread do Flask (CLOUDENV_LOG_INDEX_INTERVAL=0 desliga) ou sozinho:
+    python3 logindex.py [--once | --rebuild]
+"""
+import fcntl
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import manage_env
+
+INDEX_PATH = Path(os.environ.get("CLOUDENV_LOG_INDEX", "/var/tmp/cloudenv/logindex.db"))
+INTERVAL = float(os.environ.get("CLOUDENV_LOG_INDEX_INTERVAL", 5))
+READ_LIMIT = 8 * 1024 * 1024  # bytes lidos por ambiente por passada
+MAX_LINE = 4096               # linhas maiores são cortadas no índice
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    env TEXT PRIMARY KEY,
+    inode INTEGER,
+    offset INTEGER NOT NULL DEFAULT 0,
+    open_command INTEGER
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    env TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    command TEXT,
+    started_at TEXT,
+    exit_code INTEGER,
+    log_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS commands_env ON commands (env, id);
+CREATE INDEX IF NOT EXISTS commands_exit ON commands (exit_code);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5 (
+    text, env UNINDEXED, command_id UNINDEXED, log_offset UNINDEXED
+);
+"""
+
+# Marcadores escritos pelo manage_env
+HEADERS = (
+    (re.compile(r"^=== Executando: (.*) ===$"), "exec"),
+    (re.compile(r"^=== Executando \(stream\): (.*) ===$"), "stream"),
+    (re.compile(r"^=== Batch (\w+): .* ===$"), "batch"),
+    (re.compile(r"^=== Criando ambiente (.+) ===$"), "create"),
+    (re.compile(r"^=== Parando ambiente (.*) ===$"), "halt"),
+)
+TIMESTAMPED = ("exec", "stream", "batch")  # a linha seguinte ao marcador é a data
+EXIT_RE = re.compile(r"^--- Código de saída: (-?\d+|None) ---$")
+BATCH_EXIT_RE = re.compile(r"^\s+\[\d+\] código de saída: (-?\d+|None)$")
+TIMESTAMP_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+
+COMMAND_FIELDS = ("id", "env", "kind", "command", "started_at", "exit_code", "log_offset")
+
+
+def connect(path=INDEX_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _log_path(env):
+    return manage_env.ENVS_DIR / env / "logs" / f"{env}.log"
+
+
+class _Parser:
+    """Estado da leitura de um log: o comando aberto e as linhas a gravar."""
+
+    def __init__(self, conn, env, open_command):
+        self.conn = conn
+        self.env = env
+        self.command = open_command
+        self.need_timestamp = False
+        self.rows = []
+
+    def feed(self, line, offset):
+        expect_timestamp, self.need_timestamp = self.need_timestamp, False
+        for regex, kind in HEADERS:
+            match = regex.match(line)
+            if match:
+                self._open(kind, match.group(1), offset)
+                break
+        else:
+            match = EXIT_RE.match(line)
+            if match and self.command is not None:
+                self._exit(match.group(1))
+                self.command = None
+            elif expect_timestamp and TIMESTAMP_RE.match(line):
+                self.conn.execute("UPDATE commands SET started_at = ? WHERE id = ?", (line, self.command))
+            elif line == "Background: True" and self.command is not None:
+                self.conn.execute("UPDATE commands SET kind = 'background' WHERE id = ?", (self.command,))
+            else:
+                match = BATCH_EXIT_RE.match(line)
+                if match and self.command is not None and match.group(1) not in ("0", "None"):
+                    # Batch: o código do comando é o primeiro diferente de 0
+                    self.conn.execute("UPDATE commands SET exit_code = ? WHERE id = ? AND exit_code = 0",
+                                      (int(match.group(1)), self.command))
+        if line.strip():
+            self.rows.append((line[:MAX_LINE], self.env, self.command, offset))
+
+    def _open(self, kind, command, offset):
+        exit_code = 0 if kind == "batch" else None
+        cur = self.conn.execute(
+            "INSERT INTO commands (env, kind, command, exit_code, log_offset) VALUES (?, ?, ?, ?, ?)",
+            (self.env, kind, command, exit_code, offset))
+        self.command = cur.lastrowid
+        self.need_timestamp = kind in TIMESTAMPED
+
+    def _exit(self, code):
+        self.conn.execute("UPDATE commands SET exit_code = ? WHERE id = ?",
+                          (None if code == "None" else int(code), self.command))
+
+    def flush(self):
+        if self.rows:
+            self.conn.executemany("INSERT INTO lines (text, env, command_id, log_offset) VALUES (?, ?, ?, ?)",
+                                  self.rows)
+            self.rows = []
+
+
+def _index_bytes(parser, data, base_offset):
+    """Indexa as linhas completas de ``data``. Retorna quantos bytes consumiu."""
+    end = data.rfind(b"\n") + 1
+    if end == 0 and len(data) >= READ_LIMIT:
+        # Linha maior que uma leitura inteira: indexar o pedaço como uma linha
+        parser.feed(data.decode('utf-8', errors='replace'), base_offset)
+        return len(data)
+    pos = 0
+    while pos < end:
+        nl = data.index(b"\n", pos)
+        parser.feed(data[pos:nl].decode('utf-8', errors='replace'), base_offset + pos)
+        pos = nl + 1
+    return end
+
+
+class LogIndexer:
+
+    def __init__(self, interval=INTERVAL, path=INDEX_PATH):
+        self.interval = interval
+        self.path = path
+        self.passes = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.bytes_indexed = 0
+        self._thread = None
+        self._stop = threading.Event()
+        # Uma conexão por thread (a do indexador e as das requisições de busca);
+        # com WAL as buscas não esperam a escrita
+        self._local = threading.local()
+
+    # ------------------------------------------------------------ ciclo
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="logindex", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_locked()
+            self._stop.wait(self.interval)
+
+    def run_locked(self):
+        """Uma passada, se nenhum outro processo estiver indexando."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            lock = open(f"{self.path}.lock", 'a')
+        except OSError as e:
+            self.errors += 1
+            print(f"Erro no índice de logs: {e}")
+            return None
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.skipped += 1
+                return None
+            try:
+                return self.run_once()
+            except (OSError, sqlite3.Error) as e:
+                self.errors += 1
+                print(f"Erro no índice de logs: {e}")
+                return None
+        finally:
+            lock.close()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    # --------------------------------------------------------- passada
+
+    def run_once(self):
+        """Indexa o que cresceu desde a última passada. Retorna os bytes lidos."""
+        start = time.monotonic()
+        conn = self.connection()
+        try:
+            envs = {d.name for d in manage_env.ENVS_DIR.iterdir()
+                    if d.is_dir() and not d.name.startswith('.')}
+        except OSError:
+            envs = set()
+        known = {row["env"]: row for row in conn.execute("SELECT * FROM files")}
+
+        total = 0
+        for env in sorted(envs):
+            total += self._index_env(conn, env, known.get(env))
+        for env in set(known) - envs:
+            self._forget(conn, env)
+
+        self.passes += 1
+        self.bytes_indexed += total
+        self.last_run = time.time()
+        self.last_duration = time.monotonic() - start
+        return total
+
+    def _index_env(self, conn, env, state):
+        path = _log_path(env)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 0
+        inode, offset = (state["inode"], state["offset"]) if state else (None, 0)
+        open_command = state["open_command"] if state else None
+        if inode == st.st_ino and offset == st.st_size:
+            return 0  # nada novo: só um stat por ambiente
+
+        parser = _Parser(conn, env, open_command)
+        total = 0
+        try:
+            with conn:
+                if inode is not None and inode != st.st_ino:
+                    # Rotacionado: terminar o arquivo antigo (log.1, se ainda não virou .gz)
+                    total += self._read(parser, path.with_name(f"{path.name}.1"), offset, inode)
+                    offset = 0
+                elif offset > st.st_size:
+                    offset = 0  # truncado
+                read = self._read(parser, path, offset, st.st_ino)
+                total += read
+                parser.flush()
+                conn.execute(
+                    "INSERT INTO files (env, inode, offset, open_command) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (env) DO UPDATE SET inode = excluded.inode, offset = excluded.offset, "
+                    "open_command = excluded.open_command",
+                    (env, st.st_ino, offset + read, parser.command))
+        except PermissionError:
+            return 0
+        return total
+
+    def _read(self, parser, path, offset, inode):
+        """Indexa ``path`` a partir de ``offset``. Retorna os bytes consumidos."""
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_ino != inode:
+                    return 0
+                f.seek(offset)
+                data = f.read(READ_LIMIT)
+        except FileNotFoundError:
+            return 0
+        return _index_bytes(parser, data, offset)
+
+    def _forget(self, conn, env):
+        with conn:
+            conn.execute("DELETE FROM lines WHERE env = ?", (env,))
+            conn.execute("DELETE FROM commands WHERE env = ?", (env,))
+            conn.execute("DELETE FROM files WHERE env = ?", (env,))
+
+    def rebuild(self):
+        """Apaga o índice e indexa tudo de novo."""
+        conn = self.connection()
+        with conn:
+            for table in ("lines", "commands", "files"):
+                conn.execute(f"DELETE FROM {table}")
+        return self.run_once()
+
+    # ------------------------------------------------------------ busca
+
+    def search(self, query, env=None, kind=None, failed=False, limit=50):
+        """Linhas que casam com ``query`` (todas as palavras), mais recentes primeiro.
+
+        As palavras viram termos entre aspas: pontuação do usuário não vira
+        sintaxe do FTS5.
+        """
+        terms = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+        sql = ("SELECT l.env, l.text, l.log_offset, c.id AS command_id, c.kind, c.command, "
+               "c.started_at, c.exit_code "
+               "FROM lines l LEFT JOIN commands c ON c.id = l.command_id "
+               "WHERE lines MATCH ?")
+        params = [terms]
+        sql, params = self._filters(sql, params, env, kind, failed, prefix="l.", command="c.")
+        sql += " ORDER BY l.rowid DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.connection().execute(sql, params)]
+
+    def commands(self, env=None, kind=None, failed=False, exit_code=None, contains=None, limit=50):
+        """Comandos registrados, mais recentes primeiro."""
+        sql = f"SELECT {', '.join(COMMAND_FIELDS)} FROM commands c WHERE 1 = 1"
+        params = []
+        sql, params = self._filters(sql, params, env, kind, failed, prefix="c.", command="c.")
+        if exit_code is not None:
+            sql += " AND c.exit_code = ?"
+            params.append(exit_code)
+        if contains:
+            sql += " AND instr(c.command, ?) > 0"
+            params.append(contains)
+        sql += " ORDER BY c.id DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.connection().execute(sql, params)]
+
+    @staticmethod
+    def _filters(sql, params, env, kind, failed, prefix, command):
+        if env:
+            sql += f" AND {prefix}env = ?"
+            params.append(env)
+        if kind:
+            sql += f" AND {command}kind = ?"
+            params.append(kind)
+        if failed:
+            sql += f" AND {command}exit_code <> 0"
+        return sql, params
+
+    # ------------------------------------------------------------ leitura
+
+    def stats(self):
+        stats = {
+            "interval": self.interval,
+            "path": str(self.path),
+            "passes": self.passes,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "last_run": self.last_run,
+            "last_pass_ms": round(self.last_duration * 1000, 2),
+            "bytes_indexed": self.bytes_indexed,
+        }
+        try:
+            conn = self.connection()
+            stats["environments"] = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            stats["commands"] = conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+        except (OSError, sqlite3.Error) as e:
+            stats["error"] = str(e)
+        return stats
+
+
+INDEXER = LogIndexer()
+
+
+if __name__ == '__main__':
+    if "--rebuild" in sys.argv[1:]:
+        print(f"{INDEXER.rebuild()} bytes indexados")
+        sys.exit(0)
+    if "--once" in sys.argv[1:] or INDEXER.interval <= 0:
+        print(f"{INDEXER.run_locked()} bytes indexados")
+        sys.exit(0)
+    print(f"Indexando logs a cada {INDEXER.interval:g} s em {INDEXER.path}")
+    INDEXER._loop()
@@ -0,0 +1,152 @@
+# webapp/logtail.py
+"""Leitura incremental de logs: tail por offset e follow via inotify.
+
+O cliente guarda o offset que recebeu e pede só os bytes novos. O follow
+espera eventos do inotify no diretório do log (sem polling) e detecta
+rotação: quando o inode muda ou o arquivo fica menor que o offset,
+recomeça do 0.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+CHUNK_SIZE = 64 * 1024
+MAX_READ = 4 * 1024 * 1024  # máximo devolvido por requisição de tail
+
+# Constantes de <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def read_from(path, offset, max_bytes=MAX_READ):
+    """Lê a partir de ``offset``. Retorna (dados, próximo_offset, reset).
+
+    ``reset`` é True quando o arquivo foi rotacionado/truncado e a leitura
+    recomeçou do início.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        reset = offset > size
+        if reset:
+            offset = 0
+        f.seek(offset)
+        data = f.read(min(max_bytes, size - offset))
+    return data, offset + len(data), reset
+
+
+class Inotify:
+    """Wrapper mínimo do inotify via ctypes (sem dependências extras)."""
+
+    _libc = None
+
+    def __init__(self):
+        if Inotify._libc is None:
+            Inotify._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch falhou: {path}")
+        return wd
+
+    def wait(self, timeout):
+        """Espera eventos até ``timeout`` segundos. Retorna os nomes afetados."""
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if not poller.poll(max(int(timeout * 1000), 1)):
+            return []
+
+        names = []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(buf):
+            _, _, _, length = _EVENT_HEADER.unpack_from(buf, pos)
+            pos += _EVENT_HEADER.size
+            names.append(buf[pos:pos + length].rstrip(b"\0").decode('utf-8', errors='replace'))
+            pos += length
+        return names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def follow(path, offset=0, max_seconds=300, heartbeat=15):
+    """Gera (offset, dados) conforme o log cresce; (offset, None) como heartbeat.
+
+    Termina após ``max_seconds`` (o cliente reconecta com o último offset).
+    """
+    path = str(path)
+    name = os.path.basename(path)
+    deadline = time.monotonic() + max_seconds
+
+    try:
+        watcher = Inotify()
+        watcher.add_watch(os.path.dirname(path), IN_MODIFY | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE)
+    except (OSError, AttributeError):
+        watcher = None  # sem inotify: cair para polling a cada segundo
+
+    inode = None
+    try:
+        while True:
+            # Arquivo trocado (rotação): recomeçar do início do novo arquivo
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if inode is not None and current is not None and current != inode:
+                offset = 0
+                yield 0, b""
+            inode = current if current is not None else inode
+
+            # Esvaziar tudo o que já existe além do offset
+            while True:
+                try:
+                    data, offset, reset = read_from(path, offset, CHUNK_SIZE)
+                except FileNotFoundError:
+                    data, reset = b"", False
+                if reset:
+                    yield 0, b""
+                if not data:
+                    break
+                yield offset, data
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            timeout = min(heartbeat, remaining)
+            if watcher is None:
+                time.sleep(min(1.0, timeout))
+                continue
+
+            start = time.monotonic()
+            names = watcher.wait(timeout)
+            while names and name not in names:
+                # Evento de outro arquivo do diretório (ex.: log.1.gz)
+                left = timeout - (time.monotonic() - start)
+                if left <= 0:
+                    names = []
+                    break
+                names = watcher.wait(left)
+            if not names and time.monotonic() < deadline:
+                yield offset, None
+    finally:
+        if watcher is not None:
+            watcher.close()
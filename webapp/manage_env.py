@@ -6,28 +6,73 @@ from pathlib import Path
 import time
 import signal
 import tempfile
+import json
+import socket
+import threading
+import select
+import errno
+import codecs
+import shlex
+import uuid
+
+from envlog import get_log, flush_log, close_log
+from metrics import LATENCY
+import tracing
+from ledger import host_capacity
+from cgroups import EnvCgroup, CgroupError, CPU_PERIOD, find_block_device
+import rootfs
 
 ROOT = Path(__file__).resolve().parents[1]
-ENVS_DIR = Path("/vagrant/environments")
+ENVS_DIR = Path(os.environ.get("CLOUDENV_ENVS_DIR", "/vagrant/environments"))
 ENVS_DIR.mkdir(exist_ok=True)
 
 # Detectar se está usando cgroups v2
 CGROUP_V2 = Path("/sys/fs/cgroup/cgroup.controllers").exists()
 CGROUP_BASE = Path("/sys/fs/cgroup")
 
-# Configurações fixas da VM
-VM_TOTAL_MEM = 4096  # MB
-VM_TOTAL_CPU = 2     # cores
+# Capacidade real do host (/proc e raiz do cgroup), descontada a reserva do sistema
+VM_TOTAL_CPU, VM_TOTAL_MEM = host_capacity()  # cores, MB
+
+# Helper privilegiado (privhelper.py) - evita um processo sudo por operação.
+# Com CLOUDENV_HELPER=0, ou se o socket não existir, cai no caminho via sudo.
+HELPER_SOCK = os.environ.get("CLOUDENV_HELPER_SOCK", "/run/cloudenv/helper.sock")
+USE_HELPER = os.environ.get("CLOUDENV_HELPER", "1") != "0"
+
+# Esperas por eventos (handshake do init.sh / término do processo), em segundos
+READY_TIMEOUT = float(os.environ.get("CLOUDENV_READY_TIMEOUT", 10))
+HALT_TIMEOUT = float(os.environ.get("CLOUDENV_HALT_TIMEOUT", 2))
+KILL_TIMEOUT = float(os.environ.get("CLOUDENV_KILL_TIMEOUT", 1))
+
+# Supervisor dos jobs em background (PID 1 de cada namespace)
+SUPERVISOR = Path(__file__).resolve().with_name("supervisor.py")
+SUPERVISOR_TIMEOUT = 5  # segundos para respostas que não são "wait"
 
-def run_cmd(cmd, cwd=None, shell=False, check=False):
+# exec em foreground: tempo máximo (s) e saída máxima (bytes, 0 = sem limite)
+EXEC_TIMEOUT = float(os.environ.get("CLOUDENV_EXEC_TIMEOUT", 300))
+EXEC_MAX_OUTPUT = int(os.environ.get("CLOUDENV_EXEC_MAX_OUTPUT", 100 * 1024 * 1024))
+EXEC_CHUNK = 64 * 1024
+
+# Batches de comandos: concorrência máxima e quantos batches guardar por ambiente
+BATCH_MAX_PARALLEL = int(os.environ.get("CLOUDENV_BATCH_MAX_PARALLEL", 8))
+BATCH_KEEP = int(os.environ.get("CLOUDENV_BATCH_KEEP", 20))
+
+# Dispositivo do io.max ("MAJ:MIN"); sem a variável, detecta o disco de ENVS_DIR
+IO_DEVICE = os.environ.get("CLOUDENV_IO_DEVICE")
+
+def run_cmd(cmd, cwd=None, shell=False, check=False, timeout=None):
     """Executa comando com tratamento ULTRA-ROBUSTO de encoding."""
+    tracing.count_spawn(cmd)
+    with tracing.span(f"cmd:{tracing.program(cmd)}"):
+        return _run_cmd(cmd, cwd, shell, check, timeout)
+
+def _run_cmd(cmd, cwd, shell, check, timeout):
     try:
         if isinstance(cmd, list):
             proc = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, 
-                                stderr=subprocess.PIPE, text=False, check=check)
+                                stderr=subprocess.PIPE, text=False, check=check, timeout=timeout)
         else:
             proc = subprocess.run(cmd, cwd=cwd, shell=shell, stdout=subprocess.PIPE, 
-                                stderr=subprocess.PIPE, text=False, check=check)
+                                stderr=subprocess.PIPE, text=False, check=check, timeout=timeout)
         
         try:
             stdout_text = proc.stdout.decode('utf-8', errors='replace')
@@ -56,132 +101,494 @@ def run_cmd(cmd, cwd=None, shell=False, check=False):
             safe_error = "Erro desconhecido"
         return 1, "", safe_error
 
+# ------------------------------------------------------------------
+# Cliente do helper privilegiado
+# ------------------------------------------------------------------
+
+_helper_local = threading.local()
+
+def _helper_conn():
+    conn = getattr(_helper_local, 'conn', None)
+    if conn is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(HELPER_SOCK)
+        conn = (sock, sock.makefile('rb'))
+        _helper_local.conn = conn
+    return conn
+
+def _helper_close():
+    conn = getattr(_helper_local, 'conn', None)
+    _helper_local.conn = None
+    if conn:
+        try:
+            conn[1].close()
+            conn[0].close()
+        except OSError:
+            pass
+
+def _recv_line_fds(sock, max_fds):
+    # Os descritores chegam junto com o primeiro pedaço da resposta
+    data, fds, _, _ = socket.recv_fds(sock, 64 * 1024, max_fds)
+    while data and not data.endswith(b"\n"):
+        more = sock.recv(64 * 1024)
+        if not more:
+            break
+        data += more
+    return data, fds
+
+def helper_call(op, _recv_fds=0, **args):
+    """Envia uma requisição ao helper. Retorna a resposta ou None se indisponível.
+
+    Com ``_recv_fds`` > 0 os descritores anexados à resposta vêm em resp["fds"].
+    """
+    if not USE_HELPER:
+        return None
+
+    args["op"] = op
+    payload = json.dumps(args).encode('utf-8') + b"\n"
+    with tracing.span(f"helper:{op}"):
+        resp = _helper_request(payload, _recv_fds)
+    if resp is not None:
+        tracing.count("cloudenv_helper_calls_total", "op", op)
+        if op in HELPER_SPAWN_OPS:
+            tracing.count_spawn(args.get("argv") or [HELPER_SPAWN_OPS[op]])
+    return resp
+
+# Operações do helper que criam um processo (o programa vem do argv ou daqui)
+HELPER_SPAWN_OPS = {"run": None, "spawn": None, "stream": None, "nsexec": None, "nsstream": None,
+                    "copy": "cp", "archive": "tar", "extract": "tar"}
+
+def _helper_request(payload, _recv_fds):
+    # Uma conexão por thread, reaproveitada; tenta reconectar uma vez
+    for _ in range(2):
+        try:
+            sock, reader = _helper_conn()
+            sock.sendall(payload)
+            if _recv_fds:
+                line, fds = _recv_line_fds(sock, _recv_fds)
+            else:
+                line, fds = reader.readline(), []
+            if line:
+                resp = json.loads(line)
+                resp["fds"] = fds
+                return resp
+        except (OSError, ValueError):
+            pass
+        _helper_close()
+    return None
+
+def helper_available():
+    resp = helper_call("ping")
+    return bool(resp and resp.get("ok"))
+
+# ------------------------------------------------------------------
+# Operações privilegiadas: helper quando disponível, senão sudo
+# ------------------------------------------------------------------
+
+def priv_mkdir(path, mode=0o755, owner="www-data:www-data"):
+    """Cria diretório (com dono e permissão) como root."""
+    resp = helper_call("mkdir", path=str(path), mode=mode, owner=owner)
+    if resp is not None:
+        return resp["ok"]
+
+    r, _, _ = run_cmd(["sudo", "mkdir", "-p", str(path)])
+    if owner:
+        run_cmd(["sudo", "chown", owner, str(path)])
+    if mode is not None:
+        run_cmd(["sudo", "chmod", format(mode, 'o'), str(path)])
+    return r == 0
+
+def priv_write(path, data, mode=0o644, owner="www-data:www-data", append=False):
+    """Escreve (ou acrescenta) conteúdo num arquivo como root.
+
+    Para arquivos de cgroup use mode=None e owner=None.
+    """
+    resp = helper_call("write", path=str(path), data=data, mode=mode, owner=owner, append=append)
+    if resp is not None:
+        return resp["ok"]
+
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as tmp:
+        tmp.write(data)
+        tmp_path = tmp.name
+    try:
+        if append or mode is None:
+            redirect = ">>" if append else ">"
+            r, _, _ = run_cmd(["sudo", "bash", "-c", f"cat {tmp_path} {redirect} {path}"])
+        else:
+            r, _, _ = run_cmd(["sudo", "cp", tmp_path, str(path)])
+        if owner:
+            run_cmd(["sudo", "chown", owner, str(path)])
+        if mode is not None:
+            run_cmd(["sudo", "chmod", format(mode, 'o'), str(path)])
+    finally:
+        os.unlink(tmp_path)
+    return r == 0
+
+def priv_read(path):
+    """Lê um arquivo como root. Retorna None se não existir."""
+    resp = helper_call("read", path=str(path))
+    if resp is not None:
+        return resp.get("data") if resp["ok"] else None
+
+    r, out, err = run_cmd(["sudo", "cat", str(path)])
+    return out if r == 0 else None
+
+def priv_remove(path, recursive=False):
+    """Remove arquivo (ou árvore, com recursive=True) como root."""
+    resp = helper_call("remove", path=str(path), recursive=recursive)
+    if resp is not None:
+        return resp["ok"]
+
+    r, _, _ = run_cmd(["sudo", "rm", "-rf" if recursive else "-f", str(path)])
+    return r == 0
+
+def priv_rmdir(path):
+    """Remove diretório vazio (ex.: cgroup) como root."""
+    resp = helper_call("rmdir", path=str(path))
+    if resp is not None:
+        return resp["ok"]
+
+    r, _, _ = run_cmd(["sudo", "rmdir", str(path)])
+    return r == 0
+
+def priv_rename(src, dst):
+    """Renomeia arquivo/diretório (inclusive cgroups) como root."""
+    resp = helper_call("rename", src=str(src), dst=str(dst))
+    if resp is not None:
+        return resp["ok"]
+
+    r, _, _ = run_cmd(["sudo", "mv", "-T", str(src), str(dst)])
+    return r == 0
+
+def priv_copy(src, dst):
+    """Copia uma árvore preservando tudo (dono, xattrs, whiteouts do overlay).
+
+    Usa reflink quando o sistema de arquivos suporta (cópia quase instantânea).
+    """
+    resp = helper_call("copy", src=str(src), dst=str(dst))
+    if resp is not None:
+        return resp["ok"], resp.get("error")
+
+    r, _, err = run_cmd(["sudo", "cp", "-a", "--reflink=auto", "-T", str(src), str(dst)])
+    return r == 0, err or None
+
+def priv_archive(src_dir, dst_file):
+    """Compacta ``src_dir`` em ``dst_file`` (tar.gz) como root."""
+    resp = helper_call("archive", src=str(src_dir), dst=str(dst_file))
+    if resp is not None:
+        return resp["ok"], resp.get("error")
+
+    r, _, err = run_cmd(["sudo", "tar", "-czf", str(dst_file), "-C", str(src_dir), "."])
+    return r == 0, err or None
+
+def priv_extract(src_file, dst_dir):
+    """Extrai o tar.gz ``src_file`` em ``dst_dir`` como root."""
+    resp = helper_call("extract", src=str(src_file), dst=str(dst_dir))
+    if resp is not None:
+        return resp["ok"], resp.get("error")
+
+    r, _, err = run_cmd(["sudo", "tar", "-xzf", str(src_file), "-C", str(dst_dir)])
+    return r == 0, err or None
+
+def priv_kill(pid, sig=signal.SIGTERM):
+    """Envia sinal a um processo como root. Retorna 0 em caso de sucesso."""
+    resp = helper_call("kill", pid=int(pid), sig=int(sig))
+    if resp is not None:
+        return 0 if resp["ok"] else 1
+
+    r, _, _ = run_cmd(["sudo", "kill", f"-{int(sig)}", str(pid)])
+    return r
+
+def priv_spawn(argv, cwd=None, cgroup=None):
+    """Inicia um processo de longa duração como root. Retorna o PID no host.
+
+    Com ``cgroup`` (diretório de um cgroup v2) o processo entra no cgroup antes
+    do exec, então nenhum filho nasce fora dele.
+    """
+    resp = helper_call("spawn", argv=[str(a) for a in argv], cwd=cwd and str(cwd),
+                       cgroup=cgroup and str(cgroup))
+    if resp is not None:
+        if not resp["ok"]:
+            raise OSError(resp.get("errno") or 0, resp["error"])
+        return resp["pid"]
+
+    prefix = ["sudo"]
+    tracing.count_spawn(argv)
+    if cgroup:
+        prefix += ["sh", "-c", 'echo $$ > "$0" && exec "$@"', str(Path(cgroup) / "cgroup.procs")]
+    proc = subprocess.Popen(prefix + [str(a) for a in argv], cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    return proc.pid
+
+def priv_run(argv, cwd=None, timeout=None):
+    """Executa um comando como root e espera terminar. Retorna (rc, stdout, stderr)."""
+    resp = helper_call("run", argv=[str(a) for a in argv], cwd=cwd and str(cwd), timeout=timeout)
+    if resp is not None:
+        if not resp["ok"]:
+            return 1, "", resp["error"]
+        return resp["rc"], resp["stdout"], resp["stderr"]
+
+    return run_cmd(["sudo"] + [str(a) for a in argv], cwd=cwd, timeout=timeout)
+
+def _nsenter_argv(pid, cwd):
+    # Sem helper: nsenter entra nos namespaces e no diretório, sem shell no meio
+    argv = ["nsenter", "-t", str(pid), "-m", "-u", "-i", "-n", "-p"]
+    if cwd:
+        argv.append(f"--wd={cwd}")
+    return argv
+
+def ns_exec(env_path, pid, argv, cwd=None, cgroup=None, timeout=None):
+    """Roda ``argv`` dentro do ambiente e espera terminar. Retorna (rc, stdout, stderr).
+
+    ``pid`` é o PID 1 do namespace (ns_init_pid). Com o helper o processo
+    nasce direto nos namespaces (descritores em cache por ambiente) e no
+    ``cgroup`` (diretório v2), sem sudo, nsenter nem shell no caminho.
+    """
+    resp = helper_call("nsexec", env=str(env_path), pid=pid, argv=[str(a) for a in argv],
+                       cwd=cwd and str(cwd), cgroup=cgroup and str(cgroup), timeout=timeout)
+    if resp is not None:
+        if not resp["ok"]:
+            return 1, "", resp["error"]
+        return resp["rc"], resp["stdout"], resp["stderr"]
+
+    return priv_run(_nsenter_argv(pid, cwd) + list(argv), timeout=timeout)
+
+def ns_stream(env_path, pid, argv, cwd=None, cgroup=None):
+    """Como priv_stream, mas dentro do ambiente. Retorna (pid, fd de leitura)."""
+    resp = helper_call("nsstream", _recv_fds=1, env=str(env_path), pid=pid, argv=[str(a) for a in argv],
+                       cwd=cwd and str(cwd), cgroup=cgroup and str(cgroup))
+    if resp is not None:
+        if not resp["ok"]:
+            raise OSError(resp.get("errno") or 0, resp["error"])
+        return resp["pid"], resp["fds"][0]
+
+    return priv_stream(_nsenter_argv(pid, cwd) + list(argv))
+
+def ns_drop(env_path):
+    """Fecha os descritores de namespace do ambiente guardados no helper."""
+    helper_call("nsdrop", env=str(env_path))
+
+def _exec_cgroup(name):
+    return CGROUP_BASE / f"cloudenv_{name}" if CGROUP_V2 else None
+
+# Processos de priv_stream iniciados via sudo (sem helper): pid -> Popen
+_local_streams = {}
+
+def priv_stream(argv, cwd=None):
+    """Inicia um comando como root com stdout+stderr num pipe.
+
+    Retorna (pid, fd de leitura). O processo lidera o próprio grupo; o
+    chamador fecha o fd e pega o código de saída com priv_wait.
+    """
+    resp = helper_call("stream", _recv_fds=1, argv=[str(a) for a in argv], cwd=cwd and str(cwd))
+    if resp is not None:
+        if not resp["ok"]:
+            raise OSError(resp.get("errno") or 0, resp["error"])
+        return resp["pid"], resp["fds"][0]
+
+    tracing.count_spawn(argv)
+    proc = subprocess.Popen(["sudo"] + [str(a) for a in argv], cwd=cwd,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, start_new_session=True)
+    read_fd = os.dup(proc.stdout.fileno())
+    proc.stdout.close()
+    _local_streams[proc.pid] = proc
+    return proc.pid, read_fd
+
+def priv_wait(pid, timeout=None):
+    """Código de saída de um processo de priv_stream (None se não terminou)."""
+    proc = _local_streams.get(pid)
+    if proc is None:
+        resp = helper_call("wait", pid=pid, timeout=timeout)
+        return resp["rc"] if resp and resp["ok"] else None
+
+    try:
+        rc = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    _local_streams.pop(pid, None)
+    return rc
+
 def read_file_sudo(filepath):
-    """Lê arquivo usando sudo."""
+    """Lê arquivo com privilégio de root (helper ou sudo)."""
     try:
-        r, out, err = run_cmd(["sudo", "cat", str(filepath)])
-        if r == 0 and out.strip():
+        out = priv_read(filepath)
+        if out and out.strip():
             return out.strip()
         return None
     except Exception:
         return None
 
+def _append_log_priv(log_file, content):
+    priv_write(log_file, content, append=True)
+
 def write_log(log_file, content):
-    """Escreve no log usando sudo."""
+    """Acrescenta ao log do ambiente (buffer em memória, gravado pelo envlog)."""
     try:
-        log_dir = log_file.parent
-        run_cmd(["sudo", "mkdir", "-p", str(log_dir)])
-        run_cmd(["sudo", "chown", "www-data:www-data", str(log_dir)])
-        run_cmd(["sudo", "chmod", "755", str(log_dir)])
-        
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        run_cmd(["sudo", "cp", tmp_path, str(log_file)])
-        run_cmd(["sudo", "chown", "www-data:www-data", str(log_file)])
-        run_cmd(["sudo", "chmod", "644", str(log_file)])
-        os.unlink(tmp_path)
+        if not log_file.parent.exists():
+            priv_mkdir(log_file.parent)
+        get_log(log_file, fallback_writer=_append_log_priv).write(content)
         return True
     except Exception as e:
         print(f"Erro ao escrever log: {e}")
         return False
 
-def get_current_usage():
-    """Calcula CPU e memória já alocados em ambientes existentes."""
-    total_cpu = 0
-    total_mem = 0
-    for env_dir in ENVS_DIR.iterdir():
-        if env_dir.is_dir():
-            db_path = env_dir / "env.pid"
-            if db_path.exists():
-                cpu_file = env_dir / "cpu_alloc.txt"
-                mem_file = env_dir / "mem_alloc.txt"
-                try:
-                    if cpu_file.exists():
-                        total_cpu += float(read_file_sudo(cpu_file) or 0)
-                    if mem_file.exists():
-                        total_mem += int(read_file_sudo(mem_file) or 0)
-                except:
-                    continue
-    return total_cpu, total_mem
-
-def create_env(name, cpu_percent=100, mem=1024, io=10):
-    """Cria um ambiente isolado com limite de CPU em porcentagem e memória da VM."""
-    VM_TOTAL_CPU = 2      # Total de CPUs da VM
-    VM_TOTAL_MEM = 4096   # Memória total da VM em MB
+def validate_limits(cpu_percent, mem, io=0, host=True):
+    """Valida os limites pedidos contra a VM. Retorna a mensagem de erro ou None.
 
-    env_path = ENVS_DIR / name
-    log_file = env_path / "logs" / f"{name}.log"
-    workdir = env_path / "workspace"
-    cgroup_name = f"cloudenv_{name}"
+    Com ``host=False`` só confere se os valores fazem sentido: o teto é o do
+    nó remoto, conferido pelo escalonador.
+    """
+    # Zero ou negativo não é limite: o apply_limits pularia o memory.max e o
+    # ledger contaria capacidade que não existe
+    if cpu_percent <= 0 or mem <= 0 or io < 0:
+        return f"Erro: limites inválidos (CPU {cpu_percent}%, memória {mem} MB, I/O {io} MB/s): CPU e memória devem ser positivas e I/O não negativo"
+    if not host:
+        return None
 
     # ✅ VALIDAÇÃO: Verificar memória
     if mem > VM_TOTAL_MEM:
-        return 1, "", f"Erro: Memória solicitada ({mem} MB) excede limite da VM ({VM_TOTAL_MEM} MB)", ""
+        return f"Erro: Memória solicitada ({mem} MB) excede limite da VM ({VM_TOTAL_MEM} MB)"
 
     # ✅ VALIDAÇÃO: Verificar CPU
-    max_cpu_percent = VM_TOTAL_CPU * 100  # 200% (2 cores = 200%)
+    max_cpu_percent = int(VM_TOTAL_CPU * 100)  # 2 cores = 200%
     if cpu_percent > max_cpu_percent:
-        return 1, "", f"Erro: CPU solicitada ({cpu_percent}%) excede limite da VM ({max_cpu_percent}%)", ""
+        return f"Erro: CPU solicitada ({cpu_percent}%) excede limite da VM ({max_cpu_percent}%)"
+    return None
+
+@LATENCY.track('create')
+def create_env(name, cpu_percent=100, mem=1024, io=10, image=None, lowers=None):
+    """Cria um ambiente isolado com limite de CPU em porcentagem e memória da VM.
+
+    ``image`` é a imagem da raiz copy-on-write ('' = raiz do host). Sem ela,
+    um ambiente que já existe (resume) mantém a sua e um novo usa a padrão.
+    ``lowers`` são camadas de snapshot empilhadas sobre a imagem (clone).
+    """
+    error = validate_limits(cpu_percent, mem, io)
+    if error:
+        return 1, "", error, ""
+
+    env_path = ENVS_DIR / name
+    log_file = env_path / "logs" / f"{name}.log"
+    if image is None:
+        image = rootfs.env_image(env_path) if env_path.exists() else rootfs.DEFAULT_IMAGE
+    return start_env_at(env_path, name, f"cloudenv_{name}", log_file,
+                        cpu_percent=cpu_percent, mem=mem, io=io, image=image, lowers=lowers)
+
+def env_cgroup(cgroup_name):
+    return EnvCgroup(cgroup_name, root=CGROUP_BASE)
+
+def io_device():
+    """Disco que recebe o I/O dos ambientes (ENVS_DIR; se não for bloco, a raiz)."""
+    global IO_DEVICE
+    if IO_DEVICE is None:
+        IO_DEVICE = find_block_device([ENVS_DIR, "/"]) or ""
+    return IO_DEVICE or None
+
+@tracing.traced('phase:cgroup')
+def apply_limits(cgroup_name, cpu_percent, mem, io, log_file):
+    """Cria o cgroup (v2) e aplica os limites de CPU, memória e I/O.
+
+    Retorna a mensagem de erro ou None.
+    """
+    if not CGROUP_V2:
+        return None
+
+    cgroup = env_cgroup(cgroup_name)
+    try:
+        cgroup.create()
+
+        quota = cgroup.set_cpu(cpu_percent)
+        write_log(log_file, f"Configurando CPU: {cpu_percent}% = {quota} de {CPU_PERIOD} microsegundos\n")
+
+        if mem > 0:
+            mem_bytes = cgroup.set_memory(mem)
+            write_log(log_file, f"Configurando Memória: {mem} MB = {mem_bytes} bytes\n")
+
+        if io > 0:
+            device = io_device()
+            if device:
+                io_bps = cgroup.set_io(device, io)
+                write_log(log_file, f"Configurando I/O: {io} MB/s = {io_bps} bytes/s (dispositivo {device})\n")
+            else:
+                write_log(log_file, "⚠ Nenhum dispositivo de bloco encontrado: limite de I/O ignorado\n")
+
+        write_log(log_file, "✓ Cgroups v2 configurados\n")
+        return None
+    except CgroupError as e:
+        write_log(log_file, f"✗ Erro ao configurar cgroups: {e}\n")
+        return f"Erro ao configurar cgroups: {e}"
+
+@tracing.traced('phase:layer')
+def prepare_layer(env_path, image, log_file, lowers=None):
+    """Cria a camada overlay do ambiente e devolve o trecho do init.sh que a monta.
+
+    Só cria diretórios vazios (tempo constante). ``lowers`` (camadas de
+    snapshot, a de cima primeiro) ficam gravadas no ambiente para o resume.
+    Retorna (script, erro).
+    """
+    try:
+        image_dir = rootfs.image_path(image)
+    except rootfs.RootfsError as e:
+        write_log(log_file, f"✗ {e}\n")
+        return None, str(e)
+
+    layer = rootfs.layer_path(env_path, ENVS_DIR)
+    for dir_path in (layer, layer / "upper", layer / "work", layer / "merged"):
+        if not dir_path.exists() and not priv_mkdir(dir_path, owner=None):
+            return None, f"Não foi possível criar a camada {dir_path}"
+    priv_write(env_path / rootfs.IMAGE_FILE, f"{image}\n")
+    if lowers is None:
+        lowers = rootfs.env_lowers(env_path)
+    else:
+        priv_write(env_path / rootfs.LOWERS_FILE, "".join(f"{path}\n" for path in lowers))
+    write_log(log_file, f"Raiz: imagem {image} + camada {layer}"
+                        + (f" ({len(lowers)} camada(s) de snapshot)" if lowers else "") + "\n")
+    return rootfs.init_script(image_dir, layer, env_path, extra_binds=(SUPERVISOR.parent,), lowers=lowers), None
+
+@tracing.traced('phase:start')
+def start_env_at(env_path, name, cgroup_name, log_file, cpu_percent=None, mem=None, io=None, image="", lowers=None):
+    """Monta diretórios, cgroup e namespace em ``env_path``.
+
+    Com cpu_percent=None o cgroup é criado sem limites (usado pelo pool).
+    Com ``image`` a raiz do namespace é a imagem + uma camada overlay própria.
+    """
+    workdir = env_path / "workspace"
 
     # Criar estrutura de diretórios
     for subdir in ['', 'logs', 'workspace']:
         dir_path = env_path / subdir if subdir else env_path
         if not dir_path.exists():
-            run_cmd(["sudo", "mkdir", "-p", str(dir_path)])
-            run_cmd(["sudo", "chown", "www-data:www-data", str(dir_path)])
-            run_cmd(["sudo", "chmod", "755", str(dir_path)])
+            priv_mkdir(dir_path)
 
     pid_file = env_path / "env.pid"
+    ready_fifo = env_path / "ready.fifo"
 
     write_log(log_file, f"=== Criando ambiente {name} ===\n")
-    write_log(log_file, f"CPU: {cpu_percent}% | Memoria: {mem} MB | I/O: {io} MB/s\n")
-
-    # ✅ CORRIGIDO: Configurar cgroups v2 com cálculo correto
-    if CGROUP_V2:
-        cgroup_path = CGROUP_BASE / cgroup_name
+    rootfs_setup = ""
+    if image:
+        rootfs_setup, error = prepare_layer(env_path, image, log_file, lowers)
+        if error:
+            return 1, "", error, ""
+    if cpu_percent is not None:
+        write_log(log_file, f"CPU: {cpu_percent}% | Memoria: {mem} MB | I/O: {io} MB/s\n")
+        error = apply_limits(cgroup_name, cpu_percent, mem, io, log_file)
+        if error:
+            return 1, "", error, ""
+    elif CGROUP_V2:
         try:
-            run_cmd(["sudo", "mkdir", "-p", str(cgroup_path)])
-
-            # ✅ CPU - CÁLCULO CORRETO
-            # cpu.max formato: "MAX PERIOD" em microsegundos
-            # Período padrão: 100000 (100ms)
-            # Para X% de CPU: quota = (X * 100000) / 100
-            # Exemplo: 50% de 1 core = 50000 microsegundos de 100000
-            # Exemplo: 150% (1.5 cores) = 150000 microsegundos de 100000
-            
-            period = 100000  # 100ms em microsegundos
-            quota = int((cpu_percent * period) / 100)  # ✅ FÓRMULA CORRETA
-            
-            write_log(log_file, f"Configurando CPU: {cpu_percent}% = {quota} de {period} microsegundos\n")
-            run_cmd(["sudo", "bash", "-c", f"echo '{quota} {period}' > {cgroup_path}/cpu.max 2>/dev/null || true"])
-
-            # ✅ Memória - já estava correto
-            if mem > 0:
-                mem_bytes = mem * 1024 * 1024
-                write_log(log_file, f"Configurando Memória: {mem} MB = {mem_bytes} bytes\n")
-                run_cmd(["sudo", "bash", "-c", f"echo {mem_bytes} > {cgroup_path}/memory.max 2>/dev/null || true"])
-                # Também configurar memory.high (soft limit)
-                mem_high = int(mem_bytes * 0.9)  # 90% do limite como soft limit
-                run_cmd(["sudo", "bash", "-c", f"echo {mem_high} > {cgroup_path}/memory.high 2>/dev/null || true"])
-
-            # I/O
-            if io > 0:
-                io_bps = io * 1024 * 1024
-                write_log(log_file, f"Configurando I/O: {io} MB/s = {io_bps} bytes/s\n")
-                run_cmd(["sudo", "bash", "-c", f"echo '8:0 rbps={io_bps} wbps={io_bps}' > {cgroup_path}/io.max 2>/dev/null || true"])
-
-            write_log(log_file, "✓ Cgroups v2 configurados com limites corretos\n")
-        except Exception as e:
-            write_log(log_file, f"⚠ Erro ao configurar cgroups: {e}\n")
+            env_cgroup(cgroup_name).create()
+        except CgroupError as e:
+            write_log(log_file, f"✗ Erro ao criar cgroup: {e}\n")
+            return 1, "", str(e), ""
 
     # Criar script init.sh
     init_script = env_path / "init.sh"
     init_content = f"""#!/bin/bash
 echo "=== INICIANDO NAMESPACE ISOLADO ===" >> {log_file}
 echo "PID no namespace: $$" >> {log_file}
-mount -t proc proc /proc
+{rootfs_setup}mount -t proc proc /proc
 echo "PROC montado dentro do namespace" >> {log_file}
 export PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
 export HOME=/root
@@ -192,64 +599,74 @@ ps aux >> {log_file}
 echo "=== FILESYSTEMS MONTADOS ===" >> {log_file}
 mount | grep -E "(proc|sys)" >> {log_file}
 echo "Namespace PID isolado configurado!" >> {log_file}
-exec tail -f /dev/null
+# O supervisor vira o PID 1 (jobs em background, órfãos, SIGTERM do halt) e
+# faz o handshake de prontidão depois de abrir o socket
+if command -v python3 > /dev/null; then
+    exec python3 {SUPERVISOR} {env_path} {ready_fifo}
+fi
+# Handshake de prontidão (1<> abre o FIFO sem bloquear mesmo sem leitor)
+echo ready 1<> {ready_fifo}
+# PID 1 do namespace só recebe SIGTERM do host se tiver handler
+trap 'exit 0' TERM INT
+tail -f /dev/null &
+wait
 """
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as tmp:
-        tmp.write(init_content)
-        tmp_path = tmp.name
-
-    run_cmd(["sudo", "cp", tmp_path, str(init_script)])
-    run_cmd(["sudo", "chmod", "755", str(init_script)])
-    run_cmd(["sudo", "chown", "www-data:www-data", str(init_script)])
-    os.unlink(tmp_path)
+    priv_write(init_script, init_content, mode=0o755)
 
     # Iniciar processo isolado
     try:
         write_log(log_file, "Iniciando processo com PID namespace isolado...\n")
+        # init.sh também escreve no log: gravar o buffer antes para manter a ordem
+        flush_log(log_file)
+        ready_fd = open_ready_fifo(ready_fifo)
 
+        # --kill-child: se o unshare morrer, o namespace inteiro morre junto
         if CGROUP_V2:
             cmd = [
-                "sudo", "unshare",
-                "--fork", "--pid", "--mount-proc", "--uts", "--ipc", "--net",
+                "unshare",
+                "--fork", "--kill-child", "--pid", "--mount-proc", "--uts", "--ipc", "--net",
                 "bash", "-c", f"cd {workdir} && exec {init_script}"
             ]
         else:
             cmd = [
-                "sudo", "cgexec",
+                "cgexec",
                 "-g", f"cpu:{cgroup_name}",
                 "-g", f"memory:{cgroup_name}",
-                "unshare", "--fork", "--pid", "--mount-proc", "--uts", "--ipc", "--net",
+                "unshare", "--fork", "--kill-child", "--pid", "--mount-proc", "--uts", "--ipc", "--net",
                 "bash", "-c", f"cd {workdir} && exec {init_script}"
             ]
 
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
-        host_pid = proc.pid
-        run_cmd(["sudo", "bash", "-c", f"echo {host_pid} > {pid_file}"])
-        run_cmd(["sudo", "chown", "www-data:www-data", str(pid_file)])
-        write_log(log_file, f"PID do host: {host_pid}\n")
-        time.sleep(3)
+        try:
+            # No v2 o processo já nasce no cgroup: todos os descendentes herdam
+            host_pid = priv_spawn(cmd, cgroup=CGROUP_BASE / cgroup_name if CGROUP_V2 else None)
+            priv_write(pid_file, f"{host_pid}\n")
+            write_log(log_file, f"PID do host: {host_pid}\n")
+
+            # Esperar o init.sh sinalizar que está pronto (ou o processo morrer)
+            started = time.perf_counter()
+            ready = wait_ready(ready_fd, host_pid, READY_TIMEOUT)
+        finally:
+            if ready_fd is not None:
+                os.close(ready_fd)
+            priv_remove(ready_fifo)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if ready == "ready":
+            write_log(log_file, f"Namespace pronto em {elapsed_ms:.1f} ms\n")
+        elif ready == "timeout":
+            write_log(log_file, f"⚠ Sem handshake do init.sh após {READY_TIMEOUT:.0f} s\n")
 
         # Verificar se processo está vivo
-        r, _, _ = run_cmd(["sudo", "kill", "-0", str(host_pid)])
-        if r == 0:
+        if ready != "exited" and pid_alive(host_pid):
             if CGROUP_V2:
-                # ✅ Adicionar processo ao cgroup
-                write_log(log_file, f"Adicionando PID {host_pid} ao cgroup {cgroup_name}...\n")
-                run_cmd(["sudo", "bash", "-c", f"echo {host_pid} > /sys/fs/cgroup/{cgroup_name}/cgroup.procs 2>/dev/null || true"])
-                
-                # Verificar se foi adicionado
-                r_check, procs_out, _ = run_cmd(["sudo", "cat", f"/sys/fs/cgroup/{cgroup_name}/cgroup.procs"])
-                if str(host_pid) in procs_out:
-                    write_log(log_file, f"✓ PID {host_pid} adicionado ao cgroup com sucesso\n")
+                if host_pid in env_cgroup(cgroup_name).procs():
+                    write_log(log_file, f"✓ PID {host_pid} no cgroup {cgroup_name}\n")
                 else:
-                    write_log(log_file, f"⚠ PID pode não estar no cgroup\n")
+                    write_log(log_file, f"⚠ PID {host_pid} não está no cgroup {cgroup_name}\n")
 
-            # Verificar isolamento
+            # Verificar isolamento (e já deixar os namespaces em cache no helper)
             try:
-                test_cmd = [
-                    "sudo", "nsenter", "-t", str(host_pid), "-m", "-u", "-i", "-n", "-p", "ps", "aux"
-                ]
-                r2, out, err = run_cmd(test_cmd)
+                r2, out, err = ns_exec(env_path, ns_init_pid(host_pid) or host_pid, ["ps", "aux"])
                 line_count = len([line for line in out.split('\n') if line.strip() and not line.startswith('USER')])
 
                 write_log(log_file, f"✓ Ambiente criado com {line_count} processos visíveis no namespace\n")
@@ -270,39 +687,203 @@ exec tail -f /dev/null
         return 1, "", str(e), ""
 
 
-def status_env(name):
-    """Verifica status do ambiente - VERSÃO CORRIGIDA."""
-    env_path = ENVS_DIR / name
-    if not env_path.exists():
-        return "not_found"
-    
-    pid_file = env_path / "env.pid"
-    pid_content = read_file_sudo(pid_file)
-    
-    if pid_content:
+def read_pid(pid_file):
+    """Lê o PID do arquivo direto (sem fork); usa sudo só se faltar permissão."""
+    try:
+        with open(pid_file, encoding='utf-8') as f:
+            content = f.read().strip()
+    except FileNotFoundError:
+        return None
+    except PermissionError:
+        content = read_file_sudo(pid_file)
+    except OSError:
+        return None
+
+    try:
+        return int(content) if content else None
+    except ValueError:
+        return None
+
+def pid_alive(pid):
+    """Verifica se o PID está vivo consultando /proc (sem sudo kill -0)."""
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            stat = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+    except OSError:
+        # /proc inacessível por algum motivo: assumir vivo como o kill -0 faria
+        return True
+
+    # Formato: "PID (comm) ESTADO ..." - comm pode conter espaços e parênteses
+    end = stat.rfind(b')')
+    state = stat[end + 2:end + 3]
+    # Zumbis (Z) e mortos (X) já não estão rodando
+    return state not in (b'Z', b'X')
+
+def _pidfd(pid):
+    """Abre um pidfd para o processo (Linux 5.3+). None se indisponível."""
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        raise
+    except OSError:
+        return None
+
+@tracing.traced('wait:exit')
+def wait_exit(pid, timeout):
+    """Espera o processo terminar (pidfd + poll). Retorna True se terminou."""
+    try:
+        pidfd = _pidfd(pid)
+    except ProcessLookupError:
+        return True
+
+    if pidfd is not None:
         try:
-            # Este é o PID do HOST
-            host_pid = int(pid_content)
-            
-            # Verificar se o processo HOST ainda está vivo (MÉTODO SIMPLES)
-            r, _, _ = run_cmd(["sudo", "kill", "-0", str(host_pid)])
-            
-            if r == 0:
-                # Processo host está vivo - considerar como RUNNING
-                return "running"
-            else:
-                return "stopped"
-                
-        except (ValueError, ProcessLookupError):
-            return "stopped"
-    
-    return "stopped"
+            poller = select.poll()
+            poller.register(pidfd, select.POLLIN)
+            # pidfd fica legível quando o processo termina
+            if poller.poll(int(timeout * 1000)):
+                return True
+            return not pid_alive(pid)
+        finally:
+            os.close(pidfd)
 
+    # Fallback sem pidfd: consultar /proc com intervalo crescente
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while pid_alive(pid):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.2)
+    return True
+
+def open_ready_fifo(path):
+    """Cria o FIFO de handshake e abre para leitura (sem bloquear)."""
+    try:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        os.mkfifo(path, 0o622)
+        return os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError as e:
+        print(f"Aviso: FIFO de prontidão indisponível ({e})")
+        return None
+
+@tracing.traced('wait:ready')
+def wait_ready(ready_fd, pid, timeout):
+    """Espera o 'ready' do init.sh ou a morte do processo, o que vier primeiro.
+
+    Retorna 'ready', 'exited' ou 'timeout'.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        pidfd = _pidfd(pid)
+    except ProcessLookupError:
+        return "exited"
+
+    poller = select.poll()
+    if ready_fd is not None:
+        poller.register(ready_fd, select.POLLIN)
+    if pidfd is not None:
+        poller.register(pidfd, select.POLLIN)
+
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return "timeout"
+            # Sem pidfd, acordar de tempos em tempos para checar /proc
+            slice_ms = int(remaining * 1000) if pidfd is not None else min(int(remaining * 1000), 50)
+            for fd, event in poller.poll(max(slice_ms, 1)):
+                if fd == pidfd:
+                    return "exited"
+                if event & select.POLLIN:
+                    try:
+                        if b"ready" in os.read(fd, 64):
+                            return "ready"
+                    except OSError as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+                elif event & (select.POLLHUP | select.POLLERR):
+                    # Escritor fechou sem handshake: seguir só com o pidfd
+                    poller.unregister(fd)
+            if pidfd is None and not pid_alive(pid):
+                return "exited"
+            if ready_fd is None and pidfd is None:
+                time.sleep(min(0.05, max(remaining, 0)))
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+def ns_init_pid(host_pid):
+    """Encontra o PID (no host) do processo 1 do namespace criado pelo unshare."""
+    queue = [host_pid]
+    for _ in range(4):  # sudo -> unshare -> init: poucos níveis bastam
+        next_level = []
+        for pid in queue:
+            try:
+                with open(f"/proc/{pid}/status", encoding='utf-8') as f:
+                    for line in f:
+                        if line.startswith("NSpid:"):
+                            ids = line.split()[1:]
+                            if len(ids) > 1 and ids[-1] == "1":
+                                return pid
+                            break
+                with open(f"/proc/{pid}/task/{pid}/children", encoding='utf-8') as f:
+                    next_level.extend(int(c) for c in f.read().split())
+            except (OSError, ValueError):
+                continue
+        queue = next_level
+    return None
+
+def status_all(names=None):
+    """Status real de vários ambientes numa única passada, sem processos extras.
+
+    Retorna {nome: 'running' | 'stopped' | 'not_found'}. Sem ``names``,
+    varre todos os diretórios de ENVS_DIR.
+    """
+    if names is None:
+        try:
+            # Diretórios ocultos (ex.: .pool) não são ambientes
+            names = [d.name for d in ENVS_DIR.iterdir() if d.is_dir() and not d.name.startswith('.')]
+        except OSError:
+            names = []
+
+    result = {}
+    for name in names:
+        env_path = ENVS_DIR / name
+        if not env_path.exists():
+            result[name] = "not_found"
+            continue
+
+        # Este é o PID do HOST
+        host_pid = read_pid(env_path / "env.pid")
+        if host_pid and pid_alive(host_pid):
+            result[name] = "running"
+        else:
+            result[name] = "stopped"
+    return result
+
+def status_env(name):
+    """Verifica status do ambiente (usa o mesmo caminho do status_all)."""
+    return status_all([name])[name]
+
+@LATENCY.track('halt')
 def halt_env(name):
     """Para o ambiente."""
     env_path = ENVS_DIR / name
+    return halt_env_at(env_path, env_path / "logs" / f"{name}.log")
+
+@tracing.traced('phase:halt')
+def halt_env_at(env_path, log_file):
+    """Para o namespace cujo PID está em ``env_path``/env.pid."""
     pid_file = env_path / "env.pid"
-    log_file = env_path / "logs" / f"{name}.log"
     
     pid_content = read_file_sudo(pid_file)
     
@@ -313,31 +894,35 @@ def halt_env(name):
             
             write_log(log_file, f"\n=== Parando ambiente (PID host: {host_pid}) ===\n")
             
-            # Parar processo host (isso para todo o namespace)
-            run_cmd(["sudo", "kill", "-15", str(host_pid)])
-            time.sleep(2)
+            # SIGTERM no PID 1 do namespace (o unshare ignora SIGTERM);
+            # quando ele sai o kernel encerra o namespace inteiro
+            init_pid = ns_init_pid(host_pid)
+            priv_kill(init_pid or host_pid, signal.SIGTERM)
             
-            # Verificar se ainda está vivo
-            r, _, _ = run_cmd(["sudo", "kill", "-0", str(host_pid)])
-            if r == 0:
+            # Esperar o término por evento (pidfd), com limite de tempo
+            if not wait_exit(host_pid, HALT_TIMEOUT):
                 write_log(log_file, "Forcando parada com SIGKILL...\n")
-                run_cmd(["sudo", "kill", "-9", str(host_pid)])
-                time.sleep(1)
+                priv_kill(host_pid, signal.SIGKILL)
+                if init_pid:
+                    priv_kill(init_pid, signal.SIGKILL)
+                wait_exit(host_pid, KILL_TIMEOUT)
             
             # Remover PID file
-            run_cmd(["sudo", "rm", "-f", str(pid_file)])
+            priv_remove(pid_file)
+            ns_drop(env_path)
             write_log(log_file, f"=== Ambiente parado ===\n{time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            flush_log(log_file)
             
         except Exception as e:
             write_log(log_file, f"Erro ao parar ambiente: {e}\n")
     
     return 0, "", ""
 
-def resume_env(name):
-    """Retoma ambiente parado."""
+def resume_env(name, cpu_percent=100, mem=1024, io=10):
+    """Retoma ambiente parado com os limites gravados no banco."""
     # Chama create_env mas retorna apenas 3 valores para compatibilidade
     try:
-        r, out, err, path = create_env(name)
+        r, out, err, path = create_env(name, cpu_percent=cpu_percent, mem=mem, io=io)
         return r, out, err  # Retorna apenas 3 valores
     except Exception as e:
         return 1, "", f"Erro ao retomar ambiente: {str(e)}"
@@ -348,53 +933,72 @@ def destroy_env(name):
     halt_env(name)
     
     env_path = ENVS_DIR / name
-    cgroup_name = f"cloudenv_{name}"
-    
-    # Remover cgroup
+    return destroy_env_at(env_path, f"cloudenv_{name}", env_path / "logs" / f"{name}.log")
+
+@tracing.traced('phase:destroy')
+def destroy_env_at(env_path, cgroup_name, log_file):
+    """Remove cgroup e diretório de um ambiente já parado."""
+    # Remover cgroup (cgroup.kill mata tudo de uma vez)
     if CGROUP_V2:
-        cgroup_path = CGROUP_BASE / cgroup_name
-        if cgroup_path.exists():
-            try:
-                procs_file = cgroup_path / "cgroup.procs"
-                procs_content = read_file_sudo(procs_file)
-                if procs_content:
-                    for pid_line in procs_content.split('\n'):
-                        pid = pid_line.strip()
-                        if pid and pid.isdigit():
-                            run_cmd(["sudo", "kill", "-9", pid])
-                time.sleep(1)
-                run_cmd(["sudo", "rmdir", str(cgroup_path)])
-            except Exception as e:
-                print(f"Aviso ao remover cgroup: {e}")
+        try:
+            env_cgroup(cgroup_name).destroy(KILL_TIMEOUT)
+        except CgroupError as e:
+            print(f"Aviso ao remover cgroup: {e}")
     
-    # Remover diretório
+    # Remover diretório e a camada overlay (o namespace já morreu, nada montado)
+    close_log(log_file)
     if env_path.exists():
-        run_cmd(["sudo", "rm", "-rf", str(env_path)])
+        priv_remove(env_path, recursive=True)
+    layer = rootfs.layer_path(env_path, ENVS_DIR)
+    if layer.exists():
+        priv_remove(layer, recursive=True)
     
     return 0, "", ""
 
-def exec_in_env(name, command, background=False):
-    """Executa comando no ambiente - VERSÃO CORRIGIDA."""
+def _exec_target(name):
+    """(env_path, pid, erro) do ambiente onde um comando vai rodar.
+
+    ``pid`` é o PID 1 do namespace visto do host (o do env.pid é o unshare,
+    que fica fora do namespace de PID).
+    """
     env_path = ENVS_DIR / name
     if not env_path.exists():
-        return 1, "", "Ambiente não encontrado"
+        return env_path, None, "Ambiente não encontrado"
     
     if status_env(name) != "running":
-        return 1, "", "Ambiente não está rodando"
-    
-    log_file = env_path / "logs" / f"{name}.log"
-    workdir = env_path / "workspace"
-    pid_file = env_path / "env.pid"
+        return env_path, None, "Ambiente não está rodando"
     
     # Ler PID do ambiente (PID do HOST)
-    pid_content = read_file_sudo(pid_file)
+    pid_content = read_file_sudo(env_path / "env.pid")
     if not pid_content:
-        return 1, "", "PID do ambiente não encontrado"
+        return env_path, None, "PID do ambiente não encontrado"
     
     try:
         host_pid = int(pid_content)
     except ValueError:
-        return 1, "", "PID inválido"
+        return env_path, None, "PID inválido"
+    init_pid = ns_init_pid(host_pid)
+    if init_pid is None:
+        return env_path, None, "Ambiente não está rodando"
+    return env_path, init_pid, None
+
+def exec_in_env(name, command, background=False, restart="never"):
+    """Executa comando no ambiente - VERSÃO CORRIGIDA.
+
+    Em background o comando vira um job do supervisor (``restart``: never,
+    on-failure ou always). Em foreground ``command`` pode ser uma lista
+    (argv, sem shell); uma string roda com bash -c.
+    """
+    env_path, pid, error = _exec_target(name)
+    if error:
+        return 1, "", error
+    
+    log_file = env_path / "logs" / f"{name}.log"
+    workdir = env_path / "workspace"
+    if isinstance(command, list):
+        argv, command = [str(a) for a in command], shlex.join(str(a) for a in command)
+    else:
+        argv = ["bash", "-c", command]
     
     # Escrever log de início
     safe_log_content = f"\n=== Executando: {command} ===\n{time.strftime('%Y-%m-%d %H:%M:%S')}\nBackground: {background}\n\n"
@@ -402,69 +1006,21 @@ def exec_in_env(name, command, background=False):
     
     try:
         if background:
-            # CORREÇÃO: Comando background - garantir que escreve no log
-            background_script = env_path / f"bg_{int(time.time())}.sh"
-            
-            # Script que redireciona TODO output para o log do ambiente
-            script_content = f"""#!/bin/bash
-cd {workdir}
-echo "INICIANDO BACKGROUND: {command}" >> {log_file}
-
-# Executar o comando e redirecionar TODO output para o log
-{command} >> {log_file} 2>&1
-
-# Quando terminar, avisar
-echo "BACKGROUND FINALIZADO: Exit code: $?" >> {log_file}
-"""
-            
-            # Criar script
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as tmp:
-                tmp.write(script_content)
-                tmp_path = tmp.name
-            
-            run_cmd(["sudo", "cp", tmp_path, str(background_script)])
-            run_cmd(["sudo", "chmod", "755", str(background_script)])
-            run_cmd(["sudo", "chown", "www-data:www-data", str(background_script)])
-            os.unlink(tmp_path)
+            # O supervisor do namespace inicia e acompanha o job
+            flush_log(log_file)
+            resp = supervisor_call(name, "start", command=command, restart=restart)
+            if not resp["ok"]:
+                write_log(log_file, f"✗ Erro ao iniciar background: {resp['error']}\n")
+                return 1, "", resp["error"]
             
-            # CORREÇÃO: Executar o script em background DENTRO do namespace
-            cmd = f"sudo nsenter -t {host_pid} -m -u -i -n -p bash -c 'nohup {background_script} > /dev/null 2>&1 &'"
-            
-            # Executar rapidamente
-            proc = subprocess.run(
-                cmd, 
-                shell=True,
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                timeout=5
-            )
-            
-            # Limpar script (ele já foi copiado)
-            run_cmd(["sudo", "rm", "-f", str(background_script)])
-            
-            return 0, "Comando background iniciado - verifique os logs para ver o output", ""
+            job = resp["job"]
+            return 0, f"Job {job['id']} iniciado em background (PID {job['pid']}) - saída em jobs/{job['id']}/output.log", ""
                 
         else:
-            # Comando foreground (normal)
-            cmd = f"sudo nsenter -t {host_pid} -m -u -i -n -p bash -c 'cd {workdir} && {command}'"
-            
-            proc = subprocess.run(
-                cmd, 
-                shell=True,
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE, 
-            )
-            
-            # Decodificação segura
-            try:
-                stdout_text = proc.stdout.decode('utf-8', errors='replace')
-            except UnicodeDecodeError:
-                stdout_text = proc.stdout.decode('latin-1', errors='replace')
-                
-            try:
-                stderr_text = proc.stderr.decode('utf-8', errors='replace')
-            except UnicodeDecodeError:
-                stderr_text = proc.stderr.decode('latin-1', errors='replace')
+            # Comando foreground: o argv vai inteiro, sem montar string de shell
+            returncode, stdout_text, stderr_text = ns_exec(env_path, pid, argv, cwd=workdir,
+                                                           cgroup=_exec_cgroup(name),
+                                                           timeout=EXEC_TIMEOUT or None)
             
             # Preparar output
             output_lines = []
@@ -478,10 +1034,10 @@ echo "BACKGROUND FINALIZADO: Exit code: $?" >> {log_file}
             safe_output = "\n".join(output_lines)
             
             # Escrever no log
-            log_output = f"--- Saída ---\n{safe_output}\n--- Código de saída: {proc.returncode} ---\n"
+            log_output = f"--- Saída ---\n{safe_output}\n--- Código de saída: {returncode} ---\n"
             write_log(log_file, log_output)
             
-            return proc.returncode, safe_output, stderr_text
+            return returncode, safe_output, stderr_text
             
     except subprocess.TimeoutExpired:
         safe_error = "Timeout: comando excedeu o tempo limite"
@@ -495,4 +1051,246 @@ echo "BACKGROUND FINALIZADO: Exit code: $?" >> {log_file}
             safe_error = "Erro desconhecido"
         
         write_log(log_file, f"✗ Erro na execução: {safe_error}\n")
-        return 1, "", safe_error
\ No newline at end of file
+        return 1, "", safe_error
+
+def supervisor_call(name, op, sock_timeout=SUPERVISOR_TIMEOUT, **args):
+    """Fala com o supervisor do ambiente. Retorna a resposta ({"ok": ...})."""
+    sock_path = ENVS_DIR / name / "supervisor.sock"
+    args["op"] = op
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(sock_timeout)
+            sock.connect(str(sock_path))
+            sock.sendall(json.dumps(args).encode('utf-8') + b"\n")
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        return json.loads(line)
+    except FileNotFoundError:
+        return {"ok": False, "error": "Supervisor não encontrado (ambiente parado ou iniciado sem supervisor)"}
+    except socket.timeout:
+        return {"ok": False, "error": "Timeout falando com o supervisor"}
+    except (OSError, ValueError) as e:
+        return {"ok": False, "error": f"Erro falando com o supervisor: {e}"}
+
+def list_jobs(name):
+    return supervisor_call(name, "list")
+
+def kill_job(name, job_id, sig=signal.SIGTERM):
+    return supervisor_call(name, "kill", id=job_id, sig=int(sig))
+
+def wait_job(name, job_id, timeout=30):
+    # O socket espera um pouco mais que o próprio wait
+    return supervisor_call(name, "wait", sock_timeout=timeout + SUPERVISOR_TIMEOUT, id=job_id, timeout=timeout)
+
+def exec_stream(name, command, timeout=EXEC_TIMEOUT, max_bytes=EXEC_MAX_OUTPUT):
+    """Executa um comando em foreground entregando a saída aos pedaços.
+
+    Gera str: cada pedaço vai para o log do ambiente e para quem consome o
+    gerador, sem acumular a saída em memória. Se o tempo passar de ``timeout``
+    ou a saída passar de ``max_bytes`` (0 = sem limite), o grupo de processos
+    inteiro é morto. O último item é a linha com o código de saída.
+    """
+    env_path, ns_pid, error = _exec_target(name)
+    if error:
+        yield f"✗ {error}\n"
+        return
+    
+    log_file = env_path / "logs" / f"{name}.log"
+    workdir = env_path / "workspace"
+    write_log(log_file, f"\n=== Executando (stream): {command} ===\n{time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+    
+    try:
+        pid, read_fd = ns_stream(env_path, ns_pid, ["bash", "-c", command], cwd=workdir,
+                                 cgroup=_exec_cgroup(name))
+    except OSError as e:
+        write_log(log_file, f"✗ Erro na execução: {e}\n")
+        yield f"✗ Erro na execução: {e}\n"
+        return
+    
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    deadline = time.monotonic() + timeout if timeout else None
+    poller = select.poll()
+    poller.register(read_fd, select.POLLIN)
+    total = 0
+    reason = None
+    finished = False
+    ends_with_newline = True
+    try:
+        while True:
+            wait_ms = 1000
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    reason = f"Timeout: comando excedeu {timeout:g} s"
+                    break
+                wait_ms = max(int(min(remaining, 1.0) * 1000), 1)
+            if not poller.poll(wait_ms):
+                continue
+            
+            chunk = os.read(read_fd, EXEC_CHUNK)
+            if not chunk:
+                break
+            if max_bytes and total + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - total]
+                reason = f"Saída excedeu o limite de {max_bytes} bytes"
+            total += len(chunk)
+            
+            text = decoder.decode(chunk)
+            if text:
+                ends_with_newline = text.endswith("\n")
+                write_log(log_file, text)
+                yield text
+            if reason:
+                break
+        finished = True
+    finally:
+        os.close(read_fd)
+        if reason or not finished:
+            # Timeout, limite ou cliente desconectado: matar o grupo inteiro
+            priv_kill(-pid, signal.SIGKILL)
+            returncode = priv_wait(pid, KILL_TIMEOUT)
+    
+    if not reason:
+        # EOF: esperar o processo (pode ter fechado a saída e continuado)
+        returncode = priv_wait(pid, max(deadline - time.monotonic(), 0) if deadline else None)
+        if returncode is None:
+            reason = f"Timeout: comando excedeu {timeout:g} s"
+            priv_kill(-pid, signal.SIGKILL)
+            returncode = priv_wait(pid, KILL_TIMEOUT)
+    
+    tail = decoder.decode(b"", final=True)
+    if tail or not ends_with_newline:
+        tail += "\n"
+    footer = f"--- Código de saída: {returncode} ---\n"
+    if reason:
+        footer = f"✗ {reason} (grupo de processos encerrado)\n" + footer
+    footer = tail + footer
+    write_log(log_file, footer)
+    yield footer
+
+
+def _batch_script(batch_dir, workdir, commands, parallel, stop_on_error):
+    """Script único que roda todos os comandos dentro do namespace.
+
+    Cada comando grava a saída em <i>.out e o código de saída em <i>.rc.
+    """
+    lines = [
+        "#!/bin/bash",
+        f"exec > {batch_dir}/runner.log 2>&1",
+        f"cd {workdir} || exit 1",
+        "run() {",
+        f'    bash -c "$2" > {batch_dir}/$1.out 2>&1',
+        "    local rc=$?",
+        f"    echo $rc > {batch_dir}/$1.rc",
+        "    return $rc",
+        "}",
+    ]
+    if parallel <= 1:
+        on_error = " || exit 0" if stop_on_error else ""
+        lines += [f"run {i} {shlex.quote(cmd)}{on_error}" for i, cmd in enumerate(commands)]
+    elif not stop_on_error:
+        # Concorrência limitada: no máximo ``parallel`` comandos ao mesmo tempo
+        for i, cmd in enumerate(commands):
+            lines.append(f"run {i} {shlex.quote(cmd)} &")
+            if i + 1 >= parallel:
+                lines.append("wait -n")
+        lines.append("wait")
+    else:
+        # Cada wait -n confere o comando que terminou; na primeira falha o
+        # runner (líder do grupo) mata o grupo todo, menos ele, e para de lançar
+        lines += [
+            "stop() {",
+            "    trap '' TERM",
+            "    kill -TERM 0",
+            "    wait",
+            "    exit 0",
+            "}",
+        ]
+        for i, cmd in enumerate(commands):
+            lines.append(f"run {i} {shlex.quote(cmd)} &")
+            if i + 1 >= parallel:
+                lines.append("wait -n || stop")
+        lines += ["wait -n || stop"] * min(parallel - 1, len(commands))
+    return "\n".join(lines) + "\n"
+
+def _prune_batches(batches_dir):
+    try:
+        batches = sorted(batches_dir.iterdir(), key=lambda d: d.stat().st_mtime)
+    except OSError:
+        return
+    for old in batches[:-BATCH_KEEP] if BATCH_KEEP > 0 else []:
+        priv_remove(old, recursive=True)
+
+def _read_small(path):
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+def exec_batch(name, commands, parallel=1, timeout=EXEC_TIMEOUT, stop_on_error=False):
+    """Roda vários comandos no ambiente com um único processo (bash do runner).
+
+    Em ordem (parallel=1) ou até ``parallel`` ao mesmo tempo. Retorna
+    (erro, resultado): resultado tem o id do batch e, por comando, o código de
+    saída (None se não rodou ou foi interrompido pelo stop_on_error) e o
+    arquivo com a saída.
+    """
+    if not commands:
+        return "Nenhum comando informado", None
+    env_path, ns_pid, error = _exec_target(name)
+    if error:
+        return error, None
+    
+    parallel = max(1, min(int(parallel), BATCH_MAX_PARALLEL))
+    log_file = env_path / "logs" / f"{name}.log"
+    batch_id = uuid.uuid4().hex[:12]
+    batches_dir = env_path / "batches"
+    batch_dir = batches_dir / batch_id
+    priv_mkdir(batch_dir)
+    runner = batch_dir / "run.sh"
+    priv_write(runner, _batch_script(batch_dir, env_path / "workspace", commands, parallel, stop_on_error), mode=0o755)
+    
+    header = "".join(f"  [{i}] {cmd}\n" for i, cmd in enumerate(commands))
+    write_log(log_file, f"\n=== Batch {batch_id}: {len(commands)} comandos (paralelo: {parallel}) ===\n"
+                        f"{time.strftime('%Y-%m-%d %H:%M:%S')}\n{header}")
+    
+    started = time.perf_counter()
+    timed_out = False
+    try:
+        pid, read_fd = ns_stream(env_path, ns_pid, ["bash", str(runner)], cwd=env_path / "workspace",
+                                 cgroup=_exec_cgroup(name))
+    except OSError as e:
+        write_log(log_file, f"✗ Erro ao iniciar batch: {e}\n")
+        return str(e), None
+    # A saída do runner vai para runner.log; o pipe só serve para o ciclo de vida
+    os.close(read_fd)
+    if priv_wait(pid, timeout or None) is None:
+        timed_out = True
+        priv_kill(-pid, signal.SIGKILL)
+        priv_wait(pid, KILL_TIMEOUT)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    results = []
+    for i, command in enumerate(commands):
+        out = batch_dir / f"{i}.out"
+        rc = _read_small(batch_dir / f"{i}.rc")
+        results.append({
+            "index": i,
+            "command": command,
+            "exit_code": int(rc) if rc and rc.lstrip("-").isdigit() else None,
+            "output": str(out) if out.exists() else None,
+            "bytes": out.stat().st_size if out.exists() else 0,
+        })
+    
+    summary = "".join(f"  [{r['index']}] código de saída: {r['exit_code']}\n" for r in results)
+    status = f"✗ Timeout após {timeout:g} s\n" if timed_out else ""
+    write_log(log_file, f"--- Batch {batch_id} ---\n{summary}{status}--- {elapsed_ms:.0f} ms ---\n")
+    _prune_batches(batches_dir)
+    
+    return None, {
+        "batch": batch_id,
+        "parallel": parallel,
+        "timed_out": timed_out,
+        "elapsed_ms": round(elapsed_ms, 1),
+        "results": results,
+    }
@@ -0,0 +1,68 @@
+# webapp/metrics.py
+"""Métricas em memória do processo (latência das operações de ambiente)."""
+import functools
+import threading
+import time
+from collections import deque
+
+SAMPLES = 1000  # amostras mantidas por operação
+
+
+def percentile(values, p):
+    """Percentil p (0-100) de uma lista já ordenada (interpolação linear)."""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class LatencyRecorder:
+    """Guarda as últimas SAMPLES latências de cada operação."""
+
+    def __init__(self, samples=SAMPLES):
+        self.samples = samples
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds):
+        with self._lock:
+            buf = self._data.get(op)
+            if buf is None:
+                buf = self._data[op] = deque(maxlen=self.samples)
+            buf.append(seconds)
+
+    def summary(self, op):
+        with self._lock:
+            values = sorted(self._data.get(op, ()))
+        if not values:
+            return {"count": 0}
+        return {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p90_ms": round(percentile(values, 90) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+
+    def snapshot(self):
+        with self._lock:
+            ops = list(self._data)
+        return {op: self.summary(op) for op in ops}
+
+    def track(self, op):
+        """Decorator que registra a duração de cada chamada da função."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(op, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+
+LATENCY = LatencyRecorder()
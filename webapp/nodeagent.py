@@ -0,0 +1,245 @@
+# webapp/nodeagent.py
+"""Agente de um host de execução: as operações do manage_env por RPC.
+
+O plano de controle (nodes.py) faz POST /rpc/<op> com um objeto JSON e
+recebe outro; exec_stream responde em chunked com a saída do comando. É um
+servidor HTTP/1.1 da biblioteca padrão (uma thread por conexão, conexões
+keep-alive), sem Flask no host de execução.
+
+O agente não fala com o banco: status gravado, reservas e jobs ficam no
+plano de controle, aqui só se executa (com o pool de namespaces e o helper
+privilegiado deste host).
+
+Vários agentes podem rodar no mesmo host para testes, cada um com o seu
+diretório de ambientes e a sua porta:
+
+    CLOUDENV_ENVS_DIR=/tmp/n1 python3 nodeagent.py --port 7071 --cpu 200 --mem 2048
+
+--cpu/--mem (ou CLOUDENV_NODE_CPU/CLOUDENV_NODE_MEM) substituem a capacidade
+lida do host. Com CLOUDENV_NODE_TOKEN o agente exige o mesmo token no
+cabeçalho X-Cloudenv-Node-Token.
+"""
+import argparse
+import base64
+import hmac
+import json
+import os
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import envpool
+import logtail
+import manage_env
+import tracing
+from ledger import host_capacity
+
+NODE_TOKEN = os.environ.get("CLOUDENV_NODE_TOKEN", "")
+NODE_CPU = os.environ.get("CLOUDENV_NODE_CPU")  # em % (100 = 1 core)
+NODE_MEM = os.environ.get("CLOUDENV_NODE_MEM")  # em MB
+
+# Conexão parada há mais que isso é fechada (o cliente reconecta)
+KEEPALIVE_TIMEOUT = float(os.environ.get("CLOUDENV_NODE_KEEPALIVE", 60))
+
+TOKEN_HEADER = "X-Cloudenv-Node-Token"
+
+
+class RpcError(Exception):
+    pass
+
+
+def capacity():
+    """(CPU em %, memória em MB) que este nó oferece."""
+    cores, mem = host_capacity()
+    cpu = float(NODE_CPU) if NODE_CPU else cores * 100
+    return cpu, int(NODE_MEM) if NODE_MEM else mem
+
+
+def _name(args):
+    # O nome vira caminho dentro de ENVS_DIR: nada de "/" ou ".."
+    name = args.get("name")
+    if not isinstance(name, str) or not name or "/" in name or name.startswith("."):
+        raise RpcError(f"Nome de ambiente inválido: {name!r}")
+    return name
+
+
+def _result(r, out, err):
+    return {"code": r, "stdout": out, "stderr": err}
+
+
+# ------------------------------------------------------------ operações
+
+def op_ping(args):
+    cpu, mem = capacity()
+    return {"cpu_capacity": cpu, "mem_capacity": mem, "envs_dir": str(manage_env.ENVS_DIR),
+            "helper": manage_env.helper_available(), "pool": envpool.POOL.stats()}
+
+
+def op_create(args):
+    r, out, err, path = envpool.create_env(_name(args), cpu_percent=args["cpu"], mem=args["mem"],
+                                           io=args.get("io", 10), image=args.get("image"))
+    return {**_result(r, out, err), "path": str(path) if path else None}
+
+
+def op_resume(args):
+    return _result(*manage_env.resume_env(_name(args), cpu_percent=args["cpu"], mem=args["mem"],
+                                          io=args.get("io", 10)))
+
+
+def op_halt(args):
+    return _result(*manage_env.halt_env(_name(args)))
+
+
+def op_destroy(args):
+    return _result(*manage_env.destroy_env(_name(args)))
+
+
+def op_exec_target(args):
+    return {"error": manage_env._exec_target(_name(args))[2]}
+
+
+def op_exec(args):
+    command = args.get("command")
+    if not command or not isinstance(command, (str, list)):
+        raise RpcError("Informe 'command'")
+    return _result(*manage_env.exec_in_env(_name(args), command, background=bool(args.get("background")),
+                                           restart=args.get("restart", "never")))
+
+
+def op_status(args):
+    names = args.get("names")
+    return {"status": manage_env.status_all(names)}
+
+
+def op_logs(args):
+    name = _name(args)
+    path = manage_env.ENVS_DIR / name / "logs" / f"{name}.log"
+    if not path.exists():
+        raise RpcError("Log não encontrado")
+    max_bytes = min(int(args.get("max_bytes", logtail.MAX_READ)), logtail.MAX_READ)
+    data, offset, reset = logtail.read_from(str(path), max(int(args.get("offset", 0)), 0), max_bytes)
+    return {"data": base64.b64encode(data).decode(), "offset": offset, "reset": reset}
+
+
+OPS = {
+    "ping": op_ping,
+    "create": op_create,
+    "resume": op_resume,
+    "halt": op_halt,
+    "destroy": op_destroy,
+    "exec_target": op_exec_target,
+    "exec": op_exec,
+    "status": op_status,
+    "logs": op_logs,
+}
+
+
+# ------------------------------------------------------------- servidor
+
+class RpcHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: a conexão continua aberta entre chamadas (keep-alive)
+    protocol_version = "HTTP/1.1"
+    server_version = "cloudenv-node"
+    timeout = KEEPALIVE_TIMEOUT
+    # Cabeçalhos e corpo saem em writes separados: sem TCP_NODELAY o segundo
+    # espera o ACK atrasado do cliente (~40 ms por chamada)
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if NODE_TOKEN and not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), NODE_TOKEN):
+            return self._reply(403, {"error": "Token do nó inválido"})
+        op = self.path[len("/rpc/"):] if self.path.startswith("/rpc/") else None
+        try:
+            args = json.loads(body or b"{}")
+        except ValueError:
+            return self._reply(400, {"error": "Corpo não é JSON"})
+        if not isinstance(args, dict):
+            return self._reply(400, {"error": "Corpo deve ser um objeto JSON"})
+        if op == "exec_stream":
+            return self._stream(args)
+
+        handler = OPS.get(op)
+        if handler is None:
+            return self._reply(404, {"error": f"Operação desconhecida: {op}"})
+        try:
+            with tracing.span(f"rpc:{op}"):
+                result = handler(args)
+        except RpcError as e:
+            return self._reply(400, {"error": str(e)})
+        except (KeyError, TypeError, ValueError) as e:
+            return self._reply(400, {"error": f"Argumentos inválidos: {e}"})
+        except Exception as e:
+            traceback.print_exc()
+            return self._reply(500, {"error": f"Erro no nó: {e}"})
+        self._reply(200, result)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            return self._reply(404, {"error": "Rota desconhecida"})
+        self._send(200, tracing.render().encode(), "text/plain; version=0.0.4")
+
+    def _reply(self, status, obj):
+        self._send(status, json.dumps(obj).encode(), "application/json")
+
+    def _send(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, args):
+        try:
+            name = _name(args)
+        except RpcError as e:
+            return self._reply(400, {"error": str(e)})
+        # O plano de controle já aplicou os limites pedidos pelo cliente
+        stream = manage_env.exec_stream(name, args.get("command", ""),
+                                        timeout=args.get("timeout") or manage_env.EXEC_TIMEOUT,
+                                        max_bytes=args.get("max_bytes") or manage_env.EXEC_MAX_OUTPUT)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for piece in stream:
+                data = piece.encode()
+                if data:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Cliente foi embora: fechar o gerador mata o comando
+            self.close_connection = True
+        finally:
+            stream.close()
+
+    def log_message(self, format, *args):
+        pass  # uma linha por chamada não ajuda; erros vão para o stderr
+
+
+def main():
+    global NODE_CPU, NODE_MEM
+    parser = argparse.ArgumentParser(description="Agente de execução de ambientes (RPC para o plano de controle)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7070)
+    parser.add_argument("--cpu", help="CPU oferecida, em %% (100 = 1 core)")
+    parser.add_argument("--mem", help="Memória oferecida, em MB")
+    args = parser.parse_args()
+    NODE_CPU = args.cpu or NODE_CPU
+    NODE_MEM = args.mem or NODE_MEM
+
+    envpool.POOL.start()
+    server = ThreadingHTTPServer((args.host, args.port), RpcHandler)
+    cpu, mem = capacity()
+    print(f"Agente em http://{args.host}:{args.port} ({cpu:.0f}% de CPU, {mem} MB, ambientes em {manage_env.ENVS_DIR})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+# webapp/nodes.py
+"""Hosts de execução: o nó local e os agentes remotos (nodeagent.py).
+
+O plano de controle (app, banco, jobs) pode espalhar os ambientes por vários
+hosts. Cada host extra roda o nodeagent.py, que expõe as operações do
+manage_env por RPC (JSON sobre HTTP, conexões keep-alive reaproveitadas por
+thread); os nós vêm de CLOUDENV_NODES="nome=http://host:porta,...". A coluna
+``environments.node`` guarda o dono de cada ambiente e os jobs e as rotas de
+exec/logs/stop falam com ele através de ``SCHEDULER.get(nó)``: o nó local e
+os remotos têm os mesmos métodos, com os mesmos retornos do manage_env.
+
+O create escolhe o nó (``SCHEDULER.place``): entre os nós no ar onde a CPU e
+a memória pedidas cabem, o que fica menos carregado depois da reserva (a
+maior fração ocupada entre CPU e memória). Cada nó tem o seu Ledger, semeado
+das linhas do banco daquele nó; a capacidade de um nó remoto vem do ping ao
+agente, refeito a cada PROBE_TTL segundos.
+
+Sem CLOUDENV_NODES só existe o nó local e tudo funciona como antes.
+"""
+import base64
+import http.client
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import db
+import envpool
+import logtail
+import manage_env
+import tracing
+from ledger import LEDGER, LOCAL_NODE, Ledger
+
+NODES_CONFIG = os.environ.get("CLOUDENV_NODES", "")
+NODE_TOKEN = os.environ.get("CLOUDENV_NODE_TOKEN", "")
+# 0 = o host do app é só plano de controle e não recebe ambientes novos
+LOCAL_PLACEMENT = os.environ.get("CLOUDENV_LOCAL_NODE", "1") != "0"
+RPC_TIMEOUT = float(os.environ.get("CLOUDENV_NODE_TIMEOUT", 60))
+PROBE_TTL = float(os.environ.get("CLOUDENV_NODE_PROBE_TTL", 10))
+PROBE_TIMEOUT = 5
+
+TOKEN_HEADER = "X-Cloudenv-Node-Token"
+
+
+class NodeError(Exception):
+    pass
+
+
+def parse_nodes(config):
+    """[(nome, url)] de "nome=url,nome=url". Levanta ValueError se malformado."""
+    nodes = []
+    for item in config.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition("=")
+        name, url = name.strip(), url.strip()
+        if not sep or not name or not url.startswith("http://"):
+            raise ValueError(f"Nó inválido em CLOUDENV_NODES: {item!r} (use nome=http://host:porta)")
+        if name == LOCAL_NODE:
+            raise ValueError(f"O nome {LOCAL_NODE!r} é reservado ao host do app")
+        nodes.append((name, url.rstrip("/")))
+    return nodes
+
+
+# ------------------------------------------------------------ nó local
+
+class LocalNode:
+    """O host do próprio app: chama o manage_env direto."""
+
+    remote = False
+
+    def __init__(self, ledger=LEDGER):
+        self.name = LOCAL_NODE
+        self.ledger = ledger
+
+    def reserve(self, name, cpu, mem, timeout=0):
+        return self.ledger.reserve(name, cpu, mem, timeout=timeout)
+
+    def release(self, name):
+        self.ledger.release(name)
+
+    def create_env(self, name, cpu, mem, io, image=None):
+        return envpool.create_env(name, cpu_percent=cpu, mem=mem, io=io, image=image)
+
+    def resume_env(self, name, cpu, mem, io):
+        return manage_env.resume_env(name, cpu_percent=cpu, mem=mem, io=io)
+
+    def halt_env(self, name):
+        return manage_env.halt_env(name)
+
+    def destroy_env(self, name):
+        return manage_env.destroy_env(name)
+
+    def exec_target(self, name):
+        """Mensagem de erro se o ambiente não pode receber comandos, ou None."""
+        return manage_env._exec_target(name)[2]
+
+    def exec_in_env(self, name, command, background=False, restart="never"):
+        return manage_env.exec_in_env(name, command, background=background, restart=restart)
+
+    def exec_stream(self, name, command, timeout=manage_env.EXEC_TIMEOUT, max_bytes=manage_env.EXEC_MAX_OUTPUT):
+        return manage_env.exec_stream(name, command, timeout=timeout, max_bytes=max_bytes)
+
+    def status_all(self, names=None):
+        return manage_env.status_all(names)
+
+    def log_path(self, name):
+        return str(manage_env.ENVS_DIR / name / "logs" / f"{name}.log")
+
+    def read_log(self, name, offset, max_bytes=logtail.MAX_READ):
+        """(dados, próximo offset, reset) do log do ambiente, como logtail.read_from."""
+        return logtail.read_from(self.log_path(name), offset, max_bytes)
+
+    def stats(self):
+        return {"name": self.name, "remote": False, "up": True, "placement": LOCAL_PLACEMENT,
+                **self.ledger.stats()}
+
+
+# ---------------------------------------------------------- nó remoto
+
+class RemoteNode:
+    """Cliente RPC de um nodeagent.py."""
+
+    remote = True
+
+    def __init__(self, name, url, token=NODE_TOKEN, timeout=RPC_TIMEOUT):
+        parts = urlsplit(url)
+        self.name = name
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.base = parts.path.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.ledger = None  # criado no primeiro ping (a capacidade vem do agente)
+        self.info = None
+        self.up = False
+        self.error = None
+        self.checked_at = None
+        self.calls = 0
+        self.failures = 0
+        self._local = threading.local()
+        self._probe_lock = threading.Lock()
+
+    # ------------------------------------------------------- transporte
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        return headers
+
+    def _conn(self, timeout):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _drop_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _post(self, op, body, timeout):
+        for attempt in (1, 2):
+            conn = self._conn(timeout)
+            reused = conn.sock is not None
+            try:
+                conn.request("POST", f"{self.base}/rpc/{op}", body, self._headers())
+                resp = conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._drop_conn()
+                # Conexão keep-alive que o agente já tinha fechado: o pedido não chegou
+                if not reused or attempt == 2:
+                    raise
+            except BaseException:
+                self._drop_conn()
+                raise
+
+    def call(self, op, timeout=None, **args):
+        """Executa ``op`` no agente. Retorna o dict da resposta ou levanta NodeError."""
+        body = json.dumps(args).encode()
+        self.calls += 1
+        tracing.count("cloudenv_node_calls_total", "node", self.name)
+        with tracing.span(f"node:{op}"):
+            try:
+                status, data = self._post(op, body, timeout or self.timeout)
+            except (OSError, http.client.HTTPException) as e:
+                self.failures += 1
+                self.up = False
+                self.error = f"Nó {self.name} inacessível: {e}"
+                raise NodeError(self.error)
+        try:
+            reply = json.loads(data)
+        except ValueError:
+            reply = {}
+        if status != 200:
+            raise NodeError(reply.get("error") or f"Nó {self.name} respondeu HTTP {status}")
+        return reply
+
+    # ------------------------------------------------------------ saúde
+
+    def probe(self, force=False):
+        """Pinga o agente se a última resposta é mais velha que PROBE_TTL. Retorna ``up``."""
+        with self._probe_lock:
+            if not force and self.checked_at is not None and time.monotonic() - self.checked_at < PROBE_TTL:
+                return self.up
+            try:
+                info = self.call("ping", timeout=PROBE_TIMEOUT)
+            except NodeError as e:
+                self.up, self.error = False, str(e)
+            else:
+                self.info, self.up, self.error = info, True, None
+                if self.ledger is None:
+                    self.ledger = Ledger(info["cpu_capacity"], info["mem_capacity"], node=self.name)
+                else:
+                    self.ledger.cpu_capacity = info["cpu_capacity"]
+                    self.ledger.mem_capacity = info["mem_capacity"]
+            self.checked_at = time.monotonic()
+            return self.up
+
+    def reserve(self, name, cpu, mem, timeout=0):
+        if not self.probe() or self.ledger is None:
+            return self.error or f"Nó {self.name} fora do ar"
+        return self.ledger.reserve(name, cpu, mem, timeout=timeout)
+
+    def release(self, name):
+        if self.ledger is not None:
+            self.ledger.release(name)
+
+    # --------------------------------------------------------- operações
+
+    def create_env(self, name, cpu, mem, io, image=None):
+        reply = self.call("create", name=name, cpu=cpu, mem=mem, io=io, image=image)
+        return reply["code"], reply["stdout"], reply["stderr"], reply["path"]
+
+    def resume_env(self, name, cpu, mem, io):
+        reply = self.call("resume", name=name, cpu=cpu, mem=mem, io=io)
+        return reply["code"], reply["stdout"], reply["stderr"]
+
+    def halt_env(self, name):
+        reply = self.call("halt", name=name)
+        return reply["code"], reply["stdout"], reply["stderr"]
+
+    def destroy_env(self, name):
+        reply = self.call("destroy", name=name)
+        return reply["code"], reply["stdout"], reply["stderr"]
+
+    def exec_target(self, name):
+        """Como LocalNode.exec_target; levanta NodeError se o nó não responde."""
+        return self.call("exec_target", name=name).get("error")
+
+    def exec_in_env(self, name, command, background=False, restart="never"):
+        try:
+            reply = self.call("exec", timeout=manage_env.EXEC_TIMEOUT + self.timeout,
+                              name=name, command=command, background=background, restart=restart)
+        except NodeError as e:
+            return 1, "", str(e)
+        return reply["code"], reply["stdout"], reply["stderr"]
+
+    def exec_stream(self, name, command, timeout=manage_env.EXEC_TIMEOUT, max_bytes=manage_env.EXEC_MAX_OUTPUT):
+        """Mesmo gerador do manage_env.exec_stream, repassando a resposta chunked do agente."""
+        # Conexão própria: o stream a ocupa até o fim
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=(timeout or manage_env.EXEC_TIMEOUT) + self.timeout)
+        body = json.dumps({"name": name, "command": command, "timeout": timeout, "max_bytes": max_bytes})
+        tracing.count("cloudenv_node_calls_total", "node", self.name)
+        try:
+            conn.request("POST", f"{self.base}/rpc/exec_stream", body.encode(), self._headers())
+            resp = conn.getresponse()
+            if resp.status != 200:
+                yield f"✗ Nó {self.name} respondeu HTTP {resp.status}\n"
+                return
+            for chunk in iter(lambda: resp.read1(manage_env.EXEC_CHUNK), b""):
+                yield chunk.decode("utf-8", errors="replace")
+        except (OSError, http.client.HTTPException) as e:
+            yield f"✗ Nó {self.name} inacessível: {e}\n"
+        finally:
+            conn.close()
+
+    def status_all(self, names=None):
+        return self.call("status", names=names)["status"]
+
+    def log_path(self, name):
+        if self.info is None:
+            self.probe(force=True)
+        envs_dir = self.info["envs_dir"] if self.info else manage_env.ENVS_DIR
+        return f"{envs_dir}/{name}/logs/{name}.log"
+
+    def read_log(self, name, offset, max_bytes=logtail.MAX_READ):
+        reply = self.call("logs", name=name, offset=offset, max_bytes=max_bytes)
+        return base64.b64decode(reply["data"]), reply["offset"], reply["reset"]
+
+    def follow_log(self, name, offset=0, max_seconds=300, heartbeat=15, poll=1.0):
+        """Como logtail.follow, consultando o agente a cada ``poll`` segundos."""
+        deadline = time.monotonic() + max_seconds
+        idle = 0.0
+        while time.monotonic() < deadline:
+            try:
+                data, offset, reset = self.read_log(name, offset)
+            except NodeError:
+                return  # o cliente reconecta com o último offset
+            if reset:
+                yield 0, b""
+            if data:
+                idle = 0.0
+                yield offset, data
+                continue
+            time.sleep(poll)
+            idle += poll
+            if idle >= heartbeat:
+                idle = 0.0
+                yield offset, None
+
+    def stats(self):
+        stats = {"name": self.name, "remote": True, "url": self.url, "up": self.up, "error": self.error,
+                 "calls": self.calls, "failures": self.failures,
+                 "checked_ago": round(time.monotonic() - self.checked_at, 1) if self.checked_at else None}
+        if self.ledger is not None:
+            stats.update(self.ledger.stats())
+        return stats
+
+
+# ---------------------------------------------------------- escalonador
+
+class Scheduler:
+    """Registro dos nós e escolha do nó de cada ambiente novo."""
+
+    def __init__(self, config=NODES_CONFIG, local_placement=LOCAL_PLACEMENT):
+        self.local = LocalNode()
+        self.local_placement = local_placement
+        self.remote = {}
+        try:
+            for name, url in parse_nodes(config):
+                self.remote[name] = RemoteNode(name, url)
+        except ValueError as e:
+            print(f"Aviso: {e}; usando só o nó local")
+            self.remote = {}
+        self.placed = {}  # nó -> ambientes colocados por este processo
+
+    def get(self, name):
+        """O nó ``name`` (None = local). Levanta NodeError se não está configurado."""
+        if not name or name == LOCAL_NODE:
+            return self.local
+        node = self.remote.get(name)
+        if node is None:
+            raise NodeError(f"Nó desconhecido: {name}")
+        return node
+
+    def for_env(self, env):
+        """Nó dono da linha ``env`` de environments (None = local)."""
+        return self.get(env.get('node') if env else None)
+
+    def for_name(self, name):
+        """Nó dono do ambiente ``name``. Só consulta o banco se há nós remotos."""
+        if not self.remote:
+            return self.local
+        return self.for_env(db.get_env(name))
+
+    def nodes(self):
+        return ([self.local] if self.local_placement or not self.remote else []) + list(self.remote.values())
+
+    def place(self, name, cpu, mem):
+        """Reserva CPU/memória no nó menos carregado. Retorna (nó, erro)."""
+        candidates = []
+        errors = []
+        for node in self.nodes():
+            if node.remote and not node.probe():
+                errors.append(node.error)  # a mensagem já tem o nome do nó
+                continue
+            load, error = node.ledger.fit(cpu, mem)
+            if load is None:
+                errors.append(f"{node.name}: {error}" if self.remote else error)
+                continue
+            candidates.append((load, node.name, node))
+
+        for _, _, node in sorted(candidates, key=lambda c: c[:2]):
+            error = node.reserve(name, cpu, mem)
+            if error is None:
+                self.placed[node.name] = self.placed.get(node.name, 0) + 1
+                return node.name, None
+            errors.append(f"{node.name}: {error}" if self.remote else error)  # outra requisição levou o espaço
+
+        if not self.remote:
+            return None, errors[0]
+        return None, "Nenhum nó com capacidade: " + "; ".join(errors)
+
+    def release(self, name, node=None):
+        """Libera a reserva de ``name`` no nó (None = o nó gravado no banco)."""
+        try:
+            if node is None:
+                node = (db.get_env(name) or {}).get('node')
+            self.get(node).release(name)
+        except Exception as e:
+            print(f"Aviso: reserva de {name} não foi liberada: {e}")
+
+    def stats(self):
+        for node in self.remote.values():
+            node.probe()
+        return {
+            "local_placement": self.local_placement,
+            "placed": self.placed,
+            "nodes": [node.stats() for node in [self.local] + list(self.remote.values())],
+        }
+
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,112 @@
+# webapp/pagecache.py
+"""Cache em memória das páginas renderizadas do dashboard.
+
+Cada página (filtro de status, página, tamanho) fica guardada por TTL
+segundos junto com o ETag (hash do HTML) e o Last-Modified, que é o instante
+da última invalidação. Rotas que mudam ambientes e os workers de jobs chamam
+``invalidate()``, que descarta todas as páginas de uma vez.
+
+As páginas ficam em cada processo, mas a geração é compartilhada: o
+``invalidate()`` acrescenta um byte a STAMP_FILE e o ``get()`` compara o
+tamanho e o mtime do arquivo, então uma escrita servida por um processo WSGI
+invalida o cache dos outros na hora (um stat por consulta).
+"""
+import hashlib
+import os
+import threading
+import time
+
+import manage_env
+
+TTL = float(os.environ.get("CLOUDENV_DASHBOARD_TTL", 5))
+MAX_PAGES = 64
+STAMP_FILE = manage_env.ENVS_DIR / ".dashboard.stamp"
+STAMP_MAX = 64 * 1024  # o arquivo recomeça vazio (o mtime muda do mesmo jeito)
+
+
+class PageCache:
+
+    def __init__(self, ttl=TTL, max_pages=MAX_PAGES, stamp_file=STAMP_FILE):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self.stamp_file = stamp_file
+        self.hits = 0
+        self.misses = 0
+        self._local = 0  # invalidações deste processo (se o arquivo falhar)
+        # Segundos inteiros: é a precisão do cabeçalho Last-Modified
+        self._started = int(time.time())
+        self._pages = {}  # chave -> (html, etag, geração, expira em)
+        self._lock = threading.Lock()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.stamp_file)
+        except OSError:
+            return 0, 0
+        return st.st_size, st.st_mtime_ns
+
+    @property
+    def generation(self):
+        """Geração atual: muda a cada invalidação, deste ou de outro processo."""
+        return self._local, self._stamp()
+
+    @property
+    def last_modified(self):
+        return max(self._stamp()[1] // 10**9, self._started)
+
+    def get(self, key):
+        """(html, etag, last_modified) ainda válido para ``key``, ou None."""
+        generation = self.generation
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None or page[2] != generation or page[3] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return page[0], page[1], self.last_modified
+
+    def put(self, key, html, generation=None):
+        """Guarda a página renderizada. Retorna (etag, last_modified).
+
+        ``generation`` é a geração lida antes de consultar o banco: se houve
+        uma invalidação no meio, a página não é guardada (mas o ETag vale).
+        """
+        etag = hashlib.sha1(html.encode('utf-8')).hexdigest()
+        current = self.generation
+        with self._lock:
+            if generation is None or generation == current:
+                if len(self._pages) >= self.max_pages and key not in self._pages:
+                    self._pages.clear()
+                self._pages[key] = (html, etag, current, time.monotonic() + self.ttl)
+        return etag, self.last_modified
+
+    def invalidate(self):
+        with self._lock:
+            self._local += 1
+            self._pages.clear()
+        try:
+            # O_APPEND: o tamanho cresce a cada invalidação, mesmo com mtime grosso
+            flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+            if self._stamp()[0] >= STAMP_MAX:
+                flags |= os.O_TRUNC
+            fd = os.open(self.stamp_file, flags, 0o664)
+            try:
+                os.write(fd, b".")
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Aviso: invalidação do dashboard não foi compartilhada: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "pages": len(self._pages),
+                "generation": self._local,
+                "stamp": self._stamp()[0],
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+DASHBOARD = PageCache()
@@ -0,0 +1,556 @@
+# webapp/privhelper.py
+"""Helper privilegiado de longa duração.
+
+Roda como root (systemd: cloudenv-helper.service) e atende os workers do
+Flask por um socket Unix local. Cada requisição é uma linha JSON
+({"op": "...", ...}) e cada resposta é outra linha JSON ({"ok": true, ...}
+ou {"ok": false, "error": "..."}). As operações são feitas com syscalls
+diretas, sem um processo sudo por operação.
+
+Comandos dentro de um ambiente (nsexec/nsstream) não passam por nsenter nem
+shell: o helper abre /proc/<pid>/ns/* do PID 1 do ambiente uma vez, guarda os
+descritores por ambiente e cria o filho direto nos namespaces (setns na
+thread, depois vfork + exec do argv). O cliente descarta o cache com nsdrop
+quando o ambiente para.
+"""
+import ctypes
+import grp
+import json
+import os
+import pwd
+import shutil
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+SOCKET_PATH = os.environ.get("CLOUDENV_HELPER_SOCK", "/run/cloudenv/helper.sock")
+SOCKET_GROUP = os.environ.get("CLOUDENV_HELPER_GROUP", "www-data")
+
+# Só estes usuários podem falar com o helper
+ALLOWED_USERS = ("root", "www-data")
+
+# Operações de arquivo só são aceitas dentro destas raízes
+ALLOWED_ROOTS = (
+    os.environ.get("CLOUDENV_ENVS_DIR", "/vagrant/environments"),
+    os.environ.get("CLOUDENV_LAYERS_DIR", "/var/lib/cloudenv/layers"),
+    os.environ.get("CLOUDENV_SNAPSHOTS_DIR", "/var/lib/cloudenv/snapshots"),
+    "/sys/fs/cgroup",
+)
+
+# Programas que podem ser executados via spawn/run
+ALLOWED_PROGRAMS = ("unshare", "nsenter", "cgexec")
+
+# Namespaces que o nsexec entra, na ordem do setns (mnt por último: ele troca
+# a raiz e o diretório atual da thread)
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUTS = 0x04000000
+CLONE_NEWIPC = 0x08000000
+CLONE_NEWNET = 0x40000000
+CLONE_NEWPID = 0x20000000
+CLONE_FS = 0x00000200
+NAMESPACES = (("pid", CLONE_NEWPID), ("uts", CLONE_NEWUTS), ("ipc", CLONE_NEWIPC),
+              ("net", CLONE_NEWNET), ("mnt", CLONE_NEWNS))
+
+# Processos iniciados via spawn (reaper evita zumbis)
+_children = []
+_children_lock = threading.Lock()
+
+# Processos com saída em streaming: pid -> (Popen, início); o cliente pega o
+# código de saída com "wait". Os já terminados e esquecidos saem após STREAM_TTL.
+_streams = {}
+STREAM_TTL = 3600
+
+
+class HelperError(Exception):
+    pass
+
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def _setns(fd, nstype):
+    if hasattr(os, "setns"):  # Python 3.12+
+        os.setns(fd, nstype)
+        return
+    if _libc.setns(fd, nstype) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _check_path(path):
+    real = os.path.realpath(path)
+    for root in ALLOWED_ROOTS:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(root + os.sep):
+            return real
+    raise HelperError(f"Caminho fora das raízes permitidas: {path}")
+
+
+def _check_argv(argv):
+    if not argv or not isinstance(argv, list):
+        raise HelperError("argv inválido")
+    if os.path.basename(argv[0]) not in ALLOWED_PROGRAMS:
+        raise HelperError(f"Programa não permitido: {argv[0]}")
+    return [str(a) for a in argv]
+
+
+def _chown(path, owner):
+    if not owner:
+        return
+    user, _, group = owner.partition(":")
+    uid = pwd.getpwnam(user).pw_uid
+    gid = grp.getgrnam(group or user).gr_gid
+    os.chown(path, uid, gid)
+
+
+def _decode(data):
+    try:
+        return data.decode('utf-8', errors='replace')
+    except UnicodeDecodeError:
+        return data.decode('latin-1', errors='replace')
+
+
+# ----------------------------------------------------------------- operações
+
+def op_ping(req):
+    return {"pid": os.getpid(), "namespaces": len(_ns_cache)}
+
+
+def op_mkdir(req):
+    path = _check_path(req["path"])
+    os.makedirs(path, exist_ok=True)
+    if req.get("mode") is not None:
+        os.chmod(path, req["mode"])
+    _chown(path, req.get("owner"))
+    return {}
+
+
+def op_write(req):
+    path = _check_path(req["path"])
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if req.get("append") else os.O_TRUNC)
+    mode = req.get("mode")
+    fd = os.open(path, flags, mode if mode is not None else 0o644)
+    try:
+        os.write(fd, req.get("data", "").encode('utf-8'))
+    finally:
+        os.close(fd)
+    # Arquivos de cgroup não aceitam chmod/chown
+    if mode is not None:
+        os.chmod(path, mode)
+    _chown(path, req.get("owner"))
+    return {}
+
+
+def op_read(req):
+    path = _check_path(req["path"])
+    try:
+        with open(path, 'rb') as f:
+            return {"data": _decode(f.read())}
+    except FileNotFoundError:
+        return {"data": None}
+
+
+def op_remove(req):
+    path = _check_path(req["path"])
+    if req.get("recursive") and os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return {}
+
+
+def op_rmdir(req):
+    os.rmdir(_check_path(req["path"]))
+    return {}
+
+
+def op_rename(req):
+    # rename(2) não sobrescreve diretório não vazio: falha se o destino existir
+    src = _check_path(req["src"])
+    dst = _check_path(req["dst"])
+    if os.path.lexists(dst):
+        raise HelperError(f"Destino já existe: {req['dst']}")
+    os.rename(src, dst)
+    return {}
+
+
+def _tool(argv):
+    # cp/tar rodam só aqui dentro, com caminhos já validados (não via "run")
+    proc = subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise HelperError(_decode(proc.stderr).strip() or f"{argv[0]} falhou ({proc.returncode})")
+    return {}
+
+
+def op_copy(req):
+    src = _check_path(req["src"])
+    dst = _check_path(req["dst"])
+    if os.path.lexists(dst):
+        raise HelperError(f"Destino já existe: {req['dst']}")
+    return _tool(["cp", "-a", "--reflink=auto", "-T", src, dst])
+
+
+def op_archive(req):
+    src = _check_path(req["src"])
+    return _tool(["tar", "-czf", _check_path(req["dst"]), "-C", src, "."])
+
+
+def op_extract(req):
+    dst = _check_path(req["dst"])
+    return _tool(["tar", "-xzf", _check_path(req["src"]), "-C", dst])
+
+
+def op_kill(req):
+    os.kill(int(req["pid"]), int(req.get("sig", signal.SIGTERM)))
+    return {}
+
+
+# Entra no cgroup pelo próprio filho antes do exec (como o fallback com sudo do
+# manage_env.priv_spawn): o processo e tudo que ele criar já nascem dentro do
+# cgroup. Nada de preexec_fn, que não é seguro com as threads do helper e
+# desliga o caminho rápido (vfork) do subprocess.
+ENTER_CGROUP = ["sh", "-c", 'echo $$ > "$0" && exec "$@"']
+
+
+def op_spawn(req):
+    argv = _check_argv(req["argv"])
+    if req.get("cgroup"):
+        argv = ENTER_CGROUP + [os.path.join(_check_path(req["cgroup"]), "cgroup.procs")] + argv
+    proc = subprocess.Popen(
+        argv, cwd=req.get("cwd"),
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    with _children_lock:
+        _children.append(proc)
+    return {"pid": proc.pid}
+
+
+def op_stream(req):
+    """Inicia o processo com stdout+stderr num pipe e devolve a ponta de leitura.
+
+    O fd vai para o cliente via SCM_RIGHTS: a saída não passa pelo helper.
+    O processo lidera o próprio grupo (pgid = pid) para ser morto inteiro.
+    """
+    argv = _check_argv(req["argv"])
+    read_fd, write_fd = os.pipe()
+    try:
+        proc = subprocess.Popen(
+            argv, cwd=req.get("cwd"),
+            stdin=subprocess.DEVNULL, stdout=write_fd, stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    except Exception:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    with _children_lock:
+        _streams[proc.pid] = (proc, time.monotonic())
+    return {"pid": proc.pid, "_fds": [read_fd]}
+
+
+def op_wait(req):
+    with _children_lock:
+        entry = _streams.get(int(req["pid"]))
+    if entry is None:
+        raise HelperError(f"Processo {req['pid']} desconhecido")
+    rc = entry[0].wait(timeout=req.get("timeout"))
+    with _children_lock:
+        _streams.pop(int(req["pid"]), None)
+    return {"rc": rc}
+
+
+def op_run(req):
+    argv = _check_argv(req["argv"])
+    proc = subprocess.run(
+        argv, cwd=req.get("cwd"),
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        timeout=req.get("timeout"),
+    )
+    return {"rc": proc.returncode, "stdout": _decode(proc.stdout), "stderr": _decode(proc.stderr)}
+
+
+# ---------------------------------------------------- exec nos ambientes
+
+class Namespaces:
+    """Descritores de /proc/<pid>/ns/* de um ambiente, abertos uma vez."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.fds = {}
+        try:
+            for name, _ in NAMESPACES:
+                self.fds[name] = os.open(f"/proc/{pid}/ns/{name}", os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            self.close()
+            raise
+        self.pid_ns = os.fstat(self.fds["pid"]).st_ino
+
+    def valid(self):
+        # O PID pode ter sido reaproveitado: confere se ainda é o mesmo namespace
+        try:
+            return os.stat(f"/proc/{self.pid}/ns/pid").st_ino == self.pid_ns
+        except OSError:
+            return False
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+
+_ns_cache = {}  # ambiente -> Namespaces
+_ns_lock = threading.Lock()
+_own_ns = {}  # namespaces do próprio helper, para a thread voltar depois do spawn
+_thread_fs = threading.local()
+
+
+def _namespaces(env, pid):
+    # Chamado com _ns_lock
+    pid = int(pid)
+    cached = _ns_cache.get(env)
+    if cached is not None and cached.pid == pid and cached.valid():
+        return cached
+    if cached is not None:
+        cached.close()
+        del _ns_cache[env]
+    ns = Namespaces(pid)
+    if ns.pid_ns == os.fstat(_own_ns["pid"]).st_ino:
+        ns.close()
+        raise HelperError(f"PID {pid} não está no namespace de um ambiente")
+    _ns_cache[env] = ns
+    return ns
+
+
+def _switch(fds):
+    for name, nstype in NAMESPACES:
+        _setns(fds[name], nstype)
+
+
+def _ns_popen(req, **kwargs):
+    """Popen do argv dentro dos namespaces do ambiente (e do cgroup dele).
+
+    Namespaces são por thread: a thread do pedido entra nos do ambiente, cria
+    o filho (vfork, sem código Python no filho) e volta. O mnt exige que a
+    thread tenha o próprio fs (unshare CLONE_FS), feito uma vez por thread.
+    """
+    if not req.get("argv") or not isinstance(req["argv"], list):
+        raise HelperError("argv inválido")
+    argv = [str(a) for a in req["argv"]]
+    procs_file = None
+    if req.get("cgroup"):
+        procs_file = os.path.join(_check_path(req["cgroup"]), "cgroup.procs")
+
+    if not getattr(_thread_fs, "unshared", False):
+        if _libc.unshare(CLONE_FS) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        _thread_fs.unshared = True
+
+    # O lock vai até o fork: um nsdrop no meio fecharia os descritores
+    with _ns_lock:
+        ns = _namespaces(req["env"], req["pid"])
+        try:
+            _switch(ns.fds)
+            # cwd é resolvido pelo filho, já na raiz do ambiente
+            proc = subprocess.Popen(argv, cwd=req.get("cwd") or "/", start_new_session=True, **kwargs)
+        finally:
+            try:
+                _switch(_own_ns)
+            except OSError as e:
+                # Thread presa no ambiente não pode continuar mexendo em arquivos
+                print(f"✗ Não foi possível voltar aos namespaces do helper: {e}")
+                os._exit(1)
+
+    if procs_file:
+        try:
+            with open(procs_file, 'w') as f:
+                f.write(str(proc.pid))
+        except OSError:
+            pass  # o processo já terminou
+    return proc
+
+
+def op_nsexec(req):
+    proc = _ns_popen(req, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        out, err = proc.communicate(timeout=req.get("timeout"))
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.communicate()
+        raise
+    return {"rc": proc.returncode, "stdout": _decode(out), "stderr": _decode(err)}
+
+
+def op_nsstream(req):
+    """Como "stream", mas dentro do ambiente (o cliente pega o rc com "wait")."""
+    read_fd, write_fd = os.pipe()
+    try:
+        proc = _ns_popen(req, stdin=subprocess.DEVNULL, stdout=write_fd, stderr=subprocess.STDOUT)
+    except Exception:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    with _children_lock:
+        _streams[proc.pid] = (proc, time.monotonic())
+    return {"pid": proc.pid, "_fds": [read_fd]}
+
+
+def op_nsdrop(req):
+    # Os descritores seguram o namespace vivo: fechar quando o ambiente para
+    with _ns_lock:
+        ns = _ns_cache.pop(req["env"], None)
+        if ns is not None:
+            ns.close()
+    return {"dropped": ns is not None}
+
+
+def _sweep_namespaces():
+    with _ns_lock:
+        for env, ns in list(_ns_cache.items()):
+            if not ns.valid():
+                ns.close()
+                del _ns_cache[env]
+
+
+OPS = {
+    "ping": op_ping,
+    "mkdir": op_mkdir,
+    "write": op_write,
+    "read": op_read,
+    "remove": op_remove,
+    "rmdir": op_rmdir,
+    "rename": op_rename,
+    "copy": op_copy,
+    "archive": op_archive,
+    "extract": op_extract,
+    "kill": op_kill,
+    "spawn": op_spawn,
+    "run": op_run,
+    "stream": op_stream,
+    "wait": op_wait,
+    "nsexec": op_nsexec,
+    "nsstream": op_nsstream,
+    "nsdrop": op_nsdrop,
+}
+
+
+def handle_request(req):
+    """Executa uma requisição e monta a resposta (nunca levanta exceção)."""
+    try:
+        op = OPS.get(req.get("op"))
+        if op is None:
+            raise HelperError(f"Operação desconhecida: {req.get('op')}")
+        resp = op(req)
+        resp["ok"] = True
+        return resp
+    except subprocess.TimeoutExpired:
+        return {"ok": False, "error": "Timeout: comando excedeu o tempo limite", "errno": None}
+    except Exception as e:
+        return {"ok": False, "error": str(e), "errno": getattr(e, "errno", None)}
+
+
+# ------------------------------------------------------------------ servidor
+
+def _allowed_uids():
+    uids = set()
+    for user in ALLOWED_USERS:
+        try:
+            uids.add(pwd.getpwnam(user).pw_uid)
+        except KeyError:
+            pass
+    return uids
+
+
+class HelperHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        if uid not in self.server.allowed_uids:
+            self._send({"ok": False, "error": f"UID {uid} não autorizado"})
+            return
+
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+            except ValueError:
+                self._send({"ok": False, "error": "JSON inválido"})
+                continue
+            self._send(handle_request(req))
+
+    def _send(self, resp):
+        fds = resp.pop("_fds", None)
+        payload = json.dumps(resp).encode('utf-8') + b"\n"
+        if not fds:
+            self.wfile.write(payload)
+            self.wfile.flush()
+            return
+        # Resposta com descritores anexados (SCM_RIGHTS)
+        self.wfile.flush()
+        try:
+            socket.send_fds(self.request, [payload], fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _reaper():
+    """Recolhe processos filhos que já terminaram."""
+    while True:
+        now = time.monotonic()
+        with _children_lock:
+            _children[:] = [p for p in _children if p.poll() is None]
+            for pid, (proc, started) in list(_streams.items()):
+                if proc.poll() is not None and now - started > STREAM_TTL:
+                    del _streams[pid]
+        # Ambiente que morreu sem nsdrop (ex.: o processo caiu sozinho)
+        _sweep_namespaces()
+        time.sleep(1)
+
+
+def serve(path=SOCKET_PATH):
+    for name, _ in NAMESPACES:
+        _own_ns[name] = os.open(f"/proc/self/ns/{name}", os.O_RDONLY | os.O_CLOEXEC)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    server = HelperServer(path, HelperHandler)
+    server.allowed_uids = _allowed_uids()
+    try:
+        os.chown(path, 0, grp.getgrnam(SOCKET_GROUP).gr_gid)
+    except KeyError:
+        pass
+    os.chmod(path, 0o660)
+
+    threading.Thread(target=_reaper, daemon=True).start()
+    print(f"Helper privilegiado ouvindo em {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    if os.geteuid() != 0:
+        print("✗ O helper precisa rodar como root")
+        sys.exit(1)
+    serve(sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH)
@@ -0,0 +1,263 @@
+# webapp/reconciler.py
+"""Reconciliador: mantém environments.status alinhado com o host.
+
+A cada INTERVAL segundos compara a tabela ``environments`` com ENVS_DIR, o
+PID de cada namespace e os cgroups cloudenv_*, e então:
+
+- corrige os status divergentes num único UPDATE (ambiente cujo diretório
+  sumiu vira 'error'; namespace morto vira 'stopped');
+- mata processos que sobraram no cgroup de ambientes parados;
+- remove diretórios parados e cgroups sem linha no banco (órfãos), depois de
+  ORPHAN_GRACE segundos.
+
+Ambientes em status transitório ou com job em andamento neste processo não
+são tocados. Com vários processos WSGI só um reconcilia por vez (flock em
+ENVS_DIR/.reconciler.lock).
+
+Ambientes de nós remotos (nodes.py) só têm o status conferido, com um
+``status`` por nó ao agente; nó fora do ar fica para a próxima passada. Os
+órfãos de cada host remoto não são procurados daqui.
+
+Roda como thread do Flask (CLOUDENV_RECONCILE_INTERVAL=0 desliga) ou sozinho:
+    python3 reconciler.py [--once]
+"""
+import fcntl
+import os
+import sys
+import threading
+import time
+
+import db
+import jobs
+import manage_env
+import nodes
+import pagecache
+from cgroups import CgroupError
+from ledger import LOCAL_NODE
+
+INTERVAL = float(os.environ.get("CLOUDENV_RECONCILE_INTERVAL", 15))
+ORPHAN_GRACE = float(os.environ.get("CLOUDENV_ORPHAN_GRACE", 300))
+LOCK_FILE = manage_env.ENVS_DIR / ".reconciler.lock"
+
+CGROUP_PREFIX = "cloudenv_"
+POOL_PREFIX = "cloudenv_pool_"  # slots do pool são do envpool
+
+COUNTERS = ("status_fixed", "marked_error", "marked_stopped", "marked_running",
+            "leftover_killed", "orphan_dirs_removed", "orphan_cgroups_removed",
+            "orphans_running", "nodes_unreachable", "errors")
+
+
+def _env_dirs():
+    try:
+        return {d.name for d in manage_env.ENVS_DIR.iterdir() if d.is_dir() and not d.name.startswith('.')}
+    except OSError:
+        return set()
+
+
+def _env_cgroups():
+    if not manage_env.CGROUP_V2:
+        return set()
+    try:
+        return {e.name[len(CGROUP_PREFIX):] for e in os.scandir(manage_env.CGROUP_BASE)
+                if e.name.startswith(CGROUP_PREFIX) and not e.name.startswith(POOL_PREFIX) and e.is_dir()}
+    except OSError:
+        return set()
+
+
+def _age(path):
+    try:
+        return time.time() - path.stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+class Reconciler:
+
+    def __init__(self, interval=INTERVAL, orphan_grace=ORPHAN_GRACE):
+        self.interval = interval
+        self.orphan_grace = orphan_grace
+        self.passes = 0
+        self.skipped = 0  # passadas feitas por outro processo (lock ocupado)
+        self.last_run = None
+        self.last_duration = 0.0
+        self.last_report = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------ ciclo
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_locked()
+            self._stop.wait(self.interval)
+
+    def run_locked(self):
+        """Uma passada, se nenhum outro processo estiver reconciliando."""
+        try:
+            lock = open(LOCK_FILE, 'a')
+        except OSError:
+            lock = None  # sem permissão para o lock: reconcilia assim mesmo
+        try:
+            if lock is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.skipped += 1
+                    return None
+            try:
+                return self.run_once()
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"Erro na reconciliação: {e}")
+                return None
+        finally:
+            if lock is not None:
+                lock.close()
+
+    # --------------------------------------------------------- passada
+
+    def run_once(self):
+        """Compara banco e host e corrige. Retorna o relatório da passada."""
+        start = time.monotonic()
+        conn = db.get_db()
+        try:
+            report = self._reconcile(conn)
+        finally:
+            db.release_db(conn)
+
+        for key, value in report.items():
+            self.counters[key] += value
+        self.passes += 1
+        self.last_run = time.time()
+        self.last_duration = time.monotonic() - start
+        self.last_report = report
+        return report
+
+    def _reconcile(self, conn):
+        by_node = db.list_env_statuses_by_node(conn)
+        known = {name for rows in by_node.values() for name in rows}
+        rows = by_node.pop(LOCAL_NODE, {})
+        dirs = _env_dirs()
+        cgroups = _env_cgroups()
+        real = manage_env.status_all(sorted(set(rows) | dirs))
+        report = dict.fromkeys(COUNTERS, 0)
+
+        self._fix_statuses(nodes.SCHEDULER.local, rows, real, report, conn, cgroups)
+        for node_name, node_rows in sorted(by_node.items()):
+            try:
+                node = nodes.SCHEDULER.get(node_name)
+                node_real = node.status_all(sorted(node_rows))
+            except nodes.NodeError as e:
+                print(f"Aviso: status do nó {node_name} não conferido: {e}")
+                report["nodes_unreachable"] += 1
+                continue
+            self._fix_statuses(node, node_rows, node_real, report, conn)
+
+        # Órfãos: existem no host mas não no banco (em nenhum nó)
+        for name in sorted(dirs - known):
+            self._remove_orphan_dir(name, real[name], report)
+        for name in sorted(cgroups - known - dirs):
+            self._remove_orphan_cgroup(name, report)
+        return report
+
+    def _fix_statuses(self, node, rows, real, report, conn, cgroups=()):
+        changes = {}
+        for name, status in rows.items():
+            if status in jobs.TRANSITIONAL or self._busy(name):
+                continue
+            actual = real.get(name, 'not_found')
+            if actual == 'not_found':
+                target = 'error'
+            else:
+                target = actual
+                if actual == 'stopped' and name in cgroups and self._kill_leftovers(name):
+                    report["leftover_killed"] += 1
+            if status == target or (status == 'error' and target == 'stopped'):
+                continue  # 'error' parado continua 'error' até alguém agir
+            changes[name] = target
+            report[f"marked_{target}"] += 1
+
+        if changes:
+            report["status_fixed"] += db.update_statuses(changes, conn, skip=jobs.TRANSITIONAL)
+            for name, target in changes.items():
+                if target != 'running':
+                    node.release(name)
+            pagecache.DASHBOARD.invalidate()
+
+    def _busy(self, name):
+        """Há um job deste processo mexendo no ambiente agora?"""
+        lock = jobs._env_lock(name)
+        if not lock.acquire(blocking=False):
+            return True
+        lock.release()
+        return False
+
+    def _kill_leftovers(self, name):
+        """Mata processos que ficaram no cgroup de um ambiente parado."""
+        cgroup = manage_env.env_cgroup(CGROUP_PREFIX + name)
+        try:
+            if not cgroup.populated():
+                return False
+            cgroup.kill()
+            return True
+        except CgroupError as e:
+            print(f"Aviso: não foi possível limpar o cgroup de {name}: {e}")
+            return False
+
+    def _remove_orphan_dir(self, name, status, report):
+        env_path = manage_env.ENVS_DIR / name
+        if status == 'running':
+            # Namespace vivo sem dono: só contar, derrubar é decisão de alguém
+            report["orphans_running"] += 1
+            return
+        if _age(env_path) < self.orphan_grace or self._busy(name):
+            return
+        print(f"Reconciliação: removendo diretório órfão {env_path}")
+        manage_env.destroy_env_at(env_path, CGROUP_PREFIX + name, env_path / "logs" / f"{name}.log")
+        report["orphan_dirs_removed"] += 1
+
+    def _remove_orphan_cgroup(self, name, report):
+        cgroup = manage_env.env_cgroup(CGROUP_PREFIX + name)
+        if _age(cgroup.path) < self.orphan_grace or self._busy(name):
+            return
+        try:
+            cgroup.destroy(manage_env.KILL_TIMEOUT)
+        except CgroupError as e:
+            print(f"Aviso ao remover cgroup órfão {name}: {e}")
+            return
+        report["orphan_cgroups_removed"] += 1
+
+    # ------------------------------------------------------------ leitura
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "passes": self.passes,
+            "skipped": self.skipped,
+            "last_run": self.last_run,
+            "last_pass_ms": round(self.last_duration * 1000, 2),
+            "last_report": self.last_report,
+            "counters": dict(self.counters),
+        }
+
+
+RECONCILER = Reconciler()
+
+
+if __name__ == '__main__':
+    once = "--once" in sys.argv[1:]
+    if once or RECONCILER.interval <= 0:
+        print(RECONCILER.run_locked())
+        sys.exit(0)
+    print(f"Reconciliando a cada {RECONCILER.interval:g} s")
+    RECONCILER._loop()
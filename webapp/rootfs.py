@@ -0,0 +1,116 @@
+# webapp/rootfs.py
+"""Raiz copy-on-write dos ambientes: imagem base + camada overlayfs.
+
+Uma imagem é uma árvore de diretórios somente leitura em IMAGES_DIR/<imagem>
+(ex.: saída do debootstrap ou de um "docker export"); ela precisa de bash e,
+para os jobs em background, python3. Cada ambiente ganha uma camada em disco
+local, LAYERS_DIR/<ambiente>/{upper,work,merged}: criar a camada é só criar
+três diretórios vazios, qualquer que seja o tamanho da imagem.
+
+O overlay é montado pelo init.sh dentro do namespace de montagem do ambiente
+(propagação privada, o host não o vê), que então faz pivot_root para ele. O
+diretório do ambiente continua visível no mesmo caminho (logs, socket do
+supervisor, jobs), mas o workspace passa a ser o /workspace da camada, fora
+da pasta sincronizada do Vagrant. A camada sobrevive a halt/resume e só é
+apagada no destroy.
+
+Sem CLOUDENV_IMAGE (e sem imagem pedida no create) nada disso é usado e o
+ambiente compartilha a raiz do host, como antes.
+"""
+import os
+import re
+from pathlib import Path
+
+IMAGES_DIR = Path(os.environ.get("CLOUDENV_IMAGES_DIR", "/var/lib/cloudenv/images"))
+LAYERS_DIR = Path(os.environ.get("CLOUDENV_LAYERS_DIR", "/var/lib/cloudenv/layers"))
+DEFAULT_IMAGE = os.environ.get("CLOUDENV_IMAGE", "")
+
+IMAGE_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,62}$")
+IMAGE_FILE = "image"    # <ambiente>/image guarda a imagem usada no create
+LOWERS_FILE = "layers"  # <ambiente>/layers: camadas de snapshot sob a camada própria (clone)
+
+
+class RootfsError(Exception):
+    pass
+
+
+def list_images():
+    try:
+        return sorted(d.name for d in IMAGES_DIR.iterdir() if d.is_dir() and IMAGE_RE.match(d.name))
+    except OSError:
+        return []
+
+
+def image_path(image):
+    """Diretório da imagem ``image``. Levanta RootfsError se não existir."""
+    if not IMAGE_RE.match(image or ""):
+        raise RootfsError(f"Nome de imagem inválido: {image!r}")
+    path = IMAGES_DIR / image
+    if not path.is_dir():
+        raise RootfsError(f"Imagem não encontrada: {image}")
+    return path
+
+
+def env_image(env_path):
+    """Imagem gravada no diretório do ambiente ('' se ele usa a raiz do host)."""
+    try:
+        return (Path(env_path) / IMAGE_FILE).read_text().strip()
+    except OSError:
+        return ""
+
+
+def env_lowers(env_path):
+    """Camadas de snapshot do ambiente, a de cima primeiro ([] se não for clone)."""
+    try:
+        text = (Path(env_path) / LOWERS_FILE).read_text()
+    except OSError:
+        return []
+    return [line for line in text.splitlines() if line.strip()]
+
+
+def layer_path(env_path, envs_dir):
+    """Camada do ambiente em ``env_path``, no mesmo caminho relativo a ENVS_DIR.
+
+    Slots do pool (ENVS_DIR/.pool/<slot>) ficam em LAYERS_DIR/.pool/<slot>.
+    """
+    return LAYERS_DIR / Path(env_path).relative_to(envs_dir)
+
+
+def init_script(image_dir, layer, env_path, extra_binds=(), lowers=()):
+    """Trecho do init.sh que monta o overlay e faz pivot_root para ele.
+
+    ``extra_binds`` são diretórios do host expostos somente leitura no mesmo
+    caminho (ex.: o diretório do supervisor.py). ``lowers`` são camadas de
+    snapshot (somente leitura) entre a camada do ambiente e a imagem.
+    """
+    merged = layer / "merged"
+    lowerdir = ":".join([str(path) for path in lowers] + [str(image_dir)])
+    lines = [
+        "# Raiz copy-on-write: imagem (somente leitura) + camada do ambiente em disco local",
+        f"mount -t overlay overlay -o lowerdir={lowerdir},upperdir={layer / 'upper'},workdir={layer / 'work'} {merged}",
+        f"mkdir -p {merged}/proc {merged}/dev {merged}/tmp {merged}/workspace {merged}/.oldroot {merged}{env_path}",
+        f"mount --rbind /dev {merged}/dev",
+        f"mount --bind {env_path} {merged}{env_path}",
+        f"mount --bind {merged}/workspace {merged}{env_path}/workspace",
+    ]
+    for path in extra_binds:
+        lines += [
+            f"mkdir -p {merged}{path}",
+            f"mount --bind {path} {merged}{path} && mount -o remount,bind,ro {merged}{path}",
+        ]
+    lines += [
+        f"cd {merged} && pivot_root . .oldroot",
+        "umount -l /.oldroot && rmdir /.oldroot",
+        f"cd {env_path}/workspace",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def rebind_script(old_env_path, new_env_path):
+    """Comando (via nsenter -m) que expõe o ambiente no caminho novo.
+
+    Usado quando um slot do pool vira ambiente: no host o diretório foi
+    renomeado, mas dentro do namespace o bind ainda está no caminho do slot.
+    """
+    return (f"mkdir -p {new_env_path} && mount --bind {old_env_path} {new_env_path} "
+            f"&& mount --bind /workspace {new_env_path}/workspace")
@@ -0,0 +1,186 @@
+# webapp/snapshots.py
+"""Snapshots de ambientes e clones a partir deles.
+
+Um snapshot guarda os limites do ambiente (cpu, mem, io) e o estado do
+sistema de arquivos, em SNAPSHOTS_DIR/<id>/:
+
+- ambiente com imagem (rootfs.py): cópia da camada "upper" do overlay
+  (reflink quando o disco suporta). O snapshot vira uma camada somente
+  leitura, então um clone é só um overlay novo com ela entre a camada própria
+  e a imagem: o tempo do clone não depende do tamanho dos dados;
+- ambiente na raiz do host: o workspace compactado (workspace.tar.gz), que o
+  clone extrai antes de iniciar.
+
+Durante a cópia o cgroup do ambiente fica congelado, para o snapshot ser
+consistente. Os metadados ficam em snapshot.json.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+
+import manage_env
+import rootfs
+from cgroups import CgroupError
+
+SNAPSHOTS_DIR = Path(os.environ.get("CLOUDENV_SNAPSHOTS_DIR", "/var/lib/cloudenv/snapshots"))
+
+SNAPSHOT_RE = re.compile(r"^[a-f0-9]{12}$")
+META_FILE = "snapshot.json"
+TARBALL = "workspace.tar.gz"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def new_id():
+    return uuid.uuid4().hex[:12]
+
+
+def _dir(snapshot_id):
+    if not SNAPSHOT_RE.match(snapshot_id or ""):
+        raise SnapshotError(f"Snapshot inválido: {snapshot_id!r}")
+    return SNAPSHOTS_DIR / snapshot_id
+
+
+def get(snapshot_id):
+    """Metadados do snapshot. Levanta SnapshotError se não existir."""
+    try:
+        with open(_dir(snapshot_id) / META_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise SnapshotError(f"Snapshot não encontrado: {snapshot_id}")
+
+
+def list_snapshots(env=None):
+    try:
+        ids = [d.name for d in SNAPSHOTS_DIR.iterdir() if SNAPSHOT_RE.match(d.name)]
+    except OSError:
+        return []
+    snapshots = []
+    for snapshot_id in ids:
+        try:
+            meta = get(snapshot_id)
+        except SnapshotError:
+            continue  # snapshot em criação ou quebrado
+        if env is None or meta["env"] == env:
+            snapshots.append(meta)
+    return sorted(snapshots, key=lambda m: m["created_at"], reverse=True)
+
+
+def _du(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def create(name, snapshot_id, cpu, mem, io):
+    """Tira o snapshot ``snapshot_id`` do ambiente ``name``. Retorna os metadados."""
+    env_path = manage_env.ENVS_DIR / name
+    if not env_path.exists():
+        raise SnapshotError("Ambiente não encontrado")
+    snap_dir = _dir(snapshot_id)
+    if not SNAPSHOTS_DIR.exists():
+        manage_env.priv_mkdir(SNAPSHOTS_DIR, owner=None)
+    if not manage_env.priv_mkdir(snap_dir, owner=None):
+        raise SnapshotError(f"Não foi possível criar {snap_dir}")
+
+    image = rootfs.env_image(env_path)
+    cgroup = manage_env.env_cgroup(f"cloudenv_{name}")
+    frozen = False
+    start = time.perf_counter()
+    try:
+        if manage_env.CGROUP_V2 and cgroup.exists():
+            cgroup.freeze(True)
+            frozen = True
+
+        if image:
+            # A camada copiada vai para cima das que o ambiente já herdou (clone de clone)
+            ok, error = manage_env.priv_copy(rootfs.layer_path(env_path, manage_env.ENVS_DIR) / "upper",
+                                             snap_dir / "layer")
+            layers = [str(snap_dir / "layer")] + rootfs.env_lowers(env_path)
+            kind = "layer"
+        else:
+            ok, error = manage_env.priv_archive(env_path / "workspace", snap_dir / TARBALL)
+            layers = []
+            kind = "tar"
+    except CgroupError as e:
+        ok, error = False, f"Não foi possível congelar o ambiente: {e}"
+    finally:
+        if frozen:
+            try:
+                cgroup.freeze(False)
+            except CgroupError as e:
+                print(f"Aviso: ambiente {name} não foi descongelado: {e}")
+
+    if not ok:
+        manage_env.priv_remove(snap_dir, recursive=True)
+        raise SnapshotError(f"Erro ao copiar o ambiente: {error}")
+
+    meta = {
+        "id": snapshot_id,
+        "env": name,
+        "kind": kind,
+        "image": image,
+        "layers": layers,
+        "cpu": cpu,
+        "mem": mem,
+        "io": io,
+        "bytes": _du(snap_dir),
+        "copy_ms": round((time.perf_counter() - start) * 1000, 1),
+        "created_at": time.time(),
+    }
+    # Gravado por último: sem snapshot.json o snapshot não aparece na lista
+    manage_env.priv_write(snap_dir / META_FILE, json.dumps(meta))
+    return meta
+
+
+def clone(snapshot_id, name, cpu, mem, io):
+    """Cria o ambiente ``name`` a partir do snapshot. Mesmo retorno do create_env."""
+    meta = get(snapshot_id)
+    if meta["kind"] == "layer":
+        # Só metadados: o overlay novo empilha as camadas do snapshot
+        return manage_env.create_env(name, cpu_percent=cpu, mem=mem, io=io,
+                                     image=meta["image"], lowers=meta["layers"])
+
+    workspace = manage_env.ENVS_DIR / name / "workspace"
+    for dir_path in (workspace.parent, workspace):
+        if not dir_path.exists():
+            manage_env.priv_mkdir(dir_path)
+    ok, error = manage_env.priv_extract(_dir(snapshot_id) / TARBALL, workspace)
+    if not ok:
+        return 1, "", f"Erro ao extrair o snapshot: {error}", ""
+    return manage_env.create_env(name, cpu_percent=cpu, mem=mem, io=io, image="")
+
+
+def in_use(snapshot_id):
+    """Ambientes e snapshots que ainda usam a camada deste snapshot."""
+    layer = str(_dir(snapshot_id) / "layer")
+    users = []
+    try:
+        env_paths = [d for d in manage_env.ENVS_DIR.iterdir() if d.is_dir()]
+    except OSError:
+        env_paths = []
+    for env_path in env_paths:
+        if layer in rootfs.env_lowers(env_path):
+            users.append(env_path.name)
+    for meta in list_snapshots():
+        if meta["id"] != snapshot_id and layer in meta["layers"]:
+            users.append(f"snapshot {meta['id']}")
+    return users
+
+
+def delete(snapshot_id):
+    get(snapshot_id)
+    users = in_use(snapshot_id)
+    if users:
+        raise SnapshotError(f"Snapshot em uso por: {', '.join(users)}")
+    manage_env.priv_remove(_dir(snapshot_id), recursive=True)
@@ -0,0 +1,365 @@
+# webapp/supervisor.py
+"""Supervisor dos jobs em background de um ambiente.
+
+Roda como PID 1 do namespace (o init.sh faz exec dele) e faz o handshake de
+prontidão depois de abrir o socket. Atende o Flask por um socket Unix em <ambiente>/supervisor.sock,
+com o mesmo protocolo JSON por linha do helper privilegiado:
+
+    {"op": "start", "command": "...", "restart": "never|on-failure|always"}
+    {"op": "list"} | {"op": "get", "id": 3} | {"op": "kill", "id": 3, "sig": 15}
+    {"op": "wait", "id": 3, "timeout": 10}
+
+Cada job roda na própria sessão (pgid = pid) com a saída em
+<ambiente>/jobs/<id>/output.log e o estado em <ambiente>/jobs/<id>/status.json.
+Como PID 1, o supervisor também recolhe órfãos, e quando o processo
+principal de um job termina o resto do grupo é morto.
+
+O diretório do ambiente é o cwd do supervisor e todos os caminhos são
+relativos a ele: um slot do pool é renomeado para <ENVS_DIR>/<nome> (e o
+log para <nome>.log) depois que o supervisor já está rodando, e o cwd
+acompanha o rename.
+
+Uso: python3 supervisor.py <diretório do ambiente> [FIFO de prontidão]
+"""
+import grp
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+
+SOCKET_GROUP = os.environ.get("CLOUDENV_HELPER_GROUP", "www-data")
+
+RESTART_POLICIES = ("never", "on-failure", "always")
+MAX_RESTARTS = 10
+RESTART_DELAY = 1.0       # primeira espera antes de reiniciar (dobra a cada vez)
+RESTART_DELAY_MAX = 30.0
+STOP_TIMEOUT = 2.0        # SIGTERM -> SIGKILL ao encerrar o ambiente
+
+
+class SupervisorError(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, job_id, command, restart, max_restarts, job_dir):
+        self.id = job_id
+        self.command = command
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.dir = job_dir
+        self.pid = None
+        self.state = "starting"  # running | restarting | exited | failed | killed
+        self.exit_code = None
+        self.restarts = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stop_requested = False
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "restart": self.restart,
+            "max_restarts": self.max_restarts,
+            "pid": self.pid,
+            "state": self.state,
+            "exit_code": self.exit_code,
+            "restarts": self.restarts,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "output": os.path.join(os.getcwd(), self.dir, "output.log"),
+        }
+
+
+class Supervisor:
+
+    jobs_dir = Path("jobs")
+    workdir = Path("workspace")
+
+    def __init__(self, env_path):
+        # Caminhos relativos ao cwd: continuam valendo depois do claim do pool
+        os.chdir(env_path)
+        self.jobs = {}
+        self._by_pid = {}
+        self._cond = threading.Condition()
+        self.jobs_dir.mkdir(exist_ok=True)
+        existing = [int(d.name) for d in self.jobs_dir.iterdir() if d.name.isdigit()]
+        self._next_id = max(existing, default=0) + 1
+
+    def _log_file(self):
+        # O nome do log muda no claim (<slot>.log -> <nome>.log)
+        return next(iter(Path("logs").glob("*.log")), None)
+
+    def _log(self, message):
+        log_file = self._log_file()
+        if log_file is None:
+            return
+        try:
+            with open(log_file, 'a') as f:
+                f.write(message)
+        except OSError:
+            pass
+
+    def _save(self, job):
+        tmp = job.dir / "status.json.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp, job.dir / "status.json")
+
+    # ---------------------------------------------------------- processos
+
+    def _spawn(self, job):
+        output = str(job.dir / "output.log")
+        pid = os.posix_spawnp(
+            "bash", ["bash", "-c", f"cd {self.workdir} && {job.command}"], os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_OPEN, 0, "/dev/null", os.O_RDONLY, 0),
+                (os.POSIX_SPAWN_OPEN, 1, output, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644),
+                (os.POSIX_SPAWN_DUP2, 1, 2),
+            ],
+            setsid=True,
+            setsigmask=(),  # o supervisor bloqueia sinais; o job não herda isso
+        )
+        job.pid = pid
+        job.state = "running"
+        job.exit_code = None
+        job.started_at = time.time()
+        self._by_pid[pid] = job
+        self._save(job)
+        self._log(f"[supervisor] job {job.id} iniciado (PID {pid}): {job.command}\n")
+
+    def start(self, command, restart="never", max_restarts=MAX_RESTARTS):
+        if restart not in RESTART_POLICIES:
+            raise SupervisorError(f"Política de restart inválida: {restart}")
+        with self._cond:
+            job_id = self._next_id
+            self._next_id += 1
+            job_dir = self.jobs_dir / str(job_id)
+            job_dir.mkdir()
+            job = Job(job_id, command, restart, int(max_restarts), job_dir)
+            self.jobs[job_id] = job
+            self._spawn(job)
+            return job
+
+    def _should_restart(self, job, code):
+        if job.stop_requested or job.restarts >= job.max_restarts:
+            return False
+        return job.restart == "always" or (job.restart == "on-failure" and code != 0)
+
+    def _restart(self, job):
+        with self._cond:
+            if job.state != "restarting" or job.stop_requested:
+                return
+            job.restarts += 1
+            self._spawn(job)
+            self._cond.notify_all()
+
+    def reaped(self, pid, status):
+        """Chamado pelo loop principal para cada filho recolhido."""
+        with self._cond:
+            job = self._by_pid.pop(pid, None)
+            if job is None:
+                return  # órfão herdado pelo PID 1
+            code = os.waitstatus_to_exitcode(status)
+            # Processos que sobraram no grupo do job não ficam órfãos
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+            job.pid = None
+            job.exit_code = code
+            job.finished_at = time.time()
+            if self._should_restart(job, code):
+                job.state = "restarting"
+                delay = min(RESTART_DELAY * 2 ** job.restarts, RESTART_DELAY_MAX)
+                timer = threading.Timer(delay, self._restart, args=(job,))
+                timer.daemon = True
+                timer.start()
+            elif job.stop_requested:
+                job.state = "killed"
+            else:
+                job.state = "exited" if code == 0 else "failed"
+            self._save(job)
+            self._log(f"[supervisor] job {job.id} terminou: código {code} ({job.state})\n")
+            self._cond.notify_all()
+
+    # -------------------------------------------------------------- API
+
+    def get(self, job_id):
+        job = self.jobs.get(int(job_id))
+        if job is None:
+            raise SupervisorError(f"Job {job_id} não encontrado")
+        return job
+
+    def kill(self, job_id, sig=signal.SIGTERM):
+        with self._cond:
+            job = self.get(job_id)
+            job.stop_requested = True
+            if job.pid is None:
+                if job.state == "restarting":
+                    job.state = "killed"
+                    self._save(job)
+                    self._cond.notify_all()
+                return job
+            os.killpg(job.pid, int(sig))
+            return job
+
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + float(timeout)
+        with self._cond:
+            job = self.get(job_id)
+            while job.state in ("starting", "running", "restarting"):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return job
+
+    def stop_all(self):
+        """SIGTERM em todos os grupos, SIGKILL no que sobrar (halt do ambiente)."""
+        with self._cond:
+            running = [j for j in self.jobs.values() if j.pid is not None]
+            for job in self.jobs.values():
+                job.stop_requested = True
+            for job in running:
+                try:
+                    os.killpg(job.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while time.monotonic() < deadline and any(j.pid is not None for j in running):
+            _reap_all(self)
+            time.sleep(0.05)
+        for job in running:
+            if job.pid is not None:
+                try:
+                    os.killpg(job.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+
+# ------------------------------------------------------------- socket
+
+def handle_request(supervisor, req):
+    """Executa uma requisição e monta a resposta (nunca levanta exceção)."""
+    try:
+        op = req.get("op")
+        if op == "ping":
+            resp = {"pid": os.getpid()}
+        elif op == "start":
+            job = supervisor.start(req["command"], req.get("restart", "never"),
+                                   req.get("max_restarts", MAX_RESTARTS))
+            resp = {"job": job.to_dict()}
+        elif op == "list":
+            with supervisor._cond:
+                resp = {"jobs": [j.to_dict() for j in supervisor.jobs.values()]}
+        elif op == "get":
+            resp = {"job": supervisor.get(req["id"]).to_dict()}
+        elif op == "kill":
+            resp = {"job": supervisor.kill(req["id"], req.get("sig", signal.SIGTERM)).to_dict()}
+        elif op == "wait":
+            resp = {"job": supervisor.wait(req["id"], req.get("timeout")).to_dict()}
+        else:
+            raise SupervisorError(f"Operação desconhecida: {op}")
+        resp["ok"] = True
+        return resp
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+class SupervisorHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+            except ValueError:
+                resp = {"ok": False, "error": "JSON inválido"}
+            else:
+                resp = handle_request(self.server.supervisor, req)
+            self.wfile.write(json.dumps(resp).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+
+class SupervisorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _reap_all(supervisor):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        supervisor.reaped(pid, status)
+
+
+def _signal_ready(ready_fifo):
+    # O_RDWR não bloqueia mesmo sem leitor (como o "1<>" do init.sh)
+    try:
+        fd = os.open(ready_fifo, os.O_RDWR)
+    except OSError:
+        return
+    try:
+        os.write(fd, b"ready\n")
+    finally:
+        os.close(fd)
+
+
+def main(env_path, ready_fifo=None):
+    # Sinais tratados de forma síncrona pelo loop principal (sigtimedwait);
+    # as threads do servidor herdam a máscara
+    signals = {signal.SIGCHLD, signal.SIGTERM, signal.SIGINT}
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # PID 1 de namespace só recebe sinais do host se tiver handler
+        signal.signal(sig, lambda *_: None)
+    signal.pthread_sigmask(signal.SIG_BLOCK, signals)
+
+    supervisor = Supervisor(env_path)
+    sock_path = "supervisor.sock"  # relativo ao cwd, o diretório do ambiente
+    try:
+        os.unlink(sock_path)
+    except FileNotFoundError:
+        pass
+    server = SupervisorServer(sock_path, SupervisorHandler)
+    server.supervisor = supervisor
+    try:
+        os.chown(sock_path, 0, grp.getgrnam(SOCKET_GROUP).gr_gid)
+    except (KeyError, PermissionError):
+        pass
+    os.chmod(sock_path, 0o660)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if ready_fifo:
+        _signal_ready(ready_fifo)
+
+    while True:
+        info = signal.sigtimedwait(signals, 5.0)
+        # Recolher sempre: SIGCHLD de vários filhos pode chegar como um só
+        _reap_all(supervisor)
+        if info is not None and info.si_signo in (signal.SIGTERM, signal.SIGINT):
+            break
+
+    supervisor.stop_all()
+    server.server_close()
+    try:
+        os.unlink(sock_path)
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Uso: python3 supervisor.py <diretório do ambiente> [FIFO de prontidão]")
+        sys.exit(1)
+    main(*sys.argv[1:])
+    sys.exit(0)
@@ -0,0 +1,226 @@
+# webapp/telemetry.py
+"""Telemetria de uso real dos ambientes a partir dos arquivos de stat do cgroup v2.
+
+Uma única thread amostra, a cada INTERVAL segundos, cpu.stat, memory.current,
+memory.events, io.stat e pids.current de todos os cgroups cloudenv_* e guarda
+as taxas (CPU %, MB/s) num ring buffer de tamanho fixo por ambiente.
+
+Para ficar barato com centenas de ambientes, os arquivos ficam abertos entre
+as amostras (os.pread no offset 0 relê o conteúdo atual) e o histórico é
+guardado em arrays de floats, sem um dict por amostra.
+"""
+import os
+import threading
+import time
+from array import array
+from pathlib import Path
+
+import manage_env
+
+INTERVAL = float(os.environ.get("CLOUDENV_TELEMETRY_INTERVAL", 5))
+HISTORY = int(os.environ.get("CLOUDENV_TELEMETRY_HISTORY", 120))
+
+CGROUP_PREFIX = "cloudenv_"
+POOL_PREFIX = "cloudenv_pool_"  # slots do pool ainda não são ambientes
+
+STAT_FILES = ("cpu.stat", "memory.current", "memory.events", "io.stat", "pids.current")
+
+# Campos de cada amostra, na ordem do ring buffer
+FIELDS = ("ts", "cpu_percent", "mem_mb", "read_mbps", "write_mbps", "pids", "oom_kills")
+
+MB = 1024 * 1024
+
+
+def _keyed(text, key):
+    """Valor de ``key`` em arquivos "chave valor" (cpu.stat, memory.events)."""
+    for line in text.splitlines():
+        k, _, v = line.partition(" ")
+        if k == key:
+            return int(v)
+    return 0
+
+
+def _io_bytes(text):
+    """Soma rbytes/wbytes de todos os dispositivos do io.stat."""
+    rbytes = wbytes = 0
+    for line in text.splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            if key == "rbytes":
+                rbytes += int(value)
+            elif key == "wbytes":
+                wbytes += int(value)
+    return rbytes, wbytes
+
+
+class Ring:
+    """Ring buffer de amostras com um array('d') por campo."""
+
+    def __init__(self, size=HISTORY):
+        self.size = size
+        self.count = 0
+        self.next = 0
+        self.columns = {f: array('d', bytes(8 * size)) for f in FIELDS}
+
+    def append(self, values):
+        for f in FIELDS:
+            self.columns[f][self.next] = values[f]
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _index(self, i):
+        # i=0 é a amostra mais antiga ainda guardada
+        return (self.next - self.count + i) % self.size
+
+    def latest(self):
+        if not self.count:
+            return None
+        j = (self.next - 1) % self.size
+        return {f: self.columns[f][j] for f in FIELDS}
+
+    def history(self, limit=None):
+        n = self.count if limit is None else min(limit, self.count)
+        start = self.count - n
+        return {f: [self.columns[f][self._index(i)] for i in range(start, self.count)] for f in FIELDS}
+
+
+class _EnvStats:
+    """Arquivos abertos e contadores da amostra anterior de um cgroup."""
+
+    def __init__(self, path):
+        self.fds = {}
+        for name in STAT_FILES:
+            try:
+                self.fds[name] = os.open(path / name, os.O_RDONLY | os.O_CLOEXEC)
+            except OSError:
+                pass  # controlador desligado neste cgroup
+        self.ring = Ring()
+        self.prev = None  # (monotonic, usage_usec, rbytes, wbytes)
+
+    def read(self, name):
+        fd = self.fds.get(name)
+        if fd is None:
+            return ""
+        return os.pread(fd, 64 * 1024, 0).decode('ascii', errors='replace')
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+
+class Collector:
+
+    def __init__(self, root=None, interval=INTERVAL):
+        self.root = Path(root) if root else None
+        self.interval = interval
+        self.samples = 0
+        self.last_duration = 0.0
+        self._envs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------ ciclo
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None or not manage_env.CGROUP_V2:
+            return
+        self._thread = threading.Thread(target=self._loop, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Erro na coleta de telemetria: {e}")
+            self.last_duration = time.monotonic() - start
+            self._stop.wait(max(self.interval - self.last_duration, 0))
+
+    # ----------------------------------------------------------- coleta
+
+    def _scan(self):
+        root = self.root or manage_env.CGROUP_BASE
+        try:
+            names = [e.name for e in os.scandir(root)
+                     if e.name.startswith(CGROUP_PREFIX) and not e.name.startswith(POOL_PREFIX) and e.is_dir()]
+        except OSError:
+            names = []
+        return root, names
+
+    def sample(self):
+        """Uma amostra de todos os ambientes."""
+        root, names = self._scan()
+        now, ts = time.monotonic(), time.time()
+
+        with self._lock:
+            # Ambientes removidos: fechar os arquivos
+            for gone in set(self._envs) - set(names):
+                self._envs.pop(gone).close()
+
+            for name in names:
+                env = self._envs.get(name)
+                if env is None:
+                    env = self._envs[name] = _EnvStats(root / name)
+                try:
+                    self._sample_env(env, now, ts)
+                except OSError:
+                    # cgroup removido (ex.: ENODEV) ou renomeado entre o scan e a leitura
+                    self._envs.pop(name).close()
+        self.samples += 1
+
+    def _sample_env(self, env, now, ts):
+        usage = _keyed(env.read("cpu.stat"), "usage_usec")
+        rbytes, wbytes = _io_bytes(env.read("io.stat"))
+        mem = env.read("memory.current").strip()
+        pids = env.read("pids.current").strip()
+
+        cpu_percent = read_mbps = write_mbps = 0.0
+        if env.prev is not None:
+            elapsed = now - env.prev[0]
+            if elapsed > 0:
+                cpu_percent = (usage - env.prev[1]) / (elapsed * 1e6) * 100
+                read_mbps = (rbytes - env.prev[2]) / elapsed / MB
+                write_mbps = (wbytes - env.prev[3]) / elapsed / MB
+        env.prev = (now, usage, rbytes, wbytes)
+
+        env.ring.append({
+            "ts": ts,
+            "cpu_percent": round(max(cpu_percent, 0.0), 2),
+            "mem_mb": round(int(mem) / MB, 2) if mem.isdigit() else 0.0,
+            "read_mbps": round(max(read_mbps, 0.0), 3),
+            "write_mbps": round(max(write_mbps, 0.0), 3),
+            "pids": int(pids) if pids.isdigit() else 0,
+            "oom_kills": _keyed(env.read("memory.events"), "oom_kill"),
+        })
+
+    # ------------------------------------------------------------ leitura
+
+    def latest(self):
+        """Última amostra de cada ambiente: {nome: {...}}."""
+        with self._lock:
+            return {name[len(CGROUP_PREFIX):]: env.ring.latest()
+                    for name, env in self._envs.items() if env.ring.count}
+
+    def history(self, name, limit=None):
+        """Histórico recente de um ambiente (colunas), ou None se não houver."""
+        with self._lock:
+            env = self._envs.get(CGROUP_PREFIX + name)
+            return env.ring.history(limit) if env else None
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "history": HISTORY,
+            "environments": len(self._envs),
+            "samples": self.samples,
+            "last_sample_ms": round(self.last_duration * 1000, 2),
+        }
+
+
+COLLECTOR = Collector()
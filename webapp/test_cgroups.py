@@ -0,0 +1,77 @@
+import os
+import tempfile
+from pathlib import Path
+
+from cgroups import EnvCgroup, CgroupError, device_for
+
+
+def write(path, content=""):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def check(label, ok):
+    print(f"{'✓' if ok else '✗'} {label}")
+    return ok
+
+
+try:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        # cgroupfs falso: raiz com cpu/io/memory disponíveis e só memory ligado
+        root = tmp / "cgroup"
+        write(root / "cgroup.controllers", "cpuset cpu io memory pids\n")
+        write(root / "cgroup.subtree_control", "memory\n")
+
+        cg = EnvCgroup("cloudenv_teste", root=root).create()
+        check("cgroup criado", cg.exists())
+        check("controladores ligados no pai", (root / "cgroup.subtree_control").read_text() == "+cpu +io +pids")
+
+        cg.set_cpu(150)
+        cg.set_memory(256)
+        cg.set_io("8:0", 10)
+        check("cpu.max", cg.read("cpu.max") == "150000 100000")
+        check("memory.max", cg.read("memory.max") == str(256 * 1024 * 1024))
+        check("memory.high", cg.read("memory.high") == str(int(256 * 1024 * 1024 * 0.9)))
+        check("io.max", cg.read("io.max") == f"8:0 rbps={10 * 1024 * 1024} wbps={10 * 1024 * 1024}")
+
+        # Teardown: cgroup.kill e espera por "populated 0"
+        write(cg.file("cgroup.procs"), "101\n102\n")
+        write(cg.file("cgroup.kill"))
+        write(cg.file("cgroup.events"), "populated 1\nfrozen 0\n")
+        check("procs", cg.procs() == [101, 102])
+        check("populated", cg.populated())
+        cg.kill()
+        check("cgroup.kill escrito", cg.read("cgroup.kill") == "1")
+        check("timeout com processos", not cg.wait_empty(0.05))
+        write(cg.file("cgroup.events"), "populated 0\nfrozen 0\n")
+        check("cgroup vazio", cg.wait_empty(0.05))
+
+        # Erros não são mais engolidos: rmdir de diretório não vazio falha
+        try:
+            cg.destroy(0.05)
+            check("erro no rmdir propagado", False)
+        except CgroupError:
+            check("erro no rmdir propagado", True)
+
+        empty = EnvCgroup("cloudenv_vazio", root=root).create()
+        empty.destroy(0.05)
+        check("cgroup vazio removido", not empty.exists())
+
+        # /sys/dev/block falso: partição sda1 (8:1) resolve para o disco sda (8:0)
+        sys_root = tmp / "sys"
+        disk = sys_root / "devices" / "pci0000:00" / "block" / "sda"
+        write(disk / "dev", "8:0\n")
+        write(disk / "sda1" / "dev", "8:1\n")
+        write(disk / "sda1" / "partition", "1\n")
+        (sys_root / "dev" / "block").mkdir(parents=True)
+        os.symlink(disk, sys_root / "dev" / "block" / "8:0")
+        os.symlink(disk / "sda1", sys_root / "dev" / "block" / "8:1")
+        check("partição -> disco", device_for(8, 1, sys_root / "dev" / "block") == "8:0")
+        check("disco inteiro", device_for(8, 0, sys_root / "dev" / "block") == "8:0")
+        check("sem dispositivo de bloco", device_for(0, 45, sys_root / "dev" / "block") is None)
+except Exception as e:
+    print(f"✗ Erro no teste de cgroups: {e}")
+    import traceback
+    traceback.print_exc()
@@ -1,9 +1,44 @@
+import mysql.connector
+
+import db
 from app import app
 from db import get_db
 
 try:
-    db = get_db()
+    conn = get_db()
     print("✓ Conexão com MySQL OK!")
-    db.close()
+    db.release_db(conn)
 except Exception as e:
     print(f"✗ Erro na conexão: {e}")
+
+# Conexão devolvida ao pool não pode carregar o snapshot de uma leitura antiga
+job_id = None
+try:
+    db.POOL_SIZE = 1  # uma conexão só: a segunda leitura pega a mesma
+    _, job_id = db.execute('insert_job', ("teste_snapshot", "create", "queued"))
+    before = db.fetch_one('get_job', (job_id,))['status']
+
+    # Fora do pool (no SQLite, get_db já abre uma conexão nova)
+    other = get_db() if db.SQLITE_PATH else mysql.connector.connect(**db.DB_CONFIG)
+    cur = other.cursor()
+    cur.execute("UPDATE jobs SET status=%s WHERE id=%s", ("done", job_id))
+    other.commit()
+    cur.close()
+    other.close()
+
+    after = db.fetch_one('get_job', (job_id,))['status']
+    ok = before == "queued" and after == "done"
+    print(f"{'✓' if ok else '✗'} Leitura pelo pool vê a escrita de outra conexão ({before} -> {after})")
+except Exception as e:
+    print(f"✗ Erro no teste de snapshot do pool: {e}")
+finally:
+    if job_id is not None:
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+            cur.execute("DELETE FROM jobs WHERE id=%s", (job_id,))
+            conn.commit()
+            cur.close()
+            db.release_db(conn)
+        except Exception:
+            pass
@@ -0,0 +1,60 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SUPERVISOR = Path(__file__).resolve().with_name("supervisor.py")
+
+
+def check(label, ok):
+    print(f"{'✓' if ok else '✗'} {label}")
+    return ok
+
+
+def call(sock_path, **req):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(10)
+        s.connect(str(sock_path))
+        s.sendall(json.dumps(req).encode() + b"\n")
+        return json.loads(s.makefile().readline())
+
+
+try:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        # Slot do pool como o envpool deixa: supervisor rodando em .pool/<slot>
+        slot = tmp / ".pool" / "123_0"
+        (slot / "workspace").mkdir(parents=True)
+        (slot / "logs").mkdir()
+        (slot / "logs" / "123_0.log").write_text("")
+        fifo = tmp / "ready"
+        os.mkfifo(fifo)
+        proc = subprocess.Popen([sys.executable, str(SUPERVISOR), str(slot), str(fifo)])
+        try:
+            with open(fifo) as f:
+                check("supervisor pronto", f.readline().strip() == "ready")
+
+            # O que o claim faz: renomear o diretório e o log para o nome do ambiente
+            env = tmp / "teste"
+            slot.rename(env)
+            (env / "logs" / "123_0.log").rename(env / "logs" / "teste.log")
+
+            job = call(env / "supervisor.sock", op="start", command="pwd; echo oi")
+            check("job iniciado depois do claim", job.get("ok"))
+            done = call(env / "supervisor.sock", op="wait", id=1, timeout=5)
+            check("job terminou", done.get("ok") and done["job"]["state"] == "exited")
+
+            output = env / "jobs" / "1" / "output.log"
+            lines = output.read_text().splitlines() if output.exists() else []
+            check("saída no diretório novo", lines == [str(env.resolve() / "workspace"), "oi"])
+            check("caminho da saída reportado", done.get("job", {}).get("output") == str(env.resolve() / "jobs" / "1" / "output.log"))
+            check("log do ambiente renomeado", "[supervisor] job 1 terminou" in (env / "logs" / "teste.log").read_text())
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+except Exception as e:
+    print(f"✗ Erro no teste do supervisor: {e}")
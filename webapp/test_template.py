@@ -2,8 +2,9 @@ from app import app
 from flask import render_template
 
 try:
-    with app.app_context():
-        result = render_template('index.html', envs=[])
+    with app.test_request_context('/'):
+        result = render_template('index.html', envs=[], total=0, page=1, pages=1,
+                                 per_page=50, status=None, statuses=('running',))
         print("✓ Template OK!")
 except Exception as e:
     print(f"✗ Erro no template: {e}")
@@ -0,0 +1,329 @@
+# webapp/tracing.py
+"""Tracing por requisição, métricas no formato do Prometheus e profiling.
+
+- ``span(nome)`` mede um trecho: subprocesso (cmd:*), chamada ao helper
+  (helper:*), query (db:*), RPC a um nó remoto (node:*), fase do ciclo de
+  vida (phase:*, wait:*). Cada span é uma observação no histograma
+  ``cloudenv_span_seconds`` e, se a thread tem um trace aberto, soma no
+  trace da requisição ou do job.
+- O app abre um trace por requisição e os jobs um por job; ao fechar, os
+  spans são agregados pela rota (ou ação) em ``routes()``. Spans se aninham
+  (helper:run dentro de phase:start), então a soma passa do total.
+- ``count()`` incrementa contadores (subprocessos, chamadas ao helper,
+  queries) e ``render()`` gera o texto de /metrics.
+
+Com CLOUDENV_TRACING=0 ``span`` devolve um objeto vazio que não mede nada e
+``count`` retorna de imediato: sobra o custo de uma chamada de função.
+
+Profiling com cProfile por requisição (?profile=1 ou o cabeçalho
+X-Cloudenv-Profile: 1), só com CLOUDENV_PROFILING=1. Os últimos
+PROFILE_KEEP resultados ficam em memória (/stats/profiles).
+"""
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+ENABLED = os.environ.get("CLOUDENV_TRACING", "1") != "0"
+PROFILING = os.environ.get("CLOUDENV_PROFILING", "0") == "1"
+PROFILE_KEEP = 20
+PROFILE_LINES = 40
+
+# Limites superiores dos buckets dos histogramas, em segundos
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS = {
+    "cloudenv_request_seconds": ("histogram", "Duração das requisições HTTP, por rota"),
+    "cloudenv_job_seconds": ("histogram", "Duração dos jobs de ciclo de vida, por ação"),
+    "cloudenv_span_seconds": ("histogram", "Duração dos spans (subprocessos, helper, banco, fases)"),
+    "cloudenv_subprocess_spawns_total": ("counter", "Processos criados pelo app ou pelo helper, por programa"),
+    "cloudenv_helper_calls_total": ("counter", "Chamadas ao helper privilegiado, por operação"),
+    "cloudenv_db_queries_total": ("counter", "Queries ao banco, por consulta"),
+    "cloudenv_node_calls_total": ("counter", "Chamadas RPC aos agentes dos nós remotos, por nó"),
+}
+
+
+def program(argv):
+    """Nome curto do programa de um comando (sudo X conta como X)."""
+    if isinstance(argv, (str, bytes)):
+        argv = str(argv).split()
+    argv = [str(a) for a in argv]
+    if argv and argv[0] == "sudo" and len(argv) > 1:
+        argv = argv[1:]
+    return os.path.basename(argv[0]) if argv else "?"
+
+
+class Registry:
+    """Contadores e histogramas com rótulos, exportados no formato texto."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}    # (métrica, rótulos) -> valor
+        self._histograms = {}  # (métrica, rótulos) -> [por bucket..., +Inf, soma]
+        self._lock = threading.Lock()
+
+    def inc(self, metric, labels=(), value=1):
+        key = (metric, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric, labels, seconds):
+        key = (metric, labels)
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            hist[index] += 1
+            hist[-1] += seconds
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(hist)) for key, hist in self._histograms.items())
+
+        lines = []
+        seen = set()
+
+        def header(metric):
+            if metric not in seen:
+                seen.add(metric)
+                kind, text = METRICS.get(metric, ("untyped", ""))
+                lines.append(f"# HELP {metric} {text}")
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for (metric, labels), value in counters:
+            header(metric)
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (metric, labels), hist in histograms:
+            header(metric)
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), hist):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {hist[-1]:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+
+# ------------------------------------------------------------ spans
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoSpan()
+
+
+def span(name):
+    """Context manager que mede o trecho como o span ``name``."""
+    if not ENABLED:
+        return _NOOP
+    return _Span(name)
+
+
+def traced(name):
+    """Decorator: cada chamada da função é um span ``name``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    """Registra um span já medido."""
+    REGISTRY.observe("cloudenv_span_seconds", (("span", name),), seconds)
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def count(metric, label, value):
+    if ENABLED:
+        REGISTRY.inc(metric, ((label, value),))
+
+
+def count_spawn(argv):
+    if ENABLED:
+        REGISTRY.inc("cloudenv_subprocess_spawns_total", (("program", program(argv)),))
+
+
+# ----------------------------------------------------------- traces
+
+class Trace:
+    """Spans de uma requisição ou job, somados por nome."""
+
+    __slots__ = ("name", "start", "spans")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = {}  # nome -> [chamadas, segundos]
+
+    def add(self, name, seconds):
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+class RouteStats:
+    """Totais por rota (ou ação de job) de todos os traces fechados."""
+
+    def __init__(self):
+        self._routes = {}  # nome -> [traces, segundos, {span: [chamadas, segundos]}]
+        self._lock = threading.Lock()
+
+    def add(self, trace, elapsed):
+        with self._lock:
+            route = self._routes.get(trace.name)
+            if route is None:
+                route = self._routes[trace.name] = [0, 0.0, {}]
+            route[0] += 1
+            route[1] += elapsed
+            for name, (calls, seconds) in trace.spans.items():
+                entry = route[2].setdefault(name, [0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            routes = {name: (n, total, {s: list(v) for s, v in spans.items()})
+                      for name, (n, total, spans) in self._routes.items()}
+        result = {}
+        for name, (n, total, spans) in sorted(routes.items()):
+            result[name] = {
+                "count": n,
+                "mean_ms": round(total / n * 1000, 2),
+                "spans": {
+                    span_name: {
+                        "calls_per_trace": round(calls / n, 2),
+                        "ms_per_trace": round(seconds / n * 1000, 2),
+                        "share": round(seconds / total, 3) if total else None,
+                    }
+                    for span_name, (calls, seconds) in sorted(spans.items(), key=lambda kv: -kv[1][1])
+                },
+            }
+        return result
+
+
+ROUTES = RouteStats()
+
+
+def begin(name):
+    """Abre o trace da thread atual. Retorna o trace (None se desligado)."""
+    if not ENABLED:
+        return None
+    trace = _local.trace = Trace(name)
+    return trace
+
+
+def finish(trace, metric, labels):
+    """Fecha o trace e registra a duração total em ``metric``."""
+    if trace is None:
+        return
+    if getattr(_local, "trace", None) is trace:
+        _local.trace = None
+    elapsed = time.perf_counter() - trace.start
+    REGISTRY.observe(metric, labels, elapsed)
+    ROUTES.add(trace, elapsed)
+
+
+def routes():
+    return ROUTES.snapshot()
+
+
+def render():
+    return REGISTRY.render()
+
+
+# -------------------------------------------------------- profiling
+
+_profiles = deque(maxlen=PROFILE_KEEP)
+_profile_ids = itertools.count(1)
+
+
+def start_profile():
+    """Liga o cProfile nesta thread. None se desligado ou já houver outro ativo."""
+    if not PROFILING:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None  # outro profiler ativo no processo (Python 3.12+)
+    return profiler
+
+
+def stop_profile(profiler, name):
+    """Desliga o profiler e guarda o relatório. Retorna o id do profile."""
+    profiler.disable()
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+    profile_id = next(_profile_ids)
+    _profiles.append({
+        "id": profile_id,
+        "name": name,
+        "created_at": time.time(),
+        "total_ms": round(stats.total_tt * 1000, 2),
+        "report": out.getvalue(),
+    })
+    return profile_id
+
+
+def profiles():
+    return [{k: v for k, v in p.items() if k != "report"} for p in reversed(_profiles)]
+
+
+def get_profile(profile_id):
+    for p in _profiles:
+        if p["id"] == profile_id:
+            return p
+    return None